@@ -0,0 +1,443 @@
+"""Benchmark of the execution hot path against a running sshd.
+
+Measure login time, empty-cell latency, per-cell overhead with a large
+environment, output throughput, completion latency and fanout scaling,
+and store the results as JSON to compare them across commits.
+
+Start a local sshd first, e.g. by misc/sshd-local.sh, and add the printed
+Host blocks to ~/.ssh/config. The throughput of `process_output` itself is
+measured locally, without the host.
+
+The compression benchmark runs text-heavy output with and without SSH
+compression through a local proxy limited to `--bandwidth` MB/s,
+reached by `--shaped-host` (default sshkernel-bench-shaped), whose port
+the proxy listens on.
+
+Usage:
+    python benchmarks/bench_exec.py [--host sshkernel-bench] [--output FILE]
+    python benchmarks/bench_exec.py --only process_output
+    python benchmarks/bench_exec.py --compare BEFORE.json AFTER.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from sshkernel.kernel import SSHKernel
+from sshkernel.ssh_wrapper_async import SSHWrapperAsync
+from sshkernel.ssh_wrapper_plumbum import load_ssh_config_for_plumbum
+from sshkernel.ssh_wrapper_plumbum import process_output
+
+MODES = ["oneshot", "persistent", "async"]
+LINE = "x" * 99 + "\n"
+MB = 1024 * 1024
+
+
+def new_kernel(mode):
+    if mode == "async":
+        kernel = SSHKernel(sshwrapper_class=SSHWrapperAsync)
+    else:
+        kernel = SSHKernel()
+
+    kernel.Print = kernel.Error = kernel.Write = kernel.WriteError = noop
+
+    return kernel
+
+
+def noop(*args, **kwargs):
+    pass
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard messages printed by the wrappers."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def login(kernel, host, mode):
+    with quiet():
+        kernel.do_login(host, persistent=mode == "persistent")
+
+
+def run_cell(kernel, code):
+    with quiet():
+        result = kernel.do_execute_direct(code)
+        if asyncio.iscoroutine(result):
+            result = asyncio.run(result)
+
+    if result is not None:
+        raise RuntimeError("cell failed: {} {}".format(code, result.evalue))
+
+
+def measure(function, repeat):
+    """
+    Returns:
+        list: seconds of each call
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+
+    return samples
+
+
+def latency(samples):
+    return dict(
+        value=statistics.median(samples) * 1000,
+        unit="ms",
+        p90=sorted(samples)[int(0.9 * (len(samples) - 1))] * 1000,
+        n=len(samples),
+    )
+
+
+def rate(amount, seconds, unit):
+    return dict(value=amount / seconds, unit=unit)
+
+
+# benchmarks
+def bench_login(args):
+    results = dict()
+    for mode in MODES:
+
+        def once():
+            kernel = new_kernel(mode)
+            login(kernel, args.host, mode)
+            with quiet():
+                kernel.restart_kernel()
+
+        results["login_" + mode] = latency(measure(once, args.repeat))
+
+    return results
+
+
+def bench_empty_cell(args):
+    results = dict()
+    for mode in MODES:
+        kernel = new_kernel(mode)
+        login(kernel, args.host, mode)
+        run_cell(kernel, ":")
+
+        samples = measure(lambda: run_cell(kernel, ":"), args.repeat * 5)
+        results["empty_cell_" + mode] = latency(samples)
+        with quiet():
+            kernel.restart_kernel()
+
+    return results
+
+
+def bench_large_env(args):
+    """Cells with `--env-vars` variables of 100 bytes exported."""
+    export = (
+        "for i in $(seq {}); do export SSHKERNEL_BENCH_$i=$(printf '%0100d' $i); done"
+    ).format(args.env_vars)
+
+    results = dict()
+    for mode in MODES:
+        kernel = new_kernel(mode)
+        login(kernel, args.host, mode)
+        run_cell(kernel, export)
+        run_cell(kernel, ":")
+
+        # An unchanged environment is not transferred
+        samples = measure(lambda: run_cell(kernel, ":"), args.repeat * 5)
+        results["large_env_cell_" + mode] = latency(samples)
+
+        samples = measure(
+            lambda: run_cell(kernel, "export SSHKERNEL_BENCH_1=$RANDOM"), args.repeat
+        )
+        results["large_env_changed_" + mode] = latency(samples)
+        with quiet():
+            kernel.restart_kernel()
+
+    return results
+
+
+def bench_output(args):
+    """Output of `--output-mb` MB in lines of 100 bytes through the kernel."""
+    size = int(args.output_mb * MB)
+    lines = size // len(LINE)
+    code = "head -c {} /dev/zero | tr '\\0' x | fold -w {}".format(
+        lines * (len(LINE) - 1), len(LINE) - 1
+    )
+
+    results = dict()
+    for mode in MODES:
+        kernel = new_kernel(mode)
+        login(kernel, args.host, mode)
+
+        elapsed = min(measure(lambda: run_cell(kernel, code), args.repeat))
+        results["output_" + mode] = rate(size / MB, elapsed, "MB/s")
+        results["output_lines_" + mode] = rate(lines, elapsed, "lines/s")
+        with quiet():
+            kernel.restart_kernel()
+
+    return results
+
+
+def bench_process_output(args):
+    """`process_output` alone, on chunks read from a channel."""
+    size = int(args.output_mb * MB)
+    text = LINE * (size // len(LINE))
+    chunks = []
+    for start in range(0, len(text), 32768):
+        end = start + 32768
+        chunks.append((text[start:end], None))
+    chunks.append(("MARKER\0code\x000\0pwd\0/tmp\0MARKER\n", None))
+
+    elapsed = min(
+        measure(lambda: process_output(iter(chunks), "MARKER", noop, noop), args.repeat)
+    )
+
+    return dict(
+        process_output=rate(len(text) / MB, elapsed, "MB/s"),
+        process_output_lines=rate(text.count("\n"), elapsed, "lines/s"),
+    )
+
+
+def bench_completion(args):
+    kernel = new_kernel("oneshot")
+    login(kernel, args.host, "oneshot")
+    # Wait for the prefetch at login
+    time.sleep(1.0)
+
+    def cold():
+        kernel.completion_cache.invalidate()
+        kernel.complete("ech", 3)
+
+    results = dict(
+        completion_cold=latency(measure(cold, args.repeat)),
+        completion_warm=latency(
+            measure(lambda: kernel.complete("ech", 3), args.repeat * 5)
+        ),
+    )
+    with quiet():
+        kernel.restart_kernel()
+
+    return results
+
+
+def bench_fanout(args):
+    kernel = new_kernel("oneshot")
+
+    results = dict()
+    n = 1
+    while n <= args.fanout:
+        with quiet():
+            elapsed = min(
+                measure(lambda: kernel.do_fanout([args.host] * n, "true"), args.repeat)
+            )
+        results["fanout_{}".format(n)] = dict(value=elapsed * 1000, unit="ms")
+        n *= 2
+
+    return results
+
+
+class ShapedProxy:
+    """A TCP proxy limiting each direction to `rate` bytes per second."""
+
+    def __init__(self, port, target, rate):
+        self.target = target
+        self.rate = rate
+
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", port))
+        self._server.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+
+            upstream = socket.create_connection(self.target)
+            for src, dst in ((client, upstream), (upstream, client)):
+                threading.Thread(
+                    target=self._pump, args=(src, dst), daemon=True
+                ).start()
+
+    def _pump(self, src, dst):
+        try:
+            while True:
+                data = src.recv(16384)
+                if not data:
+                    break
+                dst.sendall(data)
+                time.sleep(len(data) / self.rate)
+        except OSError:
+            pass
+        finally:
+            src.close()
+            dst.close()
+
+
+def resolve(host):
+    hostname, plumbum_kwargs, *_ = load_ssh_config_for_plumbum("~/.ssh/config", host)
+    return hostname, plumbum_kwargs["port"] or 22
+
+
+def bench_compression(args):
+    """Log-like output of `--shaped-mb` MB through the shaped link."""
+    lines = int(args.shaped_mb * MB) // 80
+    code = (
+        "awk 'BEGIN {{ for (i = 0; i < {}; i++) printf "
+        '"2024-05-01T12:%02d:%02d INFO worker-%02d '
+        'request id=%08d latency=%03dms status=ok\\n", '
+        "i / 60 % 60, i % 60, i % 16, i, i * 7919 % 1000 }}'"
+    ).format(lines)
+
+    proxy = ShapedProxy(
+        resolve(args.shaped_host)[1], resolve(args.host), args.bandwidth * MB
+    )
+    results = dict()
+    try:
+        for compression in ("no", "yes"):
+            kernel = new_kernel("oneshot")
+            kernel.set_param("SSHKERNEL_COMPRESSION", compression)
+            login(kernel, args.shaped_host, "oneshot")
+
+            elapsed = min(measure(lambda: run_cell(kernel, code), args.repeat))
+            results["shaped_output_compression_" + compression] = rate(
+                lines * 80 / MB, elapsed, "MB/s"
+            )
+            with quiet():
+                kernel.restart_kernel()
+    finally:
+        proxy.close()
+
+    return results
+
+
+BENCHMARKS = dict(
+    login=bench_login,
+    empty_cell=bench_empty_cell,
+    large_env=bench_large_env,
+    output=bench_output,
+    process_output=bench_process_output,
+    completion=bench_completion,
+    fanout=bench_fanout,
+    compression=bench_compression,
+)
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path, threshold):
+    """Print the change of each metric, and flag regressions.
+
+    Returns:
+        int: number of regressions
+    """
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(
+        "{:<28} {:>14} {:>14} {:>8}  ({} -> {})".format(
+            "metric", "before", "after", "change", before["commit"], after["commit"]
+        )
+    )
+
+    regressions = 0
+    for name, result in after["results"].items():
+        if name not in before["results"]:
+            continue
+
+        old, new = before["results"][name]["value"], result["value"]
+        change = (new - old) / old * 100 if old else 0.0
+        # Rates are better higher, times are better lower
+        worse = -change if result["unit"].endswith("/s") else change
+
+        flag = ""
+        if worse > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+
+        print(
+            "{:<28} {:>14.3f} {:>14.3f} {:>+7.1f}%  {:<8} {}".format(
+                name, old, new, change, result["unit"], flag
+            )
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="sshkernel-bench")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--env-vars", type=int, default=1000)
+    parser.add_argument("--output-mb", type=float, default=20.0)
+    parser.add_argument("--fanout", type=int, default=16, help="max hosts")
+    parser.add_argument("--shaped-host", default="sshkernel-bench-shaped")
+    parser.add_argument(
+        "--bandwidth", type=float, default=2.0, help="MB/s of the shaped link"
+    )
+    parser.add_argument("--shaped-mb", type=float, default=5.0)
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS), help="repeatable"
+    )
+    parser.add_argument("--output", help="file to store the results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="percent to flag a regression"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    results = dict()
+    for name in args.only or BENCHMARKS:
+        for metric, result in BENCHMARKS[name](args).items():
+            results[metric] = result
+            print(
+                "{:<28} {:>14.3f} {}".format(metric, result["value"], result["unit"]),
+                flush=True,
+            )
+
+    report = dict(
+        commit=git_commit(),
+        created=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        host=args.host,
+        python=platform.python_version(),
+        args=vars(args),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
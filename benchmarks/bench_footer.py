@@ -0,0 +1,116 @@
+"""Micro-benchmark of the footer protocol.
+
+Compare parsing of the NUL-separated footer by `FooterParser` with the
+former YAML footer (`cat -v <(env -0)` + `yaml.safe_load`).
+
+Usage:
+    python benchmarks/bench_footer.py [--repeat N]
+
+Requires PyYAML for the former path.
+"""
+import argparse
+import timeit
+
+import yaml
+
+from sshkernel.ssh_wrapper_plumbum import process_output
+
+MARKER = "2760441.0453301751"
+SIZES = [("1KB", 1024), ("100KB", 100 * 1024), ("1MB", 1024 * 1024)]
+
+
+def make_env(size):
+    env = dict()
+    total = 0
+    i = 0
+    while total < size:
+        key, value = "VAR_{:06d}".format(i), "value{:06d}".format(i) * 8
+        env[key] = value
+        total += len(key) + len(value) + 2
+        i += 1
+
+    return env
+
+
+def former_stream(env):
+    """Lines emitted by the former footer"""
+    dump = "".join("{}={}^@".format(k, v) for k, v in env.items())
+    return [
+        "output\n",
+        "{m}code: 0{m}\n".format(m=MARKER),
+        "{m}pwd: /tmp{m}\n".format(m=MARKER),
+        "{m}env: {dump}{m}\n".format(m=MARKER, dump=dump),
+    ]
+
+
+def former_parse(lines):
+    """The former `process_output` and `post_exec_command`/`update_env`"""
+    env_out = ""
+    for line in lines:
+        if line.endswith(MARKER + "\n"):
+            env_out += line.replace(MARKER, "").rstrip()
+            env_out += "\n"
+
+    footer = yaml.safe_load(env_out)
+    env = dict([kv.split("=", 1) for kv in footer["env"].split("^@") if kv])
+
+    return footer["code"], footer["pwd"], env
+
+
+def current_stream(env, chunk_size=32768):
+    """Chunks emitted by the current footer"""
+    dump = "".join("{}={}\0".format(k, v) for k, v in env.items())
+    text = "output\n{m}\0code\x000\0pwd\0/tmp\0sum\x001 2\0env\0{dump}{m}\n".format(
+        m=MARKER, dump=dump
+    )
+
+    chunks = []
+    for start in range(0, len(text), chunk_size):
+        end = start + chunk_size
+        chunks.append(text[start:end])
+
+    return chunks
+
+
+def current_parse(chunks):
+    footer = process_output(((c, None) for c in chunks), MARKER, lambda s: None)
+
+    return footer["code"], footer["pwd"], footer["env"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:>6} {:>12} {:>12} {:>8}".format("env", "yaml [ms]", "nul [ms]", "speedup"))
+
+    for name, size in SIZES:
+        env = make_env(size)
+        former, current = former_stream(env), current_stream(env)
+        assert former_parse(former) == current_parse(current) == (0, "/tmp", env)
+
+        number = max(1, 100 * 1024 // size)
+        t_former = min(
+            timeit.repeat(
+                lambda: former_parse(former), number=number, repeat=args.repeat
+            )
+        )
+        t_current = min(
+            timeit.repeat(
+                lambda: current_parse(current), number=number, repeat=args.repeat
+            )
+        )
+
+        print(
+            "{:>6} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+                name,
+                t_former / number * 1000,
+                t_current / number * 1000,
+                t_former / t_current,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Micro-benchmark of ssh_config lookups.
+
+Compare parsing ~/.ssh/config on every lookup (the former
+`load_ssh_config_for_plumbum`) with the cached config and its lookup index,
+on a generated config with many Host blocks.
+
+Usage:
+    python benchmarks/bench_ssh_config.py [--hosts N] [--lookups N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import paramiko
+
+from sshkernel.ssh_config import load_ssh_config
+
+
+def make_config(hosts):
+    blocks = []
+    for i in range(hosts):
+        blocks.append(
+            "Host node{0:05d}\n    HostName 10.{1}.{2}.{3}\n    User user{0}\n".format(
+                i, i // 65536, i // 256 % 256, i % 256
+            )
+        )
+    blocks.append("Host *\n    IdentityFile ~/.ssh/id_rsa\n")
+
+    return "\n".join(blocks)
+
+
+def former_lookup(path, host):
+    conf = paramiko.SSHConfig()
+    with open(path) as ssh_config:
+        conf.parse(ssh_config)
+
+    return conf.lookup(host)
+
+
+def current_lookup(path, host):
+    return load_ssh_config(path).lookup(host)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hosts", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "config")
+        with open(path, "w") as f:
+            f.write(make_config(args.hosts))
+
+        hosts = [
+            "node{:05d}".format(random.randrange(args.hosts))
+            for _ in range(args.lookups)
+        ]
+        for host in hosts[:10]:
+            assert former_lookup(path, host) == current_lookup(path, host)
+
+        print("{:>10} {:>14} {:>10}".format("path", "lookup [ms]", "speedup"))
+        results = []
+        for name, lookup in [("parse", former_lookup), ("cached", current_lookup)]:
+            started = time.perf_counter()
+            for host in hosts:
+                lookup(path, host)
+            results.append((time.perf_counter() - started) / len(hosts) * 1000)
+
+            print(
+                "{:>10} {:>14.3f} {:>9.1f}x".format(
+                    name, results[-1], results[0] / results[-1]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Micro-benchmark of `{NAME}` parameter expansion.
+
+Compare the former `expand_parameters` (`re.sub` with a lambda on each call)
+with the compiled templates of `sshkernel.template`, for notebooks with
+hundreds of parameters, and show the bytes of the remote environment saved
+by `SSHKERNEL_PARAM_EXPORT no`.
+
+Usage:
+    python benchmarks/bench_template.py [--repeat N]
+"""
+import argparse
+import re
+import timeit
+
+from sshkernel.template import render
+
+PARAMS = [100, 500, 1000]
+# Placeholders per cell
+PLACEHOLDERS = [1, 20, 200]
+
+
+def make_params(count):
+    return {
+        "PARAM_{:04d}".format(i): "/data/run{:04d}/input.csv".format(i)
+        for i in range(count)
+    }
+
+
+def make_cell(params, placeholders):
+    # No shell braces, which the former path takes for parameters
+    names = list(params)
+    lines = ["set -e"]
+    for i in range(placeholders):
+        lines.append("wc -l {%s}" % names[i * 7 % len(names)])
+
+    return "\n".join(lines) + "\n"
+
+
+def former_expand(text, params):
+    """The former `expand_parameters`"""
+    pattern = r"\{(.*?)\}"
+
+    def repl(match):
+        param_name = match.group(1)
+        return params[param_name]
+
+    return re.sub(pattern, repl, text)
+
+
+def env_size(params):
+    """Bytes of the parameters in `env -0`, sent when the environment changes"""
+    return sum(len(k) + len(v) + 2 for k, v in params.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        "{:>6} {:>6} {:>12} {:>12} {:>8} {:>10}".format(
+            "params", "cell", "re.sub [us]", "render [us]", "speedup", "env [B]"
+        )
+    )
+
+    for count in PARAMS:
+        params = make_params(count)
+        for placeholders in PLACEHOLDERS:
+            cell = make_cell(params, placeholders)
+            assert former_expand(cell, params) == render(cell, params, strict=True)
+
+            number = 2000
+            t_former = min(
+                timeit.repeat(
+                    lambda: former_expand(cell, params),
+                    number=number,
+                    repeat=args.repeat,
+                )
+            )
+            t_current = min(
+                timeit.repeat(
+                    lambda: render(cell, params), number=number, repeat=args.repeat
+                )
+            )
+
+            print(
+                "{:>6} {:>6} {:>12.2f} {:>12.2f} {:>7.1f}x {:>10}".format(
+                    count,
+                    placeholders,
+                    t_former / number * 1e6,
+                    t_current / number * 1e6,
+                    t_former / t_current,
+                    env_size(params),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/bin/bash -e
+
+#
+# Launch sshd at $USER@127.0.0.1:$PORT (default 2222) without docker,
+# e.g. for benchmarks/bench_exec.py
+#
+# Usage: PORT=2222 DIR=/tmp/sshkernel-sshd misc/sshd-local.sh
+# Stop:  kill $(cat /tmp/sshkernel-sshd/sshd.pid)
+#
+
+PORT=${PORT:-2222}
+DIR=${DIR:-/tmp/sshkernel-sshd}
+USER=${USER:-$(id -un)}
+HERE=$(cd "$(dirname "$0")" && pwd)
+# sshd must be started with an absolute path
+SSHD=${SSHD:-$(command -v sshd || echo /usr/sbin/sshd)}
+
+mkdir -p "$DIR"
+[ -f "$DIR/ssh_host_ed25519_key" ] || ssh-keygen -q -t ed25519 -N "" -f "$DIR/ssh_host_ed25519_key"
+
+# ssh refuses a private key readable by others
+install -m 600 "$HERE/id_rsa" "$DIR/id_rsa"
+install -m 600 "$HERE/id_rsa.pub" "$DIR/authorized_keys"
+
+# MaxStartups and MaxSessions are raised for fanout and side channels
+cat > "$DIR/sshd_config" <<EOF
+Port $PORT
+ListenAddress 127.0.0.1
+HostKey $DIR/ssh_host_ed25519_key
+PidFile $DIR/sshd.pid
+AuthorizedKeysFile $DIR/authorized_keys
+PasswordAuthentication no
+KbdInteractiveAuthentication no
+StrictModes no
+UsePAM no
+MaxStartups 100
+MaxSessions 100
+EOF
+
+[ -f "$DIR/sshd.pid" ] && kill "$(cat "$DIR/sshd.pid")" 2>/dev/null && sleep 0.5
+"$SSHD" -f "$DIR/sshd_config" -E "$DIR/sshd.log"
+
+cat <<EOF
+sshd started at $USER@127.0.0.1:$PORT (log: $DIR/sshd.log)
+Add to ~/.ssh/config:
+
+Host sshkernel-bench
+    HostName 127.0.0.1
+    Port $PORT
+    User $USER
+    IdentityFile $DIR/id_rsa
+    StrictHostKeyChecking no
+    UserKnownHostsFile /dev/null
+
+# The bandwidth-shaped proxy of the compression benchmark
+Host sshkernel-bench-shaped
+    HostName 127.0.0.1
+    Port $((PORT + 1))
+    User $USER
+    IdentityFile $DIR/id_rsa
+    StrictHostKeyChecking no
+    UserKnownHostsFile /dev/null
+EOF
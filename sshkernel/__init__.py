@@ -1,5 +1,14 @@
 """A ssh kernel for Jupyter"""
 
 from .kernel import ExceptionWrapper
-from .kernel import SSHException
 from .version import __version__
+
+
+def __getattr__(name):
+    # paramiko is imported on the first login, not at startup
+    if name == "SSHException":
+        from paramiko.ssh_exception import SSHException
+
+        return SSHException
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
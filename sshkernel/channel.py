@@ -0,0 +1,134 @@
+import asyncio
+import codecs
+import select
+
+BUFSIZE = 32768
+
+
+def iter_channel(channel, timeout=1.0, reader=None, final=True):
+    """Read raw chunks from a paramiko channel until EOF.
+
+    Chunks are forwarded as soon as they arrive, without waiting for a newline,
+    and decoded incrementally so that a multibyte character may be split.
+
+    Args:
+        channel: paramiko.Channel
+        timeout (float): seconds to wait for data in one select() call
+        reader (ChannelReader): reader of the channel, to count bytes received
+        final (bool): decode incomplete characters at EOF, or leave them in `reader`
+
+    Returns:
+        iterator: yields tuple (string, string), either one of two string is None
+    """
+    reader = reader or ChannelReader(channel)
+
+    while True:
+        chunks = reader.read_ready()
+        if chunks is None:
+            break
+
+        yield from chunks
+        if not chunks:
+            select.select([channel], [], [], timeout)
+
+    if final:
+        yield from reader.finish()
+
+
+async def aiter_channel(channel, timeout=1.0, reader=None):
+    """Same as `iter_channel`, but waits for data in the running asyncio loop.
+
+    Returns:
+        async iterator: yields tuple (string, string), either one of two string is None
+    """
+    reader = reader or ChannelReader(channel)
+
+    while True:
+        chunks = reader.read_ready()
+        if chunks is None:
+            break
+
+        for chunk in chunks:
+            yield chunk
+        if not chunks:
+            await wait_readable(channel, timeout)
+
+    for chunk in reader.finish():
+        yield chunk
+
+
+async def wait_readable(channel, timeout):
+    """Wait until the channel may have data, or `timeout` seconds."""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    fd = channel.fileno()
+
+    loop.add_reader(fd, ready.set)
+    try:
+        await asyncio.wait_for(ready.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(fd)
+
+
+class ChannelReader:
+    """
+    Read and decode the ready data of a channel, without blocking.
+
+    Attributes:
+    * .received : dict, bytes received per stream
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.received = dict(stdout=0, stderr=0)
+        self.stdout_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.stderr_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def read_ready(self):
+        """
+        Returns:
+            list: chunks read, empty if nothing is ready. None at EOF.
+        """
+        channel = self.channel
+        progressed = False
+        chunks = []
+
+        if channel.recv_stderr_ready():
+            progressed = True
+            data = channel.recv_stderr(BUFSIZE)
+            self.received["stderr"] += len(data)
+            text = self.stderr_decoder.decode(data)
+            if text:
+                chunks.append((None, text))
+
+        if channel.recv_ready():
+            progressed = True
+            data = channel.recv(BUFSIZE)
+            self.received["stdout"] += len(data)
+            text = self.stdout_decoder.decode(data)
+            if text:
+                chunks.append((text, None))
+
+        if not progressed and (channel.eof_received or channel.closed):
+            return None
+
+        return chunks
+
+    def finish(self):
+        """
+        Returns:
+            list: the rest of incomplete characters
+        """
+        chunks = []
+
+        text = self.stderr_decoder.decode(b"", final=True)
+        if text:
+            chunks.append((None, text))
+
+        text = self.stdout_decoder.decode(b"", final=True)
+        if text:
+            chunks.append((text, None))
+
+        return chunks
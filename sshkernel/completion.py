@@ -0,0 +1,75 @@
+import time
+
+
+class CompletionCache:
+    """
+    Cache of remote completion candidates.
+
+    Candidates are cached by (kind, prefix) in a context, e.g. (cwd, env).
+    A lookup for a narrower prefix is served by filtering the candidates of
+    a cached broader prefix, unless the rest of the prefix contains "/"
+    (then it is completed in another directory).
+    Entries expire after `ttl` seconds, and are dropped when the context changes.
+
+    Usage:
+        matches = cache.get("command", "ls", context)
+        if matches is None:
+            matches = cache.put("command", "ls", context, run_compgen("ls"))
+    """
+
+    def __init__(self, ttl=60.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self._context = None
+        self._entries = dict()  # (kind, prefix) => (expires_at, candidates)
+
+    def get(self, kind, prefix, context):
+        """
+        Returns:
+            list: sorted candidates starting with `prefix`, or None if not cached
+        """
+        if context != self._context:
+            self.misses += 1
+            return None
+
+        now = self.clock()
+        for i in range(len(prefix), -1, -1):
+            broader = prefix[:i]
+            if "/" in prefix[i:]:
+                break
+
+            entry = self._entries.get((kind, broader))
+            if entry is None:
+                continue
+
+            expires_at, candidates = entry
+            if expires_at < now:
+                del self._entries[(kind, broader)]
+                continue
+
+            self.hits += 1
+            return sorted(c for c in candidates if c.startswith(prefix))
+
+        self.misses += 1
+        return None
+
+    def put(self, kind, prefix, context, candidates):
+        """
+        Returns:
+            list: sorted candidates starting with `prefix`
+        """
+        if context != self._context:
+            self.invalidate()
+            self._context = context
+
+        candidates = frozenset(c for c in candidates if c.startswith(prefix))
+        self._entries[(kind, prefix)] = (self.clock() + self.ttl, candidates)
+
+        return sorted(candidates)
+
+    def invalidate(self):
+        self._context = None
+        self._entries = dict()
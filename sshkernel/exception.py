@@ -6,3 +6,15 @@ class Error(Exception):
 
 class SSHKernelNotConnectedException(Error):
     pass
+
+
+class SSHKernelQueryError(Error):
+    pass
+
+
+class SSHKernelQueryTimeout(SSHKernelQueryError):
+    pass
+
+
+class SSHKernelTransferError(Error):
+    pass
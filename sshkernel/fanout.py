@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+# code is None if the host failed before the cell finished, with the reason in error
+FanoutResult = namedtuple("FanoutResult", ["host", "code", "error", "elapsed"])
+
+
+class LinePrefixer:
+    """Prefix each line of a stream, holding a partial line until it is completed."""
+
+    def __init__(self, prefix, write_function):
+        self.prefix = prefix
+        self.write_function = write_function
+        self._partial = ""
+
+    def write(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+
+        if lines:
+            self.write_function(
+                "".join("{}{}\n".format(self.prefix, line) for line in lines)
+            )
+
+    def flush(self):
+        if self._partial:
+            self.write_function("{}{}\n".format(self.prefix, self._partial))
+            self._partial = ""
+
+
+class Fanout:
+    """
+    Execute a cell on many hosts concurrently, a connection per host.
+
+    Output of workers is queued and written by the calling thread,
+    with each line prefixed by "[host] ".
+
+    Usage:
+        fanout = Fanout(lambda: SSHWrapperPlumbum(env), concurrency=16)
+        results = fanout.run(["host1", "host2"], "uptime", print, print)
+    """
+
+    def __init__(self, wrapper_factory, concurrency=16):
+        self.wrapper_factory = wrapper_factory
+        self.concurrency = concurrency
+
+        self._events = queue.Queue()
+        self._wrappers = dict()
+        self._lock = threading.Lock()
+
+    def run(self, hosts, cmd, write_function, error_function):
+        """
+        Returns:
+            list: FanoutResult in the order of `hosts`
+
+        Raises:
+            KeyboardInterrupt: After interrupting the running cells
+        """
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        futures = [executor.submit(self._run_host, host, cmd) for host in hosts]
+
+        try:
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=0.05)
+                self._dispatch(write_function, error_function)
+        except KeyboardInterrupt:
+            # Hosts not started yet are skipped
+            for future in futures:
+                future.cancel()
+            self.interrupt()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            self._dispatch(write_function, error_function)
+
+        return [future.result() for future in futures]
+
+    def interrupt(self):
+        with self._lock:
+            wrappers = list(self._wrappers.values())
+
+        for wrapper in wrappers:
+            wrapper.interrupt()
+
+    # private methods
+    def _run_host(self, host, cmd):
+        prefix = "[{}] ".format(host)
+        out = LinePrefixer(prefix, lambda text: self._events.put((False, text)))
+        err = LinePrefixer(prefix, lambda text: self._events.put((True, text)))
+
+        started = time.monotonic()
+        wrapper = self.wrapper_factory()
+        code, error = None, None
+        try:
+            wrapper.connect(host)
+            with self._lock:
+                self._wrappers[host] = wrapper
+
+            code = wrapper.exec_command(cmd, out.write, err.write)
+        except Exception as exc:
+            error = "{}: {}".format(type(exc).__name__, exc)
+        finally:
+            out.flush()
+            err.flush()
+
+            with self._lock:
+                self._wrappers.pop(host, None)
+            try:
+                wrapper.close()
+            except Exception:
+                pass
+
+        return FanoutResult(host, code, error, time.monotonic() - started)
+
+    def _dispatch(self, write_function, error_function):
+        while True:
+            try:
+                is_error, text = self._events.get_nowait()
+            except queue.Empty:
+                return
+
+            if is_error:
+                error_function(text)
+            else:
+                write_function(text)
+
+
+def parse_hosts(spec):
+    """Split a comma-separated host list, dropping blanks and duplicates.
+
+    Example:
+        "a, b,,a" => ["a", "b"]
+    """
+    hosts = []
+    for host in spec.split(","):
+        host = host.strip()
+        if host and host not in hosts:
+            hosts.append(host)
+
+    return hosts
+
+
+def format_summary(results):
+    """
+    Returns:
+        str: table of host, exit code and elapsed seconds
+    """
+    rows = [("host", "time", "exit")]
+    for result in results:
+        status = str(result.code) if result.error is None else result.error
+        rows.append((result.host, "{:.1f}s".format(result.elapsed), status))
+
+    width = max(len(row[0]) for row in rows)
+
+    return "\n".join(
+        "{}  {:>7}  {}".format(host.ljust(width), elapsed, status)
+        for host, elapsed, status in rows
+    )
@@ -0,0 +1,125 @@
+class FooterParser:
+    """
+    A streaming parser of the footer appended to every command.
+
+    The footer is a sequence of NUL-terminated records between two markers:
+
+        MARKER\\0code\\0<int>\\0pwd\\0<path>\\0...[env\\0K=V\\0...]MARKER\\n
+
+    Values are transferred verbatim, so they may contain any character but NUL.
+    `env` is always the last record, and it is followed by `K=V` variables,
+    e.g. the output of `env -0`, or only the ones changed by the command.
+
+    Usage:
+        parser = FooterParser(marker)
+        for chunk in stdout:
+            print(parser.feed(chunk), end="")
+        print(parser.flush(), end="")
+        records = parser.records()
+    """
+
+    def __init__(self, marker):
+        self.start = marker + "\0"
+        self.end = marker + "\n"
+        self.in_footer = False
+        self.done = False
+
+        self._head = ""  # a possible prefix of the start marker
+        self._body = []
+        self._body_size = 0
+
+    def feed(self, text):
+        """Feed a chunk of stdout.
+
+        Returns:
+            string: normal output in the chunk, which is not a part of the footer
+        """
+        if self.done:
+            return text
+
+        out = ""
+        if not self.in_footer:
+            text = self._head + text
+            self._head = ""
+
+            i = text.find(self.start)
+            if i < 0:
+                keep = partial_suffix_length(text, self.start)
+                if keep:
+                    self._head = text[-keep:]
+                    return text[:-keep]
+                return text
+
+            self.in_footer = True
+            body_start = i + len(self.start)
+            out, text = text[:i], text[body_start:]
+
+        # The end marker may be split across chunks
+        search_from = max(0, self._body_size - len(self.end) + 1)
+        self._body.append(text)
+        self._body_size += len(text)
+
+        if self.end[-1] not in text:
+            return out
+
+        body = "".join(self._body)
+        j = body.find(self.end, search_from)
+        if j < 0:
+            self._body = [body]
+            return out
+
+        self.done = True
+        self._body = [body[:j]]
+        rest = j + len(self.end)
+
+        return out + body[rest:]
+
+    def flush(self):
+        """Return output held back as a possible prefix of the marker."""
+        head, self._head = self._head, ""
+
+        return head
+
+    def records(self):
+        """Parse the footer.
+
+        Returns:
+            dict: {"code": int, "pwd": str, "env": dict, other records: str}
+                `env` is contained only if it is transferred.
+                None if the footer is not complete.
+        """
+        if not self.done:
+            return None
+
+        tokens = "".join(self._body).split("\0")
+        records = dict()
+
+        i = 0
+        while i + 1 < len(tokens):
+            key = tokens[i]
+            if key == "env":
+                values = i + 1
+                records["env"] = dict(
+                    kv.split("=", 1) for kv in tokens[values:] if "=" in kv
+                )
+                break
+
+            records[key] = tokens[i + 1]
+            i += 2
+
+        if "code" in records:
+            try:
+                records["code"] = int(records["code"])
+            except ValueError:
+                del records["code"]
+
+        return records
+
+
+def partial_suffix_length(text, token):
+    """Length of the longest suffix of `text` which is a proper prefix of `token`."""
+    for k in range(min(len(token) - 1, len(text)), 0, -1):
+        if text.endswith(token[:k]):
+            return k
+
+    return 0
@@ -0,0 +1,93 @@
+import time
+
+# Seconds between checks whether the targets are still alive
+TICK = 0.1
+
+SIGNALS = ("TERM", "KILL")
+
+# Seconds to wait before SIGTERM, and before SIGKILL
+DEFAULT_TIMEOUTS = (2.0, 5.0)
+
+
+def escalation_script(interrupt, send_signal, alive, timeouts=DEFAULT_TIMEOUTS):
+    """
+    Build a POSIX sh script which sends SIGINT, then SIGTERM and SIGKILL to
+    the targets still alive after each timeout. It prints the last signal sent.
+
+    Args:
+        interrupt (str): command to send SIGINT
+        send_signal (str): command to send a signal, "{sig}" is replaced with its name
+        alive (str): command which succeeds while any target is alive
+        timeouts (tuple): seconds to wait before SIGTERM, and before SIGKILL
+
+    Returns:
+        str: script
+    """
+    steps = []
+    for sig, timeout in zip(SIGNALS, timeouts):
+        steps.append(
+            """
+__sshkernel_n={ticks}
+while {alive} && [ $__sshkernel_n -gt 0 ]; do
+    sleep {tick}
+    __sshkernel_n=$((__sshkernel_n - 1))
+done
+if {alive}; then
+    {send}
+    __sshkernel_sig={sig}
+fi""".format(
+                ticks=int(round(timeout / TICK)),
+                tick=TICK,
+                alive=alive,
+                send=send_signal.format(sig=sig),
+                sig=sig,
+            )
+        )
+
+    return "{}\n__sshkernel_sig=INT{}\necho $__sshkernel_sig\n".format(
+        interrupt, "".join(steps)
+    )
+
+
+def group_escalation_script(pgid, timeouts=DEFAULT_TIMEOUTS):
+    """Signal the process group `pgid`."""
+    # Killed processes orphaned to an init which reaps lazily stay as zombies,
+    # and still count for `kill -s 0`
+    alive = (
+        "kill -s 0 -- -{0} 2>/dev/null && "
+        "ps -A -o pgid= -o stat= | awk '$1 == {0} && $2 !~ /^Z/ {{ found = 1 }} "
+        "END {{ exit !found }}'"
+    ).format(pgid)
+
+    # The POSIX form, dash does not take "--" after "-SIG"
+    return escalation_script(
+        "kill -s INT -- -{} 2>/dev/null".format(pgid),
+        "kill -s {{sig}} -- -{} 2>/dev/null".format(pgid),
+        alive,
+        timeouts,
+    )
+
+
+def signal_remote(transport, script):
+    """
+    Run an escalation script on a new channel, and wait for it.
+
+    Returns:
+        dict: {"signal": the last signal sent, "elapsed": seconds to terminate}
+    """
+    started = time.monotonic()
+
+    channel = transport.open_session()
+    try:
+        channel.exec_command(script)
+        channel.recv_exit_status()
+
+        out = b""
+        while channel.recv_ready():
+            out += channel.recv(1024)
+    finally:
+        channel.close()
+
+    sig = out.decode("utf-8", errors="replace").strip() or "INT"
+
+    return dict(signal=sig, elapsed=time.monotonic() - started)
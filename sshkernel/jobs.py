@@ -0,0 +1,221 @@
+"""
+Background jobs of `%%bg`, detached from the session.
+
+A job is started by nohup and setsid on the remote host, so that it survives
+the loss of the channel and of the connection. Its files are kept in
+~/.sshkernel/jobs/ID:
+
+    cmd      the cell
+    out      stdout and stderr of the cell
+    pid      process id of the job
+    started  start time, seconds since the epoch
+    exit     exit code, written when the job has finished
+
+`%attach` follows "out" from a byte offset, so that output already received
+is not sent again after an interrupt or a reconnect.
+"""
+
+import time
+import uuid
+from collections import namedtuple
+
+from .channel import ChannelReader
+from .channel import iter_channel
+from .transfer import format_bytes
+
+JOBS_DIR = '"$HOME"/.sshkernel/jobs'
+
+# Seconds between checks of the log of a running job
+POLL_INTERVAL = 0.5
+
+JobStatus = namedtuple("JobStatus", ["id", "state", "size", "started", "command"])
+
+LAUNCH_SCRIPT = """\
+d={jobs}/{id}
+mkdir -p "$d" || exit
+cat > "$d/cmd" <<'{marker}'
+{cell}
+{marker}
+date +%s > "$d/started"
+: > "$d/out"
+setsid=
+command -v setsid >/dev/null && setsid=setsid
+nohup $setsid bash -c 'bash "$1/cmd" > "$1/out" 2>&1; echo $? > "$1/exit.tmp"; \
+mv "$1/exit.tmp" "$1/exit"' sshkernel-job "$d" </dev/null >/dev/null 2>&1 &
+echo $! > "$d/pid"
+echo {id} $!
+"""
+
+# Prints the log from `off`, and the state to stderr:
+# "exit N" when finished, "running" without `follow`, or "missing"
+FOLLOW_SCRIPT = """\
+d={jobs}/{id}
+if [ ! -f "$d/out" ]; then echo missing >&2; exit 1; fi
+off={offset}
+while :; do
+    if [ -f "$d/exit" ]; then finished=1; else finished=0; fi
+    size=$(($(wc -c < "$d/out")))
+    if [ "$size" -gt "$off" ]; then
+        tail -c +$((off + 1)) "$d/out" 2>/dev/null | head -c $((size - off))
+        off=$size
+    fi
+    if [ $finished = 1 ]; then echo "exit $(cat "$d/exit")" >&2; exit 0; fi
+    if [ {follow} = 0 ]; then echo running >&2; exit 0; fi
+    sleep {interval}
+done
+"""
+
+LIST_SCRIPT = """\
+for d in {jobs}/*; do
+    [ -f "$d/out" ] || continue
+    if [ -f "$d/exit" ]; then
+        state="exit $(cat "$d/exit")"
+    elif kill -0 "$(cat "$d/pid" 2>/dev/null)" 2>/dev/null; then
+        state=running
+    else
+        state=lost
+    fi
+    printf '%s\\t%s\\t%s\\t%s\\t%s\\n' "${{d##*/}}" "$state" \
+"$(($(wc -c < "$d/out")))" "$(cat "$d/started")" "$(head -n 1 "$d/cmd")"
+    if [ {clean} = 1 ] && [ "$state" != running ]; then rm -rf "$d"; fi
+done
+"""
+
+
+def new_job_id():
+    return uuid.uuid4().hex[:8]
+
+
+def launch_script(job_id, cell):
+    """
+    Script to start `cell` as job `job_id`, printing "ID PID".
+    It is run by a query, in the cwd and environment of the session.
+    """
+    marker = "SSHKERNEL_JOB_{}".format(uuid.uuid4().hex)
+
+    return LAUNCH_SCRIPT.format(
+        jobs=JOBS_DIR, id=job_id, marker=marker, cell=cell.rstrip("\n")
+    )
+
+
+def follow_script(job_id, offset=0, follow=True, interval=POLL_INTERVAL):
+    return FOLLOW_SCRIPT.format(
+        jobs=JOBS_DIR,
+        id=job_id,
+        offset=int(offset),
+        follow=int(follow),
+        interval=interval,
+    )
+
+
+def list_script(clean=False):
+    """Script to print a JobStatus per line, and remove finished jobs if `clean`."""
+    return LIST_SCRIPT.format(jobs=JOBS_DIR, clean=int(clean))
+
+
+def parse_jobs(lines):
+    """
+    Returns:
+        list: JobStatus, oldest first
+    """
+    jobs = []
+    for line in lines:
+        fields = line.split("\t", 4)
+        if len(fields) != 5:
+            continue
+
+        job_id, state, size, started, command = fields
+        try:
+            jobs.append(JobStatus(job_id, state, int(size), int(started), command))
+        except ValueError:
+            continue
+
+    return sorted(jobs, key=lambda job: (job.started, job.id))
+
+
+def follow(channel, job_id, offsets, write_function, follow=True):
+    """
+    Stream the log of a job from `offsets[job_id]` on a new session channel,
+    until the job finishes or, without `follow`, to the end of the log.
+
+    `offsets[job_id]` is updated with the bytes written, also on interrupt.
+
+    Returns:
+        int: exit code of the job, or None if running
+
+    Raises:
+        KeyError: If no such job
+    """
+    start = offsets.get(job_id, 0)
+    channel.exec_command("sh")
+    channel.sendall(follow_script(job_id, start, follow).encode("utf-8"))
+
+    reader = ChannelReader(channel)
+    state = ""
+    try:
+        for out, err in iter_channel(channel, reader=reader, final=False):
+            if out is not None:
+                write_function(out)
+            if err is not None:
+                state += err
+    finally:
+        # Bytes of an incomplete character are received again next time
+        pending = len(reader.stdout_decoder.getstate()[0])
+        offsets[job_id] = start + reader.received["stdout"] - pending
+        channel.close()
+
+    state = state.strip()
+    if state == "missing":
+        raise KeyError(job_id)
+    if not state.startswith("exit "):
+        return None
+
+    # The log is complete
+    for out, _ in reader.finish():
+        if out is not None:
+            write_function(out)
+            offsets[job_id] += pending
+
+    return int(state.split()[1])
+
+
+def format_jobs(jobs, offsets, now=None):
+    """
+    Table of jobs, with bytes not received by `%attach` yet.
+
+    Example:
+        ID        STATE       OUTPUT    UNREAD  STARTED  COMMAND
+        3f2a91bc  running     1.2 MB  800.0 KB  5m ago   make -j8
+    """
+    if not jobs:
+        return "[ssh] No jobs."
+
+    now = time.time() if now is None else now
+    line = "{:<8}  {:<8} {:>9} {:>9}  {:<8} {}"
+
+    lines = [line.format("ID", "STATE", "OUTPUT", "UNREAD", "STARTED", "COMMAND")]
+    for job in jobs:
+        lines.append(
+            line.format(
+                job.id,
+                job.state,
+                format_bytes(job.size),
+                format_bytes(max(job.size - offsets.get(job.id, 0), 0)),
+                format_age(now - job.started),
+                job.command,
+            )
+        )
+
+    return "\n".join(lines)
+
+
+def format_age(seconds):
+    seconds = max(int(seconds), 0)
+    if seconds < 60:
+        return "{}s ago".format(seconds)
+    if seconds < 3600:
+        return "{}m ago".format(seconds // 60)
+    if seconds < 86400:
+        return "{}h ago".format(seconds // 3600)
+
+    return "{}d ago".format(seconds // 86400)
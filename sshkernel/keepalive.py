@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+logger = logging.getLogger("SSHKernel")
+
+# Same request as ServerAliveInterval of OpenSSH. Servers reply even if unsupported.
+KEEPALIVE_REQUEST = "keepalive@openssh.com"
+
+# TrafficCounter of each transport, dropped with the transport
+_traffic_counters = weakref.WeakKeyDictionary()
+
+
+class RollingHistogram:
+    """Distribution of the last `size` samples."""
+
+    def __init__(self, size=256):
+        self._samples = deque(maxlen=size)
+
+    def add(self, value):
+        self._samples.append(value)
+
+    def percentile(self, p):
+        """
+        Args:
+            p (float): 0 to 100
+
+        Returns:
+            float: nearest-rank percentile, or None if empty
+        """
+        if not self._samples:
+            return None
+
+        ordered = sorted(self._samples)
+        rank = max(1, -(-len(ordered) * p // 100))
+
+        return ordered[int(rank) - 1]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class TrafficCounter:
+    """
+    Count bytes on the wire of a paramiko.Transport, including encryption overhead.
+
+    The packetizer's own counters are reset on every rekey, so its reads and
+    writes are wrapped instead. Bytes before installing are not counted.
+    Use `traffic_counter()` to install one counter per transport.
+    """
+
+    def __init__(self, transport):
+        self.sent = 0
+        self.received = 0
+
+        packetizer = transport.packetizer
+        write_all, read_all = packetizer.write_all, packetizer.read_all
+
+        def counting_write_all(out):
+            write_all(out)
+            self.sent += len(out)
+
+        def counting_read_all(n, check_rekey=False):
+            data = read_all(n, check_rekey)
+            self.received += len(data)
+            return data
+
+        packetizer.write_all = counting_write_all
+        packetizer.read_all = counting_read_all
+
+
+def traffic_counter(transport):
+    """
+    Returns:
+        TrafficCounter of `transport`, installed by the first call
+    """
+    counter = _traffic_counters.get(transport)
+    if counter is None:
+        counter = _traffic_counters[transport] = TrafficCounter(transport)
+
+    return counter
+
+
+class Keepalive:
+    """
+    Probe a paramiko.Transport every `interval` seconds in a background thread,
+    and keep the round trip times.
+
+    A probe waits for the reply of a global request.
+    When `count_max` intervals pass without a reply, the transport is closed
+    like ServerAliveCountMax of OpenSSH, so that a cell blocked on a dead
+    connection fails and the next one reconnects.
+
+    Attributes:
+    * .rtt : RollingHistogram of round trip times [sec]
+    * .traffic : TrafficCounter
+    * .last_success : time of the last reply by `clock`, or None
+    * .probes, .failures : counters
+    """
+
+    def __init__(
+        self, transport, interval=30.0, count_max=3, size=256, clock=time.monotonic
+    ):
+        self.transport = transport
+        self.interval = interval
+        self.count_max = count_max
+        self.clock = clock
+
+        self.rtt = RollingHistogram(size)
+        self.traffic = traffic_counter(transport)
+        self.last_success = None
+        self.probes = 0
+        self.failures = 0
+
+        self._missed = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._probe_thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def probe(self):
+        """
+        Send a probe and wait for the reply.
+
+        Returns:
+            float: round trip time [sec], or None if the transport is closed
+        """
+        started = self.clock()
+        self.probes += 1
+        self.transport.global_request(KEEPALIVE_REQUEST, wait=True)
+
+        if not self.transport.is_active():
+            self.failures += 1
+            return None
+
+        now = self.clock()
+        self.rtt.add(now - started)
+        self.last_success = now
+        self._missed = 0
+
+        return now - started
+
+    def since_last_success(self):
+        """
+        Returns:
+            float: seconds since the last reply, or None if never replied
+        """
+        if self.last_success is None:
+            return None
+
+        return self.clock() - self.last_success
+
+    # private methods
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.transport.is_active():
+                return
+
+            if self._probe_thread and self._probe_thread.is_alive():
+                self._missed += 1
+                if self._missed >= self.count_max:
+                    logger.warning(
+                        "no keepalive reply in %d intervals, closing the transport",
+                        self._missed,
+                    )
+                    self.failures += 1
+                    self.transport.close()
+                    return
+                continue
+
+            # global_request() has no timeout, so the probe may block
+            self._probe_thread = threading.Thread(target=self.probe, daemon=True)
+            self._probe_thread.start()
@@ -1,20 +1,74 @@
+import asyncio
+import errno
+import inspect
+import json
+import os
+import posixpath
 import re
+import shlex
+import signal
 import sys
 import textwrap
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from logging import INFO
 
 from metakernel import ExceptionWrapper
 from metakernel import MetaKernel
 
-from paramiko.ssh_exception import SSHException
-
+from .completion import CompletionCache
 from .exception import SSHKernelNotConnectedException
-from .ssh_wrapper_plumbum import SSHWrapperPlumbum
+from .exception import SSHKernelQueryError
+from .fanout import Fanout
+from .jobs import follow
+from .jobs import launch_script
+from .jobs import list_script
+from .jobs import new_job_id
+from .jobs import parse_jobs
+from .keepalive import Keepalive
+from .output import OutputBuffer
+from .session import DEFAULT_SESSION
+from .session import SessionRegistry
+from .spool import SpoolRegistry
+from .template import render
+from .timing import CellTimer
+from .timing import format_timing
+from .transfer import LocalFiles
+from .transfer import RemoteFiles
+from .transfer import Transfer
 from .version import __version__
 
 version_pat = re.compile(r"version (\d+(\.\d+)+)")
 
+# Shell requests answered while a cell runs, see SSHKernel.shell_main
+SIDE_REQUESTS = ("complete_request", "inspect_request")
+
+# errno of socket errors of a lost connection
+CONNECTION_ERRNOS = {
+    errno.ECONNABORTED,
+    errno.ECONNREFUSED,
+    errno.ECONNRESET,
+    errno.EHOSTDOWN,
+    errno.EHOSTUNREACH,
+    errno.ENETDOWN,
+    errno.ENETRESET,
+    errno.ENETUNREACH,
+    errno.ENOTCONN,
+    errno.EPIPE,
+    errno.ESHUTDOWN,
+    errno.ETIMEDOUT,
+}
+
+# SSHKernel.shell_main needs internals of ipykernel 7, older ones don't call it
+CONCURRENT_DISPATCH = (
+    hasattr(MetaKernel, "_get_shell_context_var")
+    and "concurrent" in inspect.signature(MetaKernel.dispatch_shell).parameters
+)
+
+# Parameters with this prefix are kernel settings instead of remote envvars
+SETTING_PREFIX = "SSHKERNEL_"
+
 
 class SSHKernel(MetaKernel):
     """
@@ -41,6 +95,69 @@ class SSHKernel(MetaKernel):
         "file_extension": ".sh",
     }
 
+    # Default settings. Override with `%param SSHKERNEL_<NAME> <VALUE>`
+    settings = {
+        # Interval [sec] and size [chars] to flush buffered output
+        "OUTPUT_FLUSH_INTERVAL": 0.05,
+        "OUTPUT_FLUSH_SIZE": 65536,
+        # Max characters of output per cell, followed by the last OUTPUT_TAIL
+        # characters. 0 means unlimited. The full output is kept by `%output`.
+        "OUTPUT_LIMIT": 1000000,
+        "OUTPUT_TAIL": 100000,
+        # Directory of spool files with the full output of the last SPOOL_KEEP
+        # cells. Empty means a temporary directory, 0 cells means disabled.
+        "SPOOL_DIR": "",
+        "SPOOL_KEEP": 20,
+        # Characters of stdout/stderr kept per stream for `%captured`. 0 means disabled.
+        "CAPTURE_SIZE": 0,
+        # Rows kept by `%%capture_table`, the rest are counted. 0 means unlimited.
+        "TABLE_MAX_ROWS": 1000000,
+        # Seconds to reuse completion candidates
+        "COMPLETION_TTL": 60.0,
+        # Seconds to wait for completion and introspection queries
+        "QUERY_TIMEOUT": 5.0,
+        # Unix socket of the mux daemon shared by kernels (python -m sshkernel.mux).
+        # Used by --persistent sessions. Empty means a connection of its own.
+        "MUX_SOCKET": os.environ.get("SSHKERNEL_MUX_SOCKET", ""),
+        # Attempts to reconnect a lost connection, and the first interval [sec]
+        # doubled for each attempt
+        "RECONNECT_RETRIES": 5,
+        "RECONNECT_BACKOFF": 1.0,
+        # Interval [sec] of keepalive probes. 0 means disabled.
+        # The connection is closed after KEEPALIVE_COUNT_MAX probes without reply.
+        "KEEPALIVE_INTERVAL": 30.0,
+        "KEEPALIVE_COUNT_MAX": 3,
+        # Hosts to run a `%%fanout` cell on at the same time
+        "FANOUT_CONCURRENCY": 16,
+        # Live sessions kept by `%login --as`, the least recently used one is closed.
+        # Sessions unused for SESSION_IDLE_TIMEOUT [sec] are closed. 0 means never.
+        "SESSIONS_MAX": 8,
+        "SESSION_IDLE_TIMEOUT": 3600.0,
+        # Seconds to wait after SIGINT of an interrupted cell before SIGTERM,
+        # and after SIGTERM before SIGKILL
+        "INTERRUPT_TERM_TIMEOUT": 2.0,
+        "INTERRUPT_KILL_TIMEOUT": 5.0,
+        # File to append the timing of each cell as a JSON line, with `%timing on`.
+        # Empty means the kernel log.
+        "TIMING_LOG": "",
+        # Compression (yes/no) and algorithm lists of the SSH transport for
+        # logins after setting them, over ~/.ssh/config. Empty means the config.
+        "COMPRESSION": "",
+        "CIPHERS": "",
+        "MACS": "",
+        "KEX_ALGORITHMS": "",
+        # SFTP channels of `%upload` and `%download` at the same time,
+        # and bytes of a chunk copied by a channel
+        "TRANSFER_STREAMS": 4,
+        "TRANSFER_CHUNK_SIZE": 8388608,
+        # {NAME} placeholders of parameters in cells: "on" leaves undefined
+        # names as they are, "strict" refuses to run the cell, "off" disables.
+        "TEMPLATE": "off",
+        # Export parameters into the remote environment at login (yes/no).
+        # With "no", parameters reach the cells by placeholders only.
+        "PARAM_EXPORT": "yes",
+    }
+
     @property
     def sshwrapper(self):
         return self._sshwrapper
@@ -54,19 +171,51 @@ class SSHKernel(MetaKernel):
             """Usage:
 
         * Prepare `~/.ssh/config`
-        * To login to the remote server, use magic command `%login <host_in_ssh_config>` into a new cell
+        * To login to the remote server, use magic command
+          `%login <host_in_ssh_config>` into a new cell
             * e.g. `%login localhost`
+            * `%login --persistent localhost` keeps a remote bash for the session
+            * `%login --as db dbhost` keeps another session, switch with `%use db`
         * After %login, input commands are executed remotely
         * To close session, use `%logout` magic command
         """
         )
 
-    def __init__(self, sshwrapper_class=SSHWrapperPlumbum, **kwargs):
+    def __init__(self, sshwrapper_class=None, **kwargs):
+        """
+        Args:
+            sshwrapper_class: class of oneshot wrappers, SSHWrapperPlumbum if None
+        """
         super().__init__(**kwargs)
 
         self.__sshwrapper_class = sshwrapper_class
         self._sshwrapper = None
         self._parameters = dict()
+        # Last characters of each stream of the last cell
+        self.captured = dict()
+        self.spools = SpoolRegistry()
+        # Bytes of the log of each background job received by `%attach`
+        self.job_offsets = dict()
+        # Tables of `%%capture_table`, and the function to pass stdout to
+        # instead of showing it while a table is captured
+        self.tables = dict()
+        self.output_tap = None
+        self.completion_cache = CompletionCache()
+        # Completion and inspection query the remote here, off the event loop
+        self.query_thread = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sshkernel-query"
+        )
+        self.reconnect_stats = dict(
+            reconnects=0, failures=0, last_latency=0.0, total_latency=0.0
+        )
+        self.keepalive = None
+        self.sessions = SessionRegistry()
+        self.session_name = None
+        # Phases of the last cell, shown and logged by `%timing on`
+        self.timing = False
+        self.timing_rusage = False
+        self.last_timing = None
+        self._cell_timing = None
 
         # Touch inherited attribute
         self.log.name = "SSHKernel"
@@ -75,10 +224,32 @@ class SSHKernel(MetaKernel):
     def set_param(self, key, value):
         """
         Set sshkernel parameter for hostname and remote envvars.
+
+        Parameters prefixed with `SSHKERNEL_` are kernel settings.
+
+        Raises:
+            KeyError: If the setting is unknown
+            ValueError: If the setting value is invalid
         """
 
+        if key.startswith(SETTING_PREFIX):
+            name = key.replace(SETTING_PREFIX, "", 1)
+            if name not in self.settings:
+                raise KeyError("Unknown setting {}".format(key))
+            type(self.settings[name])(value)
+
         self._parameters[key] = value
 
+    # Implement metakernel method
+    def get_variable(self, name):
+        """
+        Table captured by `%%capture_table NAME`, for `%get NAME`.
+
+        Returns:
+            Table or None
+        """
+        return self.tables.get(name)
+
     def get_params(self):
         """
         Get sshkernel parameters dict.
@@ -86,60 +257,549 @@ class SSHKernel(MetaKernel):
 
         return self._parameters
 
-    def do_login(self, host: str):
-        """Establish a ssh connection to the host."""
-        self.do_logout()
+    def get_env_params(self):
+        """
+        Get sshkernel parameters dict to be injected into remote envvars.
+        Empty if SSHKERNEL_PARAM_EXPORT is "no".
+        """
+
+        if self.get_setting("PARAM_EXPORT").lower() == "no":
+            return dict()
+
+        return self.get_cell_params()
+
+    def get_cell_params(self):
+        """
+        Get sshkernel parameters dict without kernel settings,
+        for `{NAME}` placeholders in cells.
+        """
+
+        return {
+            k: v
+            for k, v in self._parameters.items()
+            if not k.startswith(SETTING_PREFIX)
+        }
+
+    def get_setting(self, name):
+        """
+        Get a kernel setting overridden by `%param SSHKERNEL_<NAME>`.
+        """
+
+        default = self.settings[name]
+        value = self._parameters.get(SETTING_PREFIX + name)
+        if value is None:
+            return default
 
-        wrapper = self.__sshwrapper_class(self.get_params())
+        return type(default)(value)
+
+    def expand_cell(self, code):
+        """
+        Expand `{NAME}` placeholders of parameters in `code`,
+        by SSHKERNEL_TEMPLATE. Kernel settings are not expanded.
+
+        Raises:
+            KeyError: If "strict" and a parameter is not defined
+        """
+        mode = self.get_setting("TEMPLATE").lower()
+        if mode == "off":
+            return code
+
+        try:
+            return render(code, self.get_cell_params(), strict=mode == "strict")
+        except KeyError as exc:
+            raise KeyError("Undefined parameter {{{}}}".format(exc.args[0]))
+
+    def do_login(self, host: str, persistent: bool = False, name: str = None):
+        """Establish a ssh connection to the host, and use it.
+
+        Other sessions are kept alive, a session of the same name is replaced.
+
+        Args:
+            persistent (bool): Execute cells in one long-lived remote bash
+            name (str): Session name for `do_use`
+        """
+        name = name or DEFAULT_SESSION
+        if name == self.session_name:
+            self.do_logout()
+        else:
+            self.close_session(self.sessions.remove(name))
+
+        wrapper = self.new_wrapper(persistent)
         wrapper.connect(host)
-        self.sshwrapper = wrapper
+
+        hello = getattr(wrapper, "mux_hello", None)
+        if hello:
+            self.log.info(
+                "attached to mux %s reused=%s handshake_time=%.3fs",
+                wrapper.mux_socket,
+                hello["reused"],
+                hello["handshake_time"],
+            )
+
+        evicted = self.sessions.add(
+            name,
+            host,
+            wrapper,
+            max_sessions=self.get_setting("SESSIONS_MAX"),
+            completion_ttl=self.get_setting("COMPLETION_TTL"),
+        )
+        for session in evicted:
+            self.close_session(session)
+        self.do_use(name)
+
+        try:
+            # Prefetch all commands so that the first Tab is answered locally
+            self.complete_remote("command", "")
+        except Exception:
+            self.log.warning("failed to prefetch completions", exc_info=True)
+
+    def new_wrapper(self, persistent=False):
+        """
+        The SSH stack (paramiko, plumbum) is imported here on the first login,
+        so that the kernel starts without it.
+        """
+        if persistent:
+            from .ssh_wrapper_persistent import SSHWrapperPersistent
+
+            mux_socket = self.get_setting("MUX_SOCKET") or None
+            wrapper = SSHWrapperPersistent(self.get_env_params(), mux_socket=mux_socket)
+        else:
+            wrapper_class = self.__sshwrapper_class
+            if wrapper_class is None:
+                from .ssh_wrapper_plumbum import SSHWrapperPlumbum
+
+                wrapper_class = SSHWrapperPlumbum
+
+            wrapper = wrapper_class(self.get_env_params())
+
+        wrapper.transport_overrides = self.transport_overrides()
+
+        return wrapper
+
+    def transport_overrides(self):
+        """Transport options over ~/.ssh/config, empty ones are not overridden."""
+        return dict(
+            compression=self.get_setting("COMPRESSION"),
+            ciphers=self.get_setting("CIPHERS"),
+            macs=self.get_setting("MACS"),
+            kexalgorithms=self.get_setting("KEX_ALGORITHMS"),
+        )
 
     def do_logout(self):
-        """Close the connection."""
+        """Close the connection of the current session."""
+        self.stop_keepalive()
+
         if self.sshwrapper:
             self.Print("[ssh] Closing existing connection.")
             self.sshwrapper.close()  # TODO: error handling
             self.Print("[ssh] Successfully logged out.")
 
+        self.sessions.remove(self.session_name)
         self.sshwrapper = None
+        self.session_name = None
+
+    def do_use(self, name):
+        """Switch to a live session without reconnecting.
+
+        Returns:
+            Session
+
+        Raises:
+            KeyError: If no session has the name
+        """
+        session = self.sessions.get(name)
+
+        self.sshwrapper = session.wrapper
+        self.session_name = name
+        self.completion_cache = session.completion_cache
+        self.start_keepalive()
+
+        return session
+
+    def close_session(self, session, reason=""):
+        """Close a session which is not current, e.g. evicted one."""
+        if session is None:
+            return
+
+        self.Print("[ssh] Closing session {} {}".format(session.name, reason).strip())
+        try:
+            session.wrapper.close()
+        except Exception:
+            self.log.warning("failed to close session %s", session.name, exc_info=True)
+
+    def expire_sessions(self):
+        """Close sessions unused for SSHKERNEL_SESSION_IDLE_TIMEOUT."""
+        idle_timeout = self.get_setting("SESSION_IDLE_TIMEOUT")
+        if idle_timeout <= 0:
+            return
+
+        for session in self.sessions.expire(idle_timeout, keep=self.session_name):
+            self.close_session(session, "(idle)")
 
     # Implement base class method
     def do_execute_direct(self, code, silent=False):
+        timer = CellTimer()
+        try:
+            code = self.expand_cell(code)
+        except KeyError as exc:
+            self.Error("[ssh] {}".format(exc.args[0]))
+            return ExceptionWrapper("KeyError", exc.args[0], [])
+
+        self.expire_sessions()
+        self.sessions.touch(self.session_name)
+
+        if self.sshwrapper is not None and not self.sshwrapper.isconnected():
+            self.reconnect()
+
         try:
             self.assert_connected()
         except SSHKernelNotConnectedException:
             self.Error(traceback.format_exc())
             return ExceptionWrapper("abort", "not connected", [])
 
+        self.sshwrapper.rusage = self.timing_rusage
+        timer.mark("prepare")
+
+        exec_command_async = getattr(self.sshwrapper, "exec_command_async", None)
+        if asyncio.iscoroutinefunction(exec_command_async):
+            # metakernel awaits the coroutine in the event loop of the kernel
+            return self.do_execute_async(code, timer)
+
         try:
-            exitcode = self.sshwrapper.exec_command(code, self.Write)
+            output = self.new_output_buffer(self.Write, self.WriteError)
+            self.captured = output.captured
+            with output:
+                exitcode = self.sshwrapper.exec_command(
+                    code, output.write, output.write_error
+                )
+                self.merge_wrapper_timing(timer)
+            timer.mark("flush")
 
         except KeyboardInterrupt:
             self.Error("* interrupt...")
 
             # TODO: Handle exception
-            self.sshwrapper.interrupt()
+            self.report_interrupt(self.sshwrapper.interrupt(self.interrupt_timeouts()))
 
             self.Error(traceback.format_exc())
 
             return ExceptionWrapper("abort", str(1), [str(KeyboardInterrupt)])
 
-        except SSHException:
-            #
-            # TODO: Implement reconnect sequence
-            return ExceptionWrapper("ssh_exception", str(1), [])
+        except Exception as exc:
+            if not is_connection_error(exc):
+                raise
+            return self.connection_lost(exc)
 
-        if exitcode:
-            ename = "abnormal exit code"
-            evalue = str(exitcode)
-            trace = [""]
+        self.record_timing(timer, exitcode)
 
-            return ExceptionWrapper(ename, evalue, trace)
+        return exit_code_result(exitcode)
 
-        return None
+    async def do_execute_async(self, code, timer=None):
+        """
+        Execute `code` by `exec_command_async` of the wrapper.
+
+        The event loop of the kernel keeps running while the cell runs,
+        and SIGINT cancels the cell instead of raising KeyboardInterrupt.
+        """
+
+        timer = timer or CellTimer()
+        output = self.new_output_buffer(self.Write, self.WriteError)
+        self.captured = output.captured
+        self.sshwrapper.interrupt_timeouts = self.interrupt_timeouts()
+
+        task = asyncio.ensure_future(
+            self.sshwrapper.exec_command_async(code, output.write, output.write_error)
+        )
+        loop = asyncio.get_running_loop()
+        sigint_handled = add_sigint_handler(loop, task.cancel)
+
+        try:
+            with output:
+                exitcode = await task
+                self.merge_wrapper_timing(timer)
+            timer.mark("flush")
+
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            task.cancel()
+            self.Error("* interrupt...")
+            self.report_interrupt(getattr(self.sshwrapper, "last_interrupt", None))
+
+            return ExceptionWrapper("abort", str(1), [str(KeyboardInterrupt)])
+
+        except Exception as exc:
+            if not is_connection_error(exc):
+                raise
+            return self.connection_lost(exc)
+
+        finally:
+            if sigint_handled:
+                loop.remove_signal_handler(signal.SIGINT)
+
+        self.record_timing(timer, exitcode)
+
+        return exit_code_result(exitcode)
+
+    def connection_lost(self, exc):
+        self.Error("[ssh] Connection lost: {}".format(exc))
+
+        # The cell may have been executed partially, so it is not retried
+        self.reconnect()
+
+        return ExceptionWrapper("ssh_exception", str(1), [str(exc)])
+
+    def do_fanout(self, hosts, code):
+        """
+        Execute `code` on each host concurrently with a connection of its own.
+        The current login is not used nor changed.
+
+        Returns:
+            list: FanoutResult per host
+        """
+
+        code = self.expand_cell(code)
+        fanout = Fanout(
+            self.new_wrapper,
+            concurrency=self.get_setting("FANOUT_CONCURRENCY"),
+        )
+
+        output = self.new_output_buffer(self.Write, self.WriteError)
+        with output:
+            return fanout.run(hosts, code, output.write, output.write_error)
+
+    def do_transfer(self, upload, src, dst=None, restart=False):
+        """
+        Copy a file between the notebook host and the remote host over SFTP.
+        Relative remote paths are in the cwd of the session,
+        and destinations default to the cwd.
+
+        Returns:
+            TransferResult
+        """
+        wrapper = self.sshwrapper
+        if wrapper is None:
+            raise SSHKernelNotConnectedException("Not logged in.")
+
+        cwd = wrapper.get_cwd()
+
+        def remote_path(path):
+            return posixpath.join(cwd, path or "")
+
+        def local_path(path):
+            return os.path.abspath(os.path.expanduser(path or "."))
+
+        def remote_files():
+            return RemoteFiles(wrapper.open_sftp())
+
+        if upload:
+            transfer = Transfer(LocalFiles, remote_files, **self.transfer_params())
+            return transfer.run(local_path(src), remote_path(dst), restart=restart)
+
+        transfer = Transfer(remote_files, LocalFiles, **self.transfer_params())
+        return transfer.run(remote_path(src), local_path(dst), restart=restart)
+
+    def transfer_params(self):
+        return dict(
+            streams=self.get_setting("TRANSFER_STREAMS"),
+            chunk_size=self.get_setting("TRANSFER_CHUNK_SIZE"),
+        )
+
+    def do_background(self, code):
+        """
+        Start `code` as a background job on the remote host, detached from the
+        session, in the current cwd and environment.
+
+        Returns:
+            (str, int): job id and pid
+
+        Raises:
+            KeyError: If a parameter of the cell is not defined, see expand_cell
+            SSHKernelQueryError: If the job was not started
+        """
+        code = self.expand_cell(code)
+        wrapper = self.connected_wrapper()
+
+        job_id = new_job_id()
+        lines = wrapper.query(
+            launch_script(job_id, code), self.get_setting("QUERY_TIMEOUT")
+        )
+        fields = lines[-1].split() if lines else []
+        if len(fields) != 2 or fields[0] != job_id:
+            raise SSHKernelQueryError("failed to start job {}".format(job_id))
+
+        self.job_offsets[job_id] = 0
+
+        return job_id, int(fields[1])
+
+    def do_jobs(self, clean=False):
+        """
+        Returns:
+            list: JobStatus of the background jobs on the remote host
+        """
+        wrapper = self.connected_wrapper()
+
+        return parse_jobs(
+            wrapper.query(list_script(clean), self.get_setting("QUERY_TIMEOUT"))
+        )
+
+    def do_attach(self, job_id, follow_output=True, from_start=False):
+        """
+        Show the output of a background job not shown yet, and follow it
+        until the job finishes if `follow_output`.
+
+        Returns:
+            int: exit code of the job, or None if running
+
+        Raises:
+            KeyError: If no such job
+        """
+        wrapper = self.connected_wrapper()
+        if from_start:
+            self.job_offsets[job_id] = 0
+
+        output = self.new_output_buffer(self.Write, self.WriteError)
+        self.captured = output.captured
+        with output:
+            return follow(
+                wrapper.open_channel(),
+                job_id,
+                self.job_offsets,
+                output.write,
+                follow=follow_output,
+            )
+
+    def connected_wrapper(self):
+        """
+        Returns:
+            the wrapper of the current session, reconnected if the connection was lost
+
+        Raises:
+            SSHKernelNotConnectedException
+        """
+        if self.sshwrapper is not None and not self.sshwrapper.isconnected():
+            self.reconnect()
+
+        self.assert_connected()
+
+        return self.sshwrapper
+
+    def reconnect(self):
+        """
+        Reconnect to the host with exponential backoff,
+        and restore the session state.
+
+        Returns:
+            bool: reconnected or not
+        """
+
+        retries = self.get_setting("RECONNECT_RETRIES")
+        backoff = self.get_setting("RECONNECT_BACKOFF")
+        started = time.monotonic()
+
+        for attempt in range(retries):
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+            self.Error("[ssh] Reconnecting ({}/{})...".format(attempt + 1, retries))
+            try:
+                self.sshwrapper.reconnect()
+            except Exception as exc:
+                self.log.warning("reconnect failed: %s", exc)
+                continue
+
+            latency = time.monotonic() - started
+            self.reconnect_stats["reconnects"] += 1
+            self.reconnect_stats["last_latency"] = latency
+            self.reconnect_stats["total_latency"] += latency
+            self.Print("[ssh] Reconnected in {:.1f}s.".format(latency))
+            self.completion_cache.invalidate()
+            self.start_keepalive()
+
+            return True
+
+        self.reconnect_stats["failures"] += 1
+        self.Error("[ssh] Failed to reconnect. Please %login again.")
+
+        return False
+
+    def start_keepalive(self):
+        """
+        Start probing the transport of the current connection,
+        replacing the keepalive of the previous one.
+        """
+
+        self.stop_keepalive()
+
+        interval = self.get_setting("KEEPALIVE_INTERVAL")
+        transport = self.sshwrapper.get_transport()
+        if interval <= 0 or transport is None:
+            return
+
+        self.keepalive = Keepalive(
+            transport, interval, count_max=self.get_setting("KEEPALIVE_COUNT_MAX")
+        )
+        self.keepalive.start()
+
+    def stop_keepalive(self):
+        if self.keepalive:
+            self.keepalive.stop()
+            self.keepalive = None
 
     # Implement ipykernel method
-    def do_complete(self, code, cursor_pos):
+    async def shell_main(self, subshell_id, msg):
+        """
+        Answer completion and inspection while a cell runs.
+
+        ipykernel handles one shell request at a time. While an async cell
+        holds the shell lock, SIDE_REQUESTS are dispatched concurrently,
+        as ipykernel does for comm messages.
+        Without the internals this relies on, requests wait for the cell.
+        """
+        lock = getattr(self, "_main_asyncio_lock", None)
+        if (
+            CONCURRENT_DISPATCH
+            and subshell_id is None
+            and lock is not None
+            and hasattr(self, "_shell_parent_ident")
+            and lock.locked()
+            and request_type(self.session, msg) in SIDE_REQUESTS
+        ):
+            parent = self.get_parent("shell")
+            ident = self._get_shell_context_var(self._shell_parent_ident)
+            try:
+                await asyncio.ensure_future(
+                    self.dispatch_shell(msg, subshell_id=subshell_id, concurrent=True)
+                )
+            finally:
+                # Output of the cell from other threads goes to the last parent
+                self.set_parent(ident, parent, channel="shell")
+            return
+
+        await super().shell_main(subshell_id, msg)
+
+    # Implement ipykernel method
+    async def do_complete(self, code, cursor_pos):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.query_thread, self.complete, code, cursor_pos
+        )
+
+    # Implement ipykernel method
+    async def do_inspect(self, code, cursor_pos, detail_level=0, omit_sections=()):
+        base_inspect = super().do_inspect
+
+        def run_inspect():
+            # MetaKernel.do_inspect gets the help by blocking queries.
+            # Since metakernel 1.0 it is a coroutine, which awaits nothing.
+            reply = base_inspect(code, cursor_pos, detail_level, omit_sections)
+            return asyncio.run(reply) if asyncio.iscoroutine(reply) else reply
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.query_thread, run_inspect)
+
+    def complete(self, code, cursor_pos):
+        """
+        Complete variables and commands by queries, see `do_complete`.
+        """
         default = {
             "matches": [],
             "cursor_start": 0,
@@ -164,49 +824,216 @@ class SSHKernel(MetaKernel):
 
         token = tokens[-1]
 
-        if token[0] == "$":
-            # complete variables
+        try:
+            if token[0] == "$":
+                # complete variables, and append matches including leading $
+                matches = ["$" + c for c in self.complete_remote("variable", token[1:])]
+            else:
+                # complete functions and builtins
+                matches = self.complete_remote("command", token)
+        except SSHKernelQueryError:
+            self.log.warning("completion failed", exc_info=True)
+            return default
 
-            # strip leading $
-            cmd = "compgen -A arrayvar -A export -A variable %s" % token[1:]
-            completions = set()
+        cursor_start = cursor_pos - len(token)
+        cursor_end = cursor_pos
+
+        return dict(
+            matches=matches,
+            cursor_start=cursor_start,
+            cursor_end=cursor_end,
+            metadata=dict(),
+            status="ok",
+        )
 
-            def callback(line):
-                completions.add(line.rstrip())
+    # Implement metakernel method
+    def get_kernel_help_on(self, info, level=0, none_on_fail=False):
+        """
+        Get help on a command with `type`, `help` and `man -f`.
+        """
 
-            self.sshwrapper.exec_command(cmd, callback)
+        not_found = super().get_kernel_help_on(info, level, none_on_fail)
+        if not info["obj"] or self.sshwrapper is None:
+            return not_found
 
-            # append matches including leading $
-            matches = ["$" + c for c in completions]
+        name = shlex.quote(info["obj"])
+        if level == 0:
+            cmd = "type {0}; help -d {0}; man -f {0}".format(name)
         else:
-            # complete functions and builtins
-            cmd = "compgen -cdfa %s" % token
-            matches = set()
+            cmd = "type {0}; help {0}; man -f {0}".format(name)
 
-            def callback(line):
-                matches.add(line.rstrip())
+        try:
+            lines = self.sshwrapper.query(cmd, self.get_setting("QUERY_TIMEOUT"))
+        except SSHKernelQueryError:
+            self.log.warning("introspection failed", exc_info=True)
+            return not_found
 
-            self.sshwrapper.exec_command(cmd, callback)
+        return "\n".join(lines) or not_found
 
-        matches = [m for m in matches if m.startswith(token)]
+    def complete_remote(self, kind, prefix):
+        """
+        Get completion candidates by compgen, or from the completion cache.
+        Commands include the aliases and functions of the session shell,
+        which the query shell doesn't have.
 
-        cursor_start = cursor_pos - len(token)
-        cursor_end = cursor_pos
+        Args:
+            kind (str): "command" or "variable"
 
-        return dict(
-            matches=sorted(matches),
-            cursor_start=cursor_start,
-            cursor_end=cursor_end,
-            metadata=dict(),
-            status="ok",
+        Returns:
+            list: sorted candidates starting with `prefix`
+        """
+
+        context = (self.sshwrapper.get_cwd(), self.sshwrapper.get_env_fingerprint())
+        matches = self.completion_cache.get(kind, prefix, context)
+        if matches is None:
+            if kind == "variable":
+                cmd = "compgen -A arrayvar -A export -A variable %s" % prefix
+            else:
+                cmd = "compgen -cdfa %s" % prefix
+
+            candidates = self.sshwrapper.query(cmd, self.get_setting("QUERY_TIMEOUT"))
+            matches = self.completion_cache.put(kind, prefix, context, candidates)
+
+        if kind == "command":
+            names = self.sshwrapper.get_session_names()
+            names = [n for n in names if n.startswith(prefix)]
+            matches = sorted(set(matches).union(names))
+
+        return matches
+
+    def WriteError(self, message):
+        """
+        Write message directly to the iopub stderr with no added end character.
+        """
+
+        self.Error(message, end="")
+
+    def merge_wrapper_timing(self, timer):
+        wrapper_timer = getattr(self.sshwrapper, "last_timing", None)
+        if isinstance(wrapper_timer, CellTimer):
+            timer.merge(wrapper_timer)
+
+    def record_timing(self, timer, exitcode):
+        """
+        Keep the timing of the finished cell. With `%timing on`, show it,
+        put it into the metadata of the reply, and log it as a JSON line.
+        """
+        timing = timer.to_dict()
+        timing.update(
+            execution_count=self.execution_count,
+            time=time.time(),
+            session=self.session_name,
+            host=(
+                self.sessions.get(self.session_name).host
+                if self.session_name in self.sessions
+                else None
+            ),
+            code=exitcode,
+        )
+        self.last_timing = timing
+
+        if not self.timing:
+            return
+
+        self._cell_timing = timing
+        self.Print(format_timing(timing))
+
+        line = json.dumps(timing, sort_keys=True)
+        path = self.get_setting("TIMING_LOG")
+        if path:
+            try:
+                with open(os.path.expanduser(path), "a") as f:
+                    f.write(line + "\n")
+                return
+            except OSError:
+                self.log.warning(
+                    "failed to write the timing log, disabled", exc_info=True
+                )
+                self.set_param(SETTING_PREFIX + "TIMING_LOG", "")
+
+        self.log.info(line)
+
+    def init_metadata(self, parent):
+        self._cell_timing = None
+
+        return super().init_metadata(parent)
+
+    def finish_metadata(self, parent, metadata, reply_content):
+        if self._cell_timing is not None:
+            metadata["sshkernel"] = dict(timing=self._cell_timing)
+
+        return super().finish_metadata(parent, metadata, reply_content)
+
+    def interrupt_timeouts(self):
+        return (
+            self.get_setting("INTERRUPT_TERM_TIMEOUT"),
+            self.get_setting("INTERRUPT_KILL_TIMEOUT"),
+        )
+
+    def report_interrupt(self, result):
+        """Show which signal terminated the interrupted cell, and when."""
+        if result:
+            self.Error(
+                "[ssh] Terminated by SIG{} in {:.1f}s".format(
+                    result["signal"], result["elapsed"]
+                )
+            )
+
+    def new_output_buffer(self, write_function, error_function=None):
+        """
+        Create an OutputBuffer which coalesces remote output into chunks.
+        """
+
+        return OutputBuffer(
+            write_function,
+            error_function,
+            flush_interval=self.get_setting("OUTPUT_FLUSH_INTERVAL"),
+            flush_size=self.get_setting("OUTPUT_FLUSH_SIZE"),
+            limit=self.get_setting("OUTPUT_LIMIT") or None,
+            capture_size=self.get_setting("CAPTURE_SIZE"),
+            tail_size=self.get_setting("OUTPUT_TAIL"),
+            spool=self.new_spool(),
+            tap=self.output_tap,
         )
 
+    def new_spool(self):
+        """
+        Returns:
+            Spool of the current cell, or None if disabled
+        """
+        self.spools.keep = self.get_setting("SPOOL_KEEP")
+        if not self.spools.keep:
+            return None
+
+        self.spools.directory = os.path.expanduser(self.get_setting("SPOOL_DIR"))
+        try:
+            return self.spools.create(self.execution_count)
+        except OSError:
+            self.log.warning("failed to create a spool file", exc_info=True)
+            return None
+
     def restart_kernel(self):
         # TODO: log message
         # self.Print('[INFO] Restart sshkernel ...')
 
         self.do_logout()
+        for session in self.sessions.sessions():
+            self.close_session(self.sessions.remove(session.name))
         self._parameters = dict()
+        self.tables = dict()
+        self.spools.clear()
+
+    async def do_shutdown(self, restart):
+        if not restart:
+            self.spools.clear()
+            self.query_thread.shutdown(wait=False)
+
+        reply = super().do_shutdown(restart)
+        if inspect.isawaitable(reply):
+            # A coroutine since metakernel 1.0
+            reply = await reply
+
+        return reply
 
     def assert_connected(self):
         """
@@ -220,3 +1047,63 @@ class SSHKernel(MetaKernel):
         if not self.sshwrapper.isconnected():
             self.Error("[ssh] Not connected.")
             raise SSHKernelNotConnectedException
+
+
+def is_connection_error(exc):
+    """
+    Whether `exc` is of a lost connection, evaluated only when a cell raises.
+    Other OSError, e.g. of writing a spool file, are not.
+    """
+    from paramiko.ssh_exception import SSHException
+
+    if isinstance(exc, (SSHException, EOFError)):
+        return True
+
+    # paramiko raises OSError("Socket is closed") without errno
+    return isinstance(exc, OSError) and (
+        exc.errno is None or exc.errno in CONNECTION_ERRNOS
+    )
+
+
+def request_type(session, msg):
+    """
+    Returns:
+        str: msg_type of a raw shell message, None if invalid
+    """
+    try:
+        _, frames = session.feed_identities(msg, copy=False)
+        header = session.deserialize(frames, content=False, copy=False)["header"]
+    except Exception:
+        return None
+
+    return header.get("msg_type")
+
+
+def exit_code_result(exitcode):
+    """
+    Returns:
+        ExceptionWrapper: for non-zero exit code, otherwise None
+    """
+    if exitcode:
+        ename = "abnormal exit code"
+        evalue = str(exitcode)
+        trace = [""]
+
+        return ExceptionWrapper(ename, evalue, trace)
+
+    return None
+
+
+def add_sigint_handler(loop, callback):
+    """
+    Call `callback` in the event loop on SIGINT.
+
+    Returns:
+        bool: installed or not, e.g. not in the main thread
+    """
+    try:
+        loop.add_signal_handler(signal.SIGINT, callback)
+    except (NotImplementedError, RuntimeError, ValueError):
+        return False
+
+    return True
@@ -4,16 +4,53 @@ import traceback
 
 from metakernel import ExceptionWrapper
 from metakernel import Magic
+from metakernel import option
+
+from sshkernel.fanout import format_summary
+from sshkernel.fanout import parse_hosts
+from sshkernel.jobs import format_jobs
+from sshkernel.spool import format_page
+from sshkernel.table import FORMATS
+from sshkernel.table import TableParser
+from sshkernel.template import HOST_PLACEHOLDER
+from sshkernel.template import render
+from sshkernel.timing import format_timing
+from sshkernel.transfer import format_transfer
 
 
 class SSHKernelMagics(Magic):
-    def line_login(self, host):
+    # (name, TableParser) of the `%%capture_table` cell being executed
+    table_capture = None
+
+    @option(
+        "-p",
+        "--persistent",
+        action="store_true",
+        default=False,
+        help="Execute cells in one long-lived remote bash",
+    )
+    @option(
+        "-a",
+        "--as",
+        action="store",
+        dest="name",
+        default=None,
+        help="Name of the session to switch back with %use",
+    )
+    def line_login(self, host, persistent=False, name=None):
         """
-        %login HOST
+        %login [--persistent] [--as NAME] HOST
 
         SSH login to the remote host.
         Cells below this line will be executed remotely.
 
+        With --persistent, cells are fed into one remote bash kept alive
+        for the session, so shell functions, aliases and options survive.
+
+        With --as, the session is kept alive under the name while other
+        sessions are used, and switched back by `%use NAME` without reconnecting.
+        A login without --as replaces the session "default".
+
         Example:
             [~/.ssh/config]
             Host myserver
@@ -21,6 +58,8 @@ class SSHKernelMagics(Magic):
                 Port 2222
 
             %login myserver
+            %login --persistent myserver
+            %login --as db dbhost
         """
 
         self.retval = None
@@ -28,7 +67,7 @@ class SSHKernelMagics(Magic):
             self.kernel.Print("[ssh] Login to {}...".format(host))
 
             expanded_host = expand_parameters(host, self.kernel.get_params())
-            self.kernel.do_login(expanded_host)
+            self.kernel.do_login(expanded_host, persistent=persistent, name=name)
         except Exception as exc:
             self.kernel.Error("[ssh] Login to {} failed.".format(host))
             self.kernel.Error(exc)
@@ -55,6 +94,37 @@ class SSHKernelMagics(Magic):
         self.retval = None
         self.kernel.do_logout()
 
+    def line_use(self, name=None):
+        """
+        %use [NAME]
+
+        Switch to a live session logged in by `%login --as NAME`,
+        keeping its cwd and environment. Without NAME, list the sessions.
+
+        Example:
+            %login --as bastion gateway
+            %login --as db dbhost
+            %use bastion
+        """
+
+        self.retval = None
+        if name is None:
+            self.kernel.Print(format_sessions(self.kernel))
+            return
+
+        try:
+            session = self.kernel.do_use(name)
+        except KeyError:
+            self.kernel.Error("[ssh] Unknown session {}".format(name))
+            self.retval = ExceptionWrapper("KeyError", repr(name), [])
+            return
+
+        self.kernel.Print(
+            "[ssh] Using {} (host = {}, cwd = {})".format(
+                name, session.host, session.wrapper.get_cwd()
+            )
+        )
+
     def line_param(self, variable, value):
         """
         %param VARIABLE VALUE
@@ -62,6 +132,61 @@ class SSHKernelMagics(Magic):
         Define a hostname/env variable.
         This is useful for parameterized notebook execution using papermill.
 
+        `{VARIABLE}` in hosts is replaced by the value, and in cells with
+        SSHKERNEL_TEMPLATE on. `{{VARIABLE}}` in cells is kept as `{VARIABLE}`.
+
+        Variables prefixed with SSHKERNEL_ are kernel settings instead:
+            SSHKERNEL_OUTPUT_FLUSH_INTERVAL  seconds to coalesce output (0.05)
+            SSHKERNEL_OUTPUT_FLUSH_SIZE      characters to coalesce output (65536)
+            SSHKERNEL_OUTPUT_LIMIT           max characters of output per cell
+                                             (1000000, 0: unlimited)
+            SSHKERNEL_OUTPUT_TAIL            characters at the end shown after the limit
+                                             (100000)
+            SSHKERNEL_SPOOL_DIR              directory of the full output of cells for
+                                             %output
+            SSHKERNEL_SPOOL_KEEP             cells to keep the full output of
+                                             (20, 0: disabled)
+            SSHKERNEL_CAPTURE_SIZE           characters of each stream kept for
+                                             %captured (0: disabled)
+            SSHKERNEL_TABLE_MAX_ROWS         rows kept by %%capture_table
+                                             (1000000, 0: unlimited)
+            SSHKERNEL_COMPLETION_TTL         seconds to reuse completion candidates
+                                             (60.0)
+            SSHKERNEL_QUERY_TIMEOUT          seconds to wait for completion and
+                                             introspection (5.0)
+            SSHKERNEL_MUX_SOCKET             socket of the mux daemon for --persistent
+                                             sessions
+            SSHKERNEL_RECONNECT_RETRIES      attempts to reconnect a lost connection (5)
+            SSHKERNEL_RECONNECT_BACKOFF      seconds before the second attempt, doubled
+                                             (1.0)
+            SSHKERNEL_KEEPALIVE_INTERVAL     seconds between keepalive probes
+                                             (30.0, 0: disabled)
+            SSHKERNEL_KEEPALIVE_COUNT_MAX    probes without reply to close the
+                                             connection (3)
+            SSHKERNEL_FANOUT_CONCURRENCY     hosts to run a %%fanout cell on at the same
+                                             time (16)
+            SSHKERNEL_SESSIONS_MAX           live sessions kept by %login --as (8)
+            SSHKERNEL_SESSION_IDLE_TIMEOUT   seconds to keep an unused session
+                                             (3600.0, 0: forever)
+            SSHKERNEL_INTERRUPT_TERM_TIMEOUT seconds after SIGINT to send SIGTERM on
+                                             interrupt (2.0)
+            SSHKERNEL_INTERRUPT_KILL_TIMEOUT seconds after SIGTERM to send SIGKILL on
+                                             interrupt (5.0)
+            SSHKERNEL_TIMING_LOG             file to append the timing of cells as JSON
+                                             lines
+            SSHKERNEL_COMPRESSION            yes/no to compress the SSH transport of
+                                             next logins
+            SSHKERNEL_CIPHERS                ciphers of next logins, e.g.
+                                             aes128-gcm@openssh.com,aes128-ctr
+            SSHKERNEL_MACS                   MACs of next logins
+            SSHKERNEL_KEX_ALGORITHMS         key exchange algorithms of next logins
+            SSHKERNEL_TRANSFER_STREAMS       SFTP channels of %upload and %download (4)
+            SSHKERNEL_TRANSFER_CHUNK_SIZE    bytes of a chunk copied by a channel
+                                             (8388608)
+            SSHKERNEL_TEMPLATE               {VARIABLE} in cells: off, on or strict
+                                             (an undefined name is an error)
+            SSHKERNEL_PARAM_EXPORT           yes/no to export variables at next logins
+
         Examples:
             In [1]:
             %param HOST_A 10.10.10.10
@@ -77,7 +202,7 @@ class SSHKernelMagics(Magic):
             11.11.11.11
         """
         try:
-            validate_value_string(value)
+            validate_value_string(value, home=variable in PATH_SETTINGS)
             self.kernel.set_param(variable, value)
         except Exception as exc:
             # To propagate exception to frontend through metakernel
@@ -86,12 +211,521 @@ class SSHKernelMagics(Magic):
             tb_format = traceback.format_exc().splitlines()
             self.retval = ExceptionWrapper(ex_type.__name__, repr(exc.args), tb_format)
 
+    def line_captured(self, stream="stdout"):
+        """
+        %captured [stdout|stderr]
+
+        Show the last output of the previous cell captured from the stream.
+        Set SSHKERNEL_CAPTURE_SIZE to enable capturing.
+
+        Example:
+            %param SSHKERNEL_CAPTURE_SIZE 100000
+            %captured stderr
+        """
+
+        self.retval = None
+        if not self.kernel.captured:
+            self.kernel.Error(
+                "[ssh] Nothing captured. "
+                "Set SSHKERNEL_CAPTURE_SIZE to enable capturing."
+            )
+            return
+
+        if stream not in self.kernel.captured:
+            self.kernel.Error("[ssh] Unknown stream {}".format(stream))
+            return
+
+        self.kernel.Write(self.kernel.captured[stream].getvalue())
+
+    @option(
+        "-g",
+        "--grep",
+        action="store",
+        default=None,
+        help="Show lines matching the regular expression",
+    )
+    @option(
+        "-r",
+        "--range",
+        action="store",
+        dest="lines_range",
+        default=None,
+        help="Lines a:b from 1, negative numbers count from the end",
+    )
+    @option(
+        "-n",
+        "--max-lines",
+        action="store",
+        type="int",
+        default=100,
+        help="Max lines to show",
+    )
+    def line_output(self, cell=None, grep=None, lines_range=None, max_lines=100):
+        """
+        %output [CELL] [--grep PATTERN] [--range a:b] [--max-lines N]
+
+        Search and page through the full output of a cell, kept in a local
+        spool file even when the output shown was truncated by
+        SSHKERNEL_OUTPUT_LIMIT. CELL is the execution count, the last cell
+        by default. The command is not executed again.
+
+        Example:
+            %output
+            %output 12 --range -50:
+            %output 12 --grep "ERROR|WARN" --range 1000:
+        """
+
+        self.retval = None
+        try:
+            spool = self.kernel.spools.get(None if cell is None else int(cell))
+        except (KeyError, ValueError):
+            self.kernel.Error(
+                "[ssh] No output of cell {} kept. See SSHKERNEL_SPOOL_KEEP.".format(
+                    cell
+                )
+            )
+            self.retval = ExceptionWrapper("KeyError", repr(cell), [])
+            return
+
+        try:
+            self.kernel.Print(format_page(spool, grep, lines_range, max_lines))
+        except (ValueError, re.error, OSError) as exc:
+            self.kernel.Error("[ssh] {}".format(exc))
+            self.retval = ExceptionWrapper(type(exc).__name__, str(exc), [])
+
+    @option(
+        "-f",
+        "--format",
+        action="store",
+        dest="fmt",
+        default="auto",
+        help="Format of the output: {}".format(", ".join(FORMATS)),
+    )
+    @option(
+        "--no-header",
+        action="store_true",
+        default=False,
+        help="The first line is a row, columns are named 1, 2, ...",
+    )
+    @option(
+        "-n",
+        "--max-rows",
+        action="store",
+        type="int",
+        default=20,
+        help="Rows of the table to show",
+    )
+    def cell_capture_table(self, name, fmt="auto", no_header=False, max_rows=20):
+        """
+        %%capture_table [--format FORMAT] [--no-header] [--max-rows N] NAME
+
+        Execute the cell, and parse its stdout into a table NAME instead of
+        showing it. The output is parsed as it is received, and numbers are
+        stored in arrays by column. The first rows of the table are shown,
+        and `%get NAME` shows it again.
+
+        Formats are csv, tsv, ws (whitespace-separated, the last column takes
+        the rest of the line), jsonl (a JSON object per line), and auto.
+        Set SSHKERNEL_TABLE_MAX_ROWS to change the rows kept.
+
+        Example:
+            %%capture_table procs
+            ps -eo pid,user,%cpu,rss,args
+        """
+
+        self.retval = None
+        try:
+            parser = TableParser(
+                fmt,
+                header=not no_header,
+                max_rows=self.kernel.get_setting("TABLE_MAX_ROWS"),
+                # e.g. "[ssh] host = ..." before the output
+                comment="[ssh] ",
+            )
+        except ValueError as exc:
+            self.kernel.Error("[ssh] {}".format(exc))
+            self.retval = ExceptionWrapper("ValueError", str(exc), [])
+            self.code = ""
+            return
+
+        # The cell is executed by the kernel after this, then post_process()
+        # stores the table
+        self.table_capture = (name, parser, max_rows)
+        self.kernel.output_tap = parser.feed
+
+    def line_ssh_status(self):
+        """
+        %ssh_status
+
+        Show the health of the connection: round trip times of keepalive
+        probes, bytes sent and received, and reconnects.
+        Set SSHKERNEL_KEEPALIVE_INTERVAL to change the probe interval.
+
+        Example:
+            %ssh_status
+        """
+
+        self.retval = None
+        kernel = self.kernel
+        if kernel.sshwrapper is None:
+            kernel.Error("[ssh] Not logged in.")
+            return
+
+        lines = [
+            "[ssh] connected: {}".format(kernel.sshwrapper.isconnected()),
+        ]
+
+        keepalive = kernel.keepalive
+        if keepalive is None:
+            lines.append("[ssh] keepalive: disabled")
+        else:
+            rtt = keepalive.rtt
+            if len(rtt):
+                lines.append(
+                    "[ssh] rtt: p50={} p90={} p99={} (last {} probes)".format(
+                        *[format_ms(rtt.percentile(p)) for p in (50, 90, 99)], len(rtt)
+                    )
+                )
+            else:
+                lines.append("[ssh] rtt: no reply yet")
+
+            age = keepalive.since_last_success()
+            lines.append(
+                "[ssh] last reply: {}, probes: {}, failures: {}".format(
+                    "never" if age is None else "{:.1f}s ago".format(age),
+                    keepalive.probes,
+                    keepalive.failures,
+                )
+            )
+            lines.append(
+                "[ssh] bytes: sent {}, received {}".format(
+                    keepalive.traffic.sent, keepalive.traffic.received
+                )
+            )
+
+        stats = kernel.reconnect_stats
+        lines.append(
+            "[ssh] reconnects: {}, failures: {}, last latency: {:.1f}s".format(
+                stats["reconnects"], stats["failures"], stats["last_latency"]
+            )
+        )
+
+        kernel.Print("\n".join(lines))
+
+    @option(
+        "-r",
+        "--rusage",
+        action="store_true",
+        default=False,
+        help="Also measure user and system time of the cell on the remote host",
+    )
+    def line_timing(self, state=None, rusage=False):
+        """
+        %timing [on|off] [--rusage]
+
+        With "on", show where the time of each cell goes: opening the
+        channel, starting bash, the command, the footer, updating the
+        environment, and flushing output. The timing is also put into the
+        metadata of the reply, and logged as a JSON line to
+        SSHKERNEL_TIMING_LOG, or to the kernel log if not set.
+        Without arguments, show the timing of the last cell.
+
+        Example:
+            %timing on --rusage
+            %param SSHKERNEL_TIMING_LOG ~/sshkernel-timing.jsonl
+        """
+
+        self.retval = None
+        if state is None:
+            if self.kernel.last_timing is None:
+                self.kernel.Error("[ssh] No cell executed yet.")
+            else:
+                self.kernel.Print(format_timing(self.kernel.last_timing))
+            return
+
+        if state not in ("on", "off"):
+            self.kernel.Error("[ssh] Usage: %timing [on|off] [--rusage]")
+            self.retval = ExceptionWrapper("ValueError", repr(state), [])
+            return
+
+        self.kernel.timing = state == "on"
+        self.kernel.timing_rusage = self.kernel.timing and rusage
+
+    @option(
+        "-r",
+        "--restart",
+        action="store_true",
+        default=False,
+        help="Discard a partial transfer instead of resuming it",
+    )
+    def line_upload(self, local, remote=None, restart=False):
+        """
+        %upload [--restart] LOCAL [REMOTE]
+
+        Copy a file from the notebook host to the remote host over SFTP,
+        with parallel streams for large files. A relative REMOTE is in the
+        current remote directory, which is also the default.
+
+        An interrupted transfer is resumed by the same command.
+        Set SSHKERNEL_TRANSFER_STREAMS to change the number of streams.
+
+        Example:
+            %upload data.csv
+            %upload ~/dataset.tar.gz /scratch/
+        """
+
+        self.transfer(True, local, remote, restart)
+
+    @option(
+        "-r",
+        "--restart",
+        action="store_true",
+        default=False,
+        help="Discard a partial transfer instead of resuming it",
+    )
+    def line_download(self, remote, local=None, restart=False):
+        """
+        %download [--restart] REMOTE [LOCAL]
+
+        Copy a file from the remote host to the notebook host over SFTP,
+        with parallel streams for large files. A relative REMOTE is in the
+        current remote directory. LOCAL defaults to the notebook directory.
+
+        An interrupted transfer is resumed by the same command.
+
+        Example:
+            %download results/output.csv
+            %download /var/log/syslog logs/
+        """
+
+        self.transfer(False, remote, local, restart)
+
+    def transfer(self, upload, src, dst, restart):
+        self.retval = None
+        try:
+            result = self.kernel.do_transfer(upload, src, dst, restart=restart)
+        except KeyboardInterrupt:
+            self.kernel.Error("* interrupt... run again to resume")
+            self.retval = ExceptionWrapper("abort", str(1), [str(KeyboardInterrupt)])
+            return
+        except Exception as exc:
+            self.kernel.Error("[ssh] Transfer failed: {}".format(exc))
+            tb = traceback.format_exc().splitlines()
+            self.retval = ExceptionWrapper(type(exc).__name__, str(exc), tb)
+            return
+
+        self.kernel.Print(
+            format_transfer("uploaded" if upload else "downloaded", result)
+        )
+
+    def cell_fanout(self, hosts):
+        """
+        %%fanout HOST[,HOST...]
+
+        Execute the cell on many hosts concurrently, with a new connection
+        per host. Output lines are prefixed with the host, and a summary of
+        exit codes is shown at the end. The current login is not changed.
+
+        Parameters in {} are expanded, and may be comma-separated lists.
+        Set SSHKERNEL_FANOUT_CONCURRENCY to change the number of hosts
+        executed at the same time.
+
+        Example:
+            %param NODES node01,node02,node03
+            %param SSHKERNEL_FANOUT_CONCURRENCY 32
+
+            %%fanout login01,{NODES}
+            uptime
+        """
+
+        self.retval = None
+        code, self.code = self.code, ""
+
+        try:
+            hosts = parse_hosts(expand_parameters(hosts, self.kernel.get_params()))
+            results = self.kernel.do_fanout(hosts, code)
+        except KeyboardInterrupt:
+            self.kernel.Error("* interrupt...")
+            self.retval = ExceptionWrapper("abort", str(1), [str(KeyboardInterrupt)])
+            return
+        except Exception as exc:
+            self.kernel.Error("[ssh] Fanout failed: {}".format(exc))
+            tb = traceback.format_exc().splitlines()
+            self.retval = ExceptionWrapper(type(exc).__name__, str(exc), tb)
+            return
+
+        self.kernel.Print(format_summary(results))
+
+        failed = [r.host for r in results if r.code != 0]
+        if failed:
+            self.retval = ExceptionWrapper(
+                "fanout failed",
+                "{} of {} hosts".format(len(failed), len(results)),
+                failed,
+            )
+
+    def cell_bg(self):
+        """
+        %%bg
+
+        Start the cell as a background job on the remote host, detached
+        from the session, and return at once with the job id. The job
+        survives interrupts, reconnects and the end of the kernel, and its
+        output is kept in ~/.sshkernel/jobs/ID/out on the remote host.
+
+        See the jobs by %jobs, and their output by %attach.
+
+        Example:
+            %%bg
+            make -j8 all
+        """
+
+        self.retval = None
+        code, self.code = self.code, ""
+
+        try:
+            job_id, pid = self.kernel.do_background(code)
+        except Exception as exc:
+            self.kernel.Error("[ssh] Failed to start the job: {}".format(exc))
+            tb = traceback.format_exc().splitlines()
+            self.retval = ExceptionWrapper(type(exc).__name__, str(exc), tb)
+            return
+
+        self.kernel.Print(
+            "[ssh] job {0} started (pid {1}), see %attach {0}".format(job_id, pid)
+        )
+
+    @option(
+        "-c",
+        "--clean",
+        action="store_true",
+        default=False,
+        help="Remove the jobs not running after listing them",
+    )
+    def line_jobs(self, clean=False):
+        """
+        %jobs [--clean]
+
+        List the background jobs started by %%bg on the remote host, with
+        their state, output size, and output not shown by %attach yet.
+
+        Example:
+            %jobs
+        """
+
+        self.retval = None
+        try:
+            jobs = self.kernel.do_jobs(clean)
+        except Exception as exc:
+            self.kernel.Error("[ssh] Failed to list jobs: {}".format(exc))
+            tb = traceback.format_exc().splitlines()
+            self.retval = ExceptionWrapper(type(exc).__name__, str(exc), tb)
+            return
+
+        self.kernel.Print(format_jobs(jobs, self.kernel.job_offsets))
+
+    @option(
+        "-n",
+        "--no-follow",
+        action="store_true",
+        default=False,
+        help="Show the output so far and return, even if the job is running",
+    )
+    @option(
+        "-a",
+        "--all",
+        action="store_true",
+        dest="from_start",
+        default=False,
+        help="Show the output from the beginning",
+    )
+    def line_attach(self, job_id, no_follow=False, from_start=False):
+        """
+        %attach [--no-follow] [--all] ID
+
+        Show the output of a background job not shown yet, and follow it
+        until the job finishes. Interrupting the cell detaches from the job,
+        which keeps running, and the next %attach continues from there.
+
+        Example:
+            %attach 3f2a91bc
+        """
+
+        self.retval = None
+        try:
+            code = self.kernel.do_attach(
+                job_id, follow_output=not no_follow, from_start=from_start
+            )
+        except KeyboardInterrupt:
+            self.kernel.Error(
+                "* detached, job {0} keeps running, see %attach {0}".format(job_id)
+            )
+            return
+        except KeyError:
+            self.kernel.Error("[ssh] No such job: {}".format(job_id))
+            self.retval = ExceptionWrapper("KeyError", repr(job_id), [])
+            return
+        except Exception as exc:
+            self.kernel.Error("[ssh] Failed to attach: {}".format(exc))
+            tb = traceback.format_exc().splitlines()
+            self.retval = ExceptionWrapper(type(exc).__name__, str(exc), tb)
+            return
+
+        if code is None:
+            self.kernel.Print("[ssh] job {} is running".format(job_id))
+        elif code != 0:
+            self.kernel.Error("[ssh] job {} exited with {}".format(job_id, code))
+            self.retval = ExceptionWrapper("job failed", str(code), [job_id])
+
     def post_process(self, retval):
+        capture, self.table_capture = self.table_capture, None
+        if capture is not None:
+            self.finish_capture(*capture)
+            return retval
+
         try:
             return self.retval
         except AttributeError:
             return retval
 
+    def finish_capture(self, name, parser, max_rows):
+        self.kernel.output_tap = None
+
+        table = parser.close()
+        self.kernel.tables[name] = table
+        self.kernel.Display(
+            {
+                "text/html": table.to_html(max_rows),
+                "text/plain": "[ssh] {} = {!r}".format(name, table),
+            }
+        )
+
+
+def format_sessions(kernel):
+    """List sessions with the current one marked by "*"."""
+    sessions = kernel.sessions.sessions()
+    if not sessions:
+        return "[ssh] No sessions."
+
+    now = kernel.sessions.clock()
+    lines = []
+    for session in reversed(sessions):
+        lines.append(
+            "{} {}  host = {}, cwd = {}, idle {:.0f}s".format(
+                "*" if session.name == kernel.session_name else " ",
+                session.name,
+                session.host,
+                session.wrapper.get_cwd(),
+                now - session.last_used,
+            )
+        )
+
+    return "\n".join(lines)
+
+
+def format_ms(seconds):
+    return "{:.1f}ms".format(seconds * 1000)
+
 
 def expand_parameters(host, params):
     """Expand parameters in hostname.
@@ -100,29 +734,32 @@ def expand_parameters(host, params):
     * "target{N}" => "target1"
     * "{host}.{domain} => "host01.example.com"
 
+    Raises:
+        KeyError: If a parameter is not defined
     """
-    pattern = r"\{(.*?)\}"
-
-    def repl(match):
-        param_name = match.group(1)
-        return params[param_name]
-
-    return re.sub(pattern, repl, host)
+    return render(host, params, strict=True, pattern=HOST_PLACEHOLDER)
 
 
 blacklist = re.compile(r".*([^- %,\./:=_a-zA-Z\d@])")
 
+# Settings of local paths, which may start with ~
+PATH_SETTINGS = ("SSHKERNEL_SPOOL_DIR", "SSHKERNEL_TIMING_LOG")
 
-def validate_value_string(val_str):
+
+def validate_value_string(val_str, home=False):
     """Raise if given string contains invalid characters.
 
     Args:
         val_str (str)
+        home (bool): allow a leading ~ of a path in the home directory
 
     Raises:
         ValueError: If `val_str` matches `blacklist`
     """
-    m = re.match(blacklist, str(val_str))
+    val_str = str(val_str)
+    checked = val_str[1:] if home and val_str.startswith("~") else val_str
+
+    m = re.match(blacklist, checked)
     if m:
         msg = "{val} contains invalid character {matched}. Valid characters are A-Z a-z 0-9 - % , . / : = _ @".format(
             val=repr(val_str), matched=repr(m.group(1))
@@ -0,0 +1,486 @@
+"""
+A local daemon to share one authenticated SSH connection per
+(user, host, port) across kernel processes, like OpenSSH ControlMaster.
+
+Start the daemon:
+
+    python -m sshkernel.mux [--socket PATH] [--idle-timeout SECONDS]
+
+and let kernels attach to it with `%param SSHKERNEL_MUX_SOCKET PATH`
+(or the environment variable of the same name) and `%login --persistent`.
+
+Each session channel is a connection to the Unix socket. Messages are
+framed as (kind: 1 byte, length: 4 bytes, payload):
+
+    client => daemon: REQUEST {"host": str, "command": str, "attach": bool}, STDIN
+    daemon => client: HELLO {"reused": bool, "handshake_time": float},
+                      STDOUT, STDERR, EXIT (exit status), FAIL (message)
+"""
+
+import argparse
+import json
+import os
+import select
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from paramiko.ssh_exception import SSHException
+
+from .ssh_wrapper_plumbum import build_remote
+from .ssh_wrapper_plumbum import load_ssh_config_for_plumbum
+
+BUFSIZE = 32768
+
+REQUEST = b"R"
+STDIN = b"I"
+HELLO = b"H"
+STDOUT = b"O"
+STDERR = b"E"
+EXIT = b"X"
+FAIL = b"F"
+
+HEADER = struct.Struct(">cI")
+
+
+def default_socket_path():
+    return os.path.join(
+        tempfile.gettempdir(), "sshkernel-mux-{}.sock".format(os.getuid())
+    )
+
+
+def send_frame(sock, kind, payload=b""):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+class FrameReader:
+    """Split a byte stream into frames."""
+
+    def __init__(self):
+        self._buf = b""
+
+    def feed(self, data):
+        """
+        Returns:
+            list: complete frames [(kind, payload)]
+        """
+        self._buf += data
+        frames = []
+
+        while len(self._buf) >= HEADER.size:
+            kind, length = HEADER.unpack_from(self._buf)
+            start = HEADER.size
+            end = start + length
+            if len(self._buf) < end:
+                break
+
+            frames.append((kind, self._buf[start:end]))
+            self._buf = self._buf[end:]
+
+        return frames
+
+
+class MuxTransport:
+    """
+    Open session channels through the mux daemon,
+    as a replacement of paramiko.Transport.
+    """
+
+    def __init__(self, socket_path, host):
+        self.socket_path = socket_path
+        self.host = host
+        self._attached = False
+
+    def open_session(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+
+        # Only the first channel would need a handshake of its own
+        attach = not self._attached
+        self._attached = True
+
+        return MuxChannel(sock, self.host, attach)
+
+
+class MuxChannel:
+    """
+    A session channel proxied by the mux daemon.
+    It implements the subset of paramiko.Channel used by the wrappers.
+
+    Attributes:
+    * .hello : dict, {"reused": bool, "handshake_time": float} after exec_command()
+    """
+
+    def __init__(self, sock, host, attach=True):
+        self.host = host
+        self.attach = attach
+        self.hello = None
+        self.closed = False
+        self.eof_received = False
+
+        self._sock = sock
+        self._reader = FrameReader()
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+        self._exit_status = None
+
+    def exec_command(self, command):
+        """
+        Raises:
+            SSHException: If the daemon failed to connect or to execute
+        """
+        request = dict(host=self.host, command=command, attach=self.attach)
+        send_frame(self._sock, REQUEST, json.dumps(request).encode("utf-8"))
+
+        while self.hello is None:
+            if self.eof_received:
+                raise SSHException("mux daemon closed the channel")
+            self._pump(block=True)
+
+    def sendall(self, data):
+        send_frame(self._sock, STDIN, data)
+
+    def recv_ready(self):
+        self._pump()
+        return bool(self._stdout)
+
+    def recv(self, size):
+        return self._pop(self._stdout, size)
+
+    def recv_stderr_ready(self):
+        self._pump()
+        return bool(self._stderr)
+
+    def recv_stderr(self, size):
+        return self._pop(self._stderr, size)
+
+    def exit_status_ready(self):
+        self._pump()
+        return self._exit_status is not None
+
+    def recv_exit_status(self):
+        while self._exit_status is None and not self.eof_received:
+            self._pump(block=True)
+
+        return -1 if self._exit_status is None else self._exit_status
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._sock.close()
+
+    # private methods
+    def _pump(self, block=False):
+        if self.eof_received or self.closed:
+            return
+
+        if not block:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if not readable:
+                return
+
+        data = self._sock.recv(BUFSIZE)
+        if not data:
+            self.eof_received = True
+            return
+
+        for kind, payload in self._reader.feed(data):
+            if kind == STDOUT:
+                self._stdout += payload
+            elif kind == STDERR:
+                self._stderr += payload
+            elif kind == EXIT:
+                self._exit_status = int(payload)
+            elif kind == HELLO:
+                self.hello = json.loads(payload.decode("utf-8"))
+            elif kind == FAIL:
+                self.close()
+                raise SSHException(payload.decode("utf-8"))
+
+    @staticmethod
+    def _pop(buf, size):
+        data = bytes(buf[:size])
+        del buf[:size]
+
+        return data
+
+
+class SharedConnection:
+    """A connection shared by channels, closed when idle."""
+
+    def __init__(self, key, remote, handshake_time):
+        self.key = key
+        self.remote = remote
+        self.handshake_time = handshake_time
+        self.refs = 0
+        self.idle_timer = None
+
+    @property
+    def transport(self):
+        return self.remote._client.get_transport()
+
+    def is_active(self):
+        transport = self.transport
+        return transport is not None and transport.is_active()
+
+
+class MuxServer:
+    """
+    Share one connection per (user, host, port) with reference counting.
+    A connection is closed after `idle_timeout` seconds without channels.
+
+    Handshakes run outside the lock, so that a slow or unreachable host does
+    not block other hosts. While connecting, the key holds a Future that
+    callers for the same key wait on.
+
+    Attributes:
+    * .stats : dict, counters of handshakes and reused connections
+    """
+
+    def __init__(self, socket_path, idle_timeout=600.0, connect_function=build_remote):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.connect_function = connect_function
+        self.stats = dict(handshakes=0, reused=0, handshake_time_saved=0.0)
+
+        self._connections = dict()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        mux = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                mux.handle(self.request)
+
+        # Only the owner can connect to the socket
+        umask = os.umask(0o177)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(
+                self.socket_path, Handler
+            )
+        finally:
+            os.umask(umask)
+
+        self._server.daemon_threads = True
+        print("[ssh] mux listening on {}".format(self.socket_path))
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.socket_path)
+
+    def shutdown(self):
+        self._server.shutdown()
+
+        with self._lock:
+            for conn in self._connections.values():
+                if not isinstance(conn, Future):
+                    self._close(conn)
+            self._connections = dict()
+
+    def acquire(self, host, attach=True):
+        """
+        Args:
+            attach (bool): The first channel of a session. Count the handshake saved.
+
+        Returns:
+            (SharedConnection, bool): the connection, and whether it was reused
+
+        Raises:
+            Exception: The error of the handshake, also to callers waiting for it
+        """
+        hostname, plumbum_kwargs, *_ = load_ssh_config_for_plumbum(
+            "~/.ssh/config", host
+        )
+        key = (plumbum_kwargs["user"], hostname, plumbum_kwargs["port"])
+
+        while True:
+            with self._lock:
+                conn = self._connections.get(key)
+                if isinstance(conn, Future):
+                    pending = conn
+                else:
+                    if conn and not conn.is_active():
+                        self._close(conn)
+                        del self._connections[key]
+                        conn = None
+
+                    if conn is not None:
+                        if attach:
+                            self.stats["reused"] += 1
+                            self.stats["handshake_time_saved"] += conn.handshake_time
+                        self._hold(conn)
+                        return conn, True
+
+                    pending = self._connections[key] = Future()
+                    break
+
+            # Another caller is connecting to the host
+            pending.result()
+
+        started = time.monotonic()
+        try:
+            remote = self.connect_function(host)
+        except BaseException as exc:
+            with self._lock:
+                del self._connections[key]
+            pending.set_exception(exc)
+            raise
+
+        conn = SharedConnection(key, remote, time.monotonic() - started)
+        with self._lock:
+            self._connections[key] = conn
+            self.stats["handshakes"] += 1
+            self._hold(conn)
+        pending.set_result(conn)
+
+        return conn, False
+
+    def release(self, conn):
+        with self._lock:
+            conn.refs -= 1
+            if conn.refs == 0:
+                conn.idle_timer = threading.Timer(
+                    self.idle_timeout, self._expire, [conn]
+                )
+                conn.idle_timer.daemon = True
+                conn.idle_timer.start()
+
+    def handle(self, sock):
+        """Serve a session channel for a client."""
+        reader = FrameReader()
+
+        try:
+            frames = []
+            while not frames:
+                data = sock.recv(BUFSIZE)
+                if not data:
+                    return
+                frames = reader.feed(data)
+
+            kind, payload = frames[0]
+            request = json.loads(payload.decode("utf-8"))
+            conn, reused = self.acquire(request["host"], request.get("attach", True))
+        except Exception as exc:
+            send_frame(
+                sock, FAIL, "{}: {}".format(type(exc).__name__, exc).encode("utf-8")
+            )
+            return
+
+        if request.get("attach", True):
+            print(
+                "[ssh] mux attach {} reused={} handshake_time_saved={:.3f}s".format(
+                    conn.key, reused, self.stats["handshake_time_saved"]
+                )
+            )
+
+        channel = None
+        try:
+            channel = conn.transport.open_session()
+            channel.exec_command(request["command"])
+
+            hello = dict(reused=reused, handshake_time=conn.handshake_time)
+            send_frame(sock, HELLO, json.dumps(hello).encode("utf-8"))
+
+            for kind, payload in frames[1:]:
+                if kind == STDIN:
+                    channel.sendall(payload)
+
+            self._proxy(sock, channel, reader)
+        except (OSError, SSHException) as exc:
+            try:
+                send_frame(sock, FAIL, str(exc).encode("utf-8"))
+            except OSError:
+                pass
+        finally:
+            if channel:
+                channel.close()
+            self.release(conn)
+
+    # private methods
+    def _proxy(self, sock, channel, reader):
+        while True:
+            readable, _, _ = select.select([sock, channel], [], [], 1.0)
+
+            if sock in readable:
+                data = sock.recv(BUFSIZE)
+                if not data:
+                    # The client closed the channel
+                    return
+
+                for kind, payload in reader.feed(data):
+                    if kind == STDIN:
+                        channel.sendall(payload)
+
+            while channel.recv_stderr_ready():
+                send_frame(sock, STDERR, channel.recv_stderr(BUFSIZE))
+
+            while channel.recv_ready():
+                send_frame(sock, STDOUT, channel.recv(BUFSIZE))
+
+            if channel.eof_received or channel.closed:
+                if not (channel.recv_ready() or channel.recv_stderr_ready()):
+                    status = channel.recv_exit_status()
+                    send_frame(sock, EXIT, str(status).encode("utf-8"))
+                    return
+
+    def _expire(self, conn):
+        with self._lock:
+            if conn.refs or self._connections.get(conn.key) is not conn:
+                return
+
+            print("[ssh] mux closing idle connection {}".format(conn.key))
+            self._close(conn)
+            del self._connections[conn.key]
+
+    @staticmethod
+    def _hold(conn):
+        if conn.idle_timer:
+            conn.idle_timer.cancel()
+            conn.idle_timer = None
+        conn.refs += 1
+
+    @staticmethod
+    def _close(conn):
+        if conn.idle_timer:
+            conn.idle_timer.cancel()
+        conn.remote.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Share SSH connections across sshkernels"
+    )
+    parser.add_argument(
+        "--socket", default=default_socket_path(), help="Unix socket path"
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=600.0,
+        help="Seconds to keep a connection without channels",
+    )
+    args = parser.parse_args(argv)
+
+    server = MuxServer(args.socket, idle_timeout=args.idle_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
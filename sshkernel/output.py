@@ -0,0 +1,197 @@
+import collections
+import contextvars
+import threading
+
+
+class OutputBuffer:
+    """
+    Coalesce small writes into larger chunks.
+
+    Buffered text is passed to `write_function` (stdout) or `error_function`
+    (stderr) when its size reaches `flush_size`, `flush_interval` seconds
+    after the first buffered write, or when the stream changes.
+    After `limit` characters, further output is dropped and a summary is
+    written at `close()`, followed by the last `tail_size` characters dropped.
+    With `capture_size`, the last characters of each stream are also kept
+    in `captured` for later inspection.
+    With `spool`, all output is also written to it, to be read by `%output`.
+    With `tap`, stdout is passed to it instead of `write_function`, without
+    `limit`, e.g. to be parsed by `%%capture_table`.
+
+    Usage:
+        with OutputBuffer(kernel.Write, kernel.WriteError) as output:
+            wrapper.exec_command(cmd, output.write, output.write_error)
+    """
+
+    def __init__(
+        self,
+        write_function,
+        error_function=None,
+        flush_interval=0.05,
+        flush_size=65536,
+        limit=None,
+        capture_size=0,
+        tail_size=0,
+        spool=None,
+        tap=None,
+    ):
+        self.write_functions = dict(
+            stdout=write_function, stderr=error_function or write_function
+        )
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.limit = limit
+        self.spool = spool
+        self.tap = tap
+
+        self.written = 0
+        self.dropped = 0
+        self.dropped_lines = 0
+        self.captured = dict()
+        if capture_size:
+            self.captured = dict(
+                stdout=RingBuffer(capture_size), stderr=RingBuffer(capture_size)
+            )
+        self.tail = RingBuffer(tail_size) if tail_size else None
+
+        self._buffer = []
+        self._size = 0
+        self._stream = "stdout"
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def write(self, text):
+        self._write(text, "stdout")
+
+    def write_error(self, text):
+        self._write(text, "stderr")
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+        if self.spool:
+            self.spool.close()
+
+        if self.dropped:
+            tail = self._tail()
+            summary = "\n[ssh] Output truncated: {} characters ({} lines) omitted{}\n"
+            self.write_functions["stdout"](
+                summary.format(
+                    self.dropped - len(tail),
+                    self.dropped_lines - tail.count("\n"),
+                    ", see %output {}".format(self.spool.label) if self.spool else "",
+                )
+                + tail
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # private methods
+    def _write(self, text, stream):
+        with self._lock:
+            if self.captured:
+                self.captured[stream].append(text)
+            if self.spool:
+                self.spool.write(text)
+            if self.tap and stream == "stdout":
+                self.tap(text)
+                return
+
+            if self.limit is not None:
+                room = self.limit - self.written - self._size
+                if room < len(text):
+                    kept = max(room, 0)
+                    dropped = text[kept:]
+                    self.dropped += len(dropped)
+                    self.dropped_lines += dropped.count("\n")
+                    if self.tail is not None:
+                        self.tail.append(dropped)
+                    text = text[:kept]
+                    if not text:
+                        return
+
+            if stream != self._stream:
+                self._flush()
+                self._stream = stream
+
+            self._buffer.append(text)
+            self._size += len(text)
+
+            if self._size >= self.flush_size:
+                self._flush()
+            elif self._timer is None:
+                # Flush in the context of the writer, where the kernel
+                # finds the request of the output
+                self._timer = threading.Timer(
+                    self.flush_interval,
+                    contextvars.copy_context().run,
+                    (self.flush,),
+                )
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _tail(self):
+        """The tail of dropped output from the start of a line."""
+        if self.tail is None:
+            return ""
+
+        text = self.tail.getvalue()
+        if len(text) < self.dropped:
+            start = text.find("\n") + 1
+            text = text[start:]
+
+        return text
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._buffer:
+            return
+
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self.written += len(text)
+
+        self.write_functions[self._stream](text)
+
+
+class RingBuffer:
+    """
+    Keep the last `size` characters of appended chunks.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.total = 0
+
+        self._chunks = collections.deque()
+        self._length = 0
+
+    def append(self, text):
+        self._chunks.append(text)
+        self._length += len(text)
+        self.total += len(text)
+
+        # Keep whole chunks, the head is trimmed in getvalue()
+        while self._length - len(self._chunks[0]) >= self.size:
+            self._length -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        text = "".join(self._chunks)
+        extra = max(len(text) - self.size, 0)
+
+        return text[extra:]
+
+    def __len__(self):
+        return min(self._length, self.size)
@@ -0,0 +1,122 @@
+import select
+import shlex
+import threading
+import time
+
+from .exception import SSHKernelQueryError
+from .exception import SSHKernelQueryTimeout
+
+BUFSIZE = 32768
+
+
+class QueryShell:
+    """
+    A non-interactive bash on its own channel to run side queries,
+    e.g. completion and introspection.
+
+    The shell is opened on the first query and reused for the following ones.
+    Each query runs in a subshell with the given cwd and environment,
+    so that it never changes the state of the main session.
+    A query exceeding the timeout closes the shell, a new one is opened
+    for the next query.
+
+    Usage:
+        shell = QueryShell(client.get_transport())
+        lines = shell.run("compgen -c ls", cwd="/tmp", timeout=5.0)
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._channel = None
+        self._lock = threading.Lock()
+
+    def run(self, cmd, cwd=None, env=dict(), unset=(), timeout=5.0):
+        """
+        Returns:
+            list: lines of stdout. stderr is discarded.
+
+        Raises:
+            SSHKernelQueryTimeout: If the query does not finish in `timeout` seconds
+            SSHKernelQueryError: If the shell is closed
+        """
+        with self._lock:
+            if self._channel is None or self._channel.closed:
+                self._open()
+
+            marker = str(time.time())[::-1]
+            self._channel.sendall(
+                wrap_query(cmd, marker, cwd, env, unset).encode("utf-8")
+            )
+
+            try:
+                out = self._read_until(marker + "\n", time.monotonic() + timeout)
+            except SSHKernelQueryError:
+                self._close()
+                raise
+
+        return out.decode("utf-8", errors="replace").splitlines()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    # private methods
+    def _open(self):
+        channel = self._transport.open_session()
+        channel.exec_command("bash --noprofile --norc")
+        self._channel = channel
+
+    def _close(self):
+        if self._channel:
+            self._channel.close()
+            self._channel = None
+
+    def _read_until(self, end, deadline):
+        end = end.encode("utf-8")
+        buf = b""
+
+        while not buf.endswith(end):
+            if self._channel.recv_stderr_ready():
+                # e.g. syntax errors of the query itself
+                self._channel.recv_stderr(BUFSIZE)
+                continue
+
+            if self._channel.recv_ready():
+                buf += self._channel.recv(BUFSIZE)
+                continue
+
+            if self._channel.eof_received or self._channel.closed:
+                raise SSHKernelQueryError("query channel is closed")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SSHKernelQueryTimeout("query timed out")
+
+            select.select([self._channel], [], [], remaining)
+
+        return buf[: -len(end)]
+
+
+def wrap_query(cmd, marker, cwd=None, env=dict(), unset=()):
+    """
+    Wrap `cmd` to be run in a subshell of the query shell.
+
+    Returns:
+        str: script
+    """
+    setup = []
+    if cwd:
+        setup.append("cd -- {} 2>/dev/null".format(shlex.quote(cwd)))
+    if unset:
+        setup.append("unset {}".format(" ".join(sorted(unset))))
+    setup += ["export {}={}".format(k, shlex.quote(v)) for k, v in env.items()]
+
+    script = """
+(
+{setup}
+{cmd}
+) </dev/null 2>/dev/null
+printf '%s\\n' {marker}
+""".format(setup="\n".join(setup), cmd=cmd, marker=marker)
+
+    return script
@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+
+from .completion import CompletionCache
+
+DEFAULT_SESSION = "default"
+
+
+class Session:
+    """
+    A named live login.
+
+    Attributes:
+    * .wrapper : SSHWrapper, keeps its own cwd and environment
+    * .completion_cache : CompletionCache, kept warm while switched away
+    * .last_used : time of the last use by the clock of the registry
+    """
+
+    def __init__(self, name, host, wrapper, completion_cache, last_used):
+        self.name = name
+        self.host = host
+        self.wrapper = wrapper
+        self.completion_cache = completion_cache
+        self.last_used = last_used
+
+
+class SessionRegistry:
+    """
+    Named live sessions, ordered from the least recently used.
+
+    The registry only keeps sessions, closing evicted ones is up to the caller.
+
+    Usage:
+        evicted = registry.add("db", "dbhost", wrapper, max_sessions=8)
+        session = registry.get("db")
+        idle = registry.expire(3600.0, keep="db")
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._sessions = OrderedDict()
+
+    def add(self, name, host, wrapper, max_sessions=8, completion_ttl=60.0):
+        """
+        Add a session as the most recently used one.
+
+        Returns:
+            list: Sessions evicted to keep `max_sessions`, the least recently used first
+        """
+        self._sessions.pop(name, None)
+        self._sessions[name] = Session(
+            name, host, wrapper, CompletionCache(ttl=completion_ttl), self.clock()
+        )
+
+        evicted = []
+        while len(self._sessions) > max(max_sessions, 1):
+            _, session = self._sessions.popitem(last=False)
+            evicted.append(session)
+
+        return evicted
+
+    def get(self, name):
+        """
+        Get a session, and mark it as the most recently used.
+
+        Raises:
+            KeyError: If no session has the name
+        """
+        session = self._sessions[name]
+        self.touch(name)
+
+        return session
+
+    def touch(self, name):
+        if name in self._sessions:
+            self._sessions.move_to_end(name)
+            self._sessions[name].last_used = self.clock()
+
+    def remove(self, name):
+        """
+        Returns:
+            Session: removed session, or None if not found
+        """
+        return self._sessions.pop(name, None)
+
+    def expire(self, idle_timeout, keep=None):
+        """
+        Remove sessions unused for `idle_timeout` seconds, except `keep`.
+
+        Returns:
+            list: removed Sessions
+        """
+        deadline = self.clock() - idle_timeout
+        expired = [
+            session
+            for name, session in self._sessions.items()
+            if name != keep and session.last_used < deadline
+        ]
+        for session in expired:
+            del self._sessions[session.name]
+
+        return expired
+
+    def sessions(self):
+        """
+        Returns:
+            list: Sessions from the least recently used
+        """
+        return list(self._sessions.values())
+
+    def __contains__(self, name):
+        return name in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,289 @@
+import collections
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+# Bytes scanned at a time to count lines
+BLOCK_SIZE = 1024 * 1024
+
+
+class Spool:
+    """
+    The full output of a cell, in the order received, in a local file.
+
+    Usage:
+        spool = registry.create(12)
+        spool.write("line\\n")
+        spool.close()
+    """
+
+    def __init__(self, label, path):
+        self.label = label
+        self.path = path
+        self.size = 0
+
+        self._file = open(path, "wb")
+
+    def write(self, text):
+        data = text.encode("utf-8", errors="replace")
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+
+class SpoolRegistry:
+    """
+    Spool files of the last `keep` cells in `directory`, a temporary
+    directory by default. Older files are removed.
+    """
+
+    def __init__(self, directory="", keep=20):
+        self.directory = directory
+        self.keep = keep
+
+        self._spools = collections.OrderedDict()
+        self._tempdir = None
+
+    def create(self, label):
+        directory = self.directory or self._temporary_directory()
+        os.makedirs(directory, exist_ok=True)
+
+        spool = Spool(label, os.path.join(directory, "cell-{}.log".format(label)))
+        self._spools.pop(label, None)
+        self._spools[label] = spool
+
+        while len(self._spools) > self.keep:
+            _, old = self._spools.popitem(last=False)
+            remove_file(old.path)
+
+        return spool
+
+    def get(self, label=None):
+        """
+        Returns:
+            Spool of the cell `label`, or the last one if None
+
+        Raises:
+            KeyError: If not spooled or already removed
+        """
+        if label is None:
+            if not self._spools:
+                raise KeyError(label)
+            label = next(reversed(self._spools))
+
+        return self._spools[label]
+
+    def clear(self):
+        for spool in self._spools.values():
+            remove_file(spool.path)
+        self._spools.clear()
+
+        if self._tempdir:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+    def _temporary_directory(self):
+        if self._tempdir is None:
+            self._tempdir = tempfile.mkdtemp(prefix="sshkernel-spool-")
+
+        return self._tempdir
+
+
+class SpoolReader:
+    """
+    Read lines of a spool file through a memory map,
+    without loading it into memory.
+
+    Lines are numbered from 1.
+
+    Usage:
+        with SpoolReader(spool.path) as reader:
+            for lineno, line in reader.grep("ERROR", first=1, last=1000):
+                print(lineno, line)
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+
+        # An empty file can not be mapped
+        self._map = b""
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._line_count = None
+
+    def close(self):
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def line_count(self):
+        if self._line_count is None:
+            count = 0
+            for pos in range(0, self.size, BLOCK_SIZE):
+                end = pos + BLOCK_SIZE
+                count += self._map[pos:end].count(b"\n")
+
+            # The last line may not end with a newline
+            last = self.size - 1
+            if self.size and self._map[last:] != b"\n":
+                count += 1
+            self._line_count = count
+
+        return self._line_count
+
+    def offset(self, lineno):
+        """Byte offset where the line `lineno` starts."""
+        remaining = lineno - 1
+        pos = 0
+        while remaining > 0 and pos < self.size:
+            end = pos + BLOCK_SIZE
+            block = self._map[pos:end]
+            count = block.count(b"\n")
+            if count < remaining:
+                remaining -= count
+                pos += len(block)
+                continue
+
+            index = -1
+            for _ in range(remaining):
+                index = block.find(b"\n", index + 1)
+            return pos + index + 1
+
+        return min(pos, self.size)
+
+    def lines(self, first=1, last=None):
+        """
+        Yields:
+            (int, str): line number and line without the newline,
+                from `first` to `last` inclusive
+        """
+        pos = self.offset(first)
+        lineno = first
+        while pos < self.size and (last is None or lineno <= last):
+            end = self._map.find(b"\n", pos)
+            if end < 0:
+                end = self.size
+
+            yield lineno, decode(self._map[pos:end])
+            pos = end + 1
+            lineno += 1
+
+    def grep(self, pattern, first=1, last=None):
+        """
+        Yields:
+            (int, str): line number and line matching the regular expression
+                `pattern`, from `first` to `last` inclusive
+        """
+        regex = re.compile(pattern.encode("utf-8"), re.MULTILINE)
+
+        start = self.offset(first)
+        end = self.size if last is None else self.offset(last + 1)
+
+        lineno, counted = first, start
+        previous = None
+        for match in regex.finditer(self._map, start, end):
+            line_start = self._map.rfind(b"\n", 0, match.start()) + 1
+            if line_start == previous:
+                # Another match in the same line
+                continue
+
+            lineno += self._map[counted:line_start].count(b"\n")
+            counted = previous = line_start
+
+            line_end = self._map.find(b"\n", match.start())
+            if line_end < 0 or line_end > end:
+                line_end = end
+
+            yield lineno, decode(self._map[line_start:line_end])
+
+
+def parse_range(text, line_count):
+    """Parse "a:b" into line numbers, inclusive.
+
+    Either side may be omitted, and negative numbers count from the last line.
+
+    Examples:
+        "10:20" => (10, 20), "-5:" => (line_count - 4, line_count)
+
+    Raises:
+        ValueError: If not in the form
+    """
+    match = re.match(r"^(-?\d*):(-?\d*)$", text.strip())
+    if not match:
+        raise ValueError("Range must be a:b, got {!r}".format(text))
+
+    def lineno(value, default):
+        if not value:
+            return default
+
+        n = int(value)
+        return line_count + n + 1 if n < 0 else n
+
+    first = max(lineno(match.group(1), 1), 1)
+    last = min(lineno(match.group(2), line_count), line_count)
+
+    return first, last
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def decode(data):
+    return data.decode("utf-8", errors="replace")
+
+
+def format_page(spool, grep=None, lines_range=None, max_lines=100):
+    """
+    Lines of a spool in `lines_range` ("a:b"), or those matching `grep`,
+    up to `max_lines`, prefixed with line numbers.
+
+    Returns:
+        str
+    """
+    with SpoolReader(spool.path) as reader:
+        count = reader.line_count()
+        first, last = parse_range(lines_range or ":", count)
+
+        if grep:
+            found = reader.grep(grep, first, last)
+        else:
+            found = reader.lines(first, last)
+
+        lines = [
+            "[ssh] %output {}: {} bytes, {} lines in {}".format(
+                spool.label, reader.size, count, spool.path
+            )
+        ]
+        shown = None
+        for lineno, line in found:
+            if len(lines) > max_lines:
+                lines.append(
+                    "[ssh] More lines from {0}, see %output {1} --range {0}:".format(
+                        lineno, spool.label
+                    )
+                )
+                break
+
+            lines.append("{:>7}  {}".format(lineno, line))
+            shown = lineno
+
+    if shown is None:
+        lines.append("[ssh] No lines{}.".format(" matching" if grep else ""))
+
+    return "\n".join(lines)
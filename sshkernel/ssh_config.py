@@ -0,0 +1,163 @@
+import copy
+import glob
+import io
+import os
+import re
+import threading
+from collections import defaultdict
+
+import paramiko
+
+# Parsed configs by path
+_cache = dict()
+_cache_lock = threading.Lock()
+
+include_pattern = re.compile(r"\s*include(?:\s*=\s*|\s+)(.*)$", re.IGNORECASE)
+
+# Nesting limit of Include, same as OpenSSH
+MAX_INCLUDE_DEPTH = 16
+
+
+def load_ssh_config(filename):
+    """Load a parsed ssh_config, reusing the last one if no file is modified.
+
+    Args:
+        filename (str): path of ssh_config, e.g. "~/.ssh/config"
+
+    Returns:
+        CachedSSHConfig
+    """
+    path = os.path.expanduser(filename)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is None or not cached.is_fresh():
+            cached = CachedSSHConfig(path)
+            _cache[path] = cached
+
+    return cached
+
+
+class CachedSSHConfig:
+    """
+    A parsed ssh_config with `Include` files expanded, and a lookup index.
+
+    Host blocks which consist of exact names only are indexed by name,
+    so a lookup applies them and the rest blocks (patterns and `Match`) only.
+    Results are memoized unless the config has `Match` blocks.
+
+    Attributes:
+    * .files : list of (path, (mtime_ns, size)) which the config is read from
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        paths = []
+        text = read_config(path, paths)
+        self.files = [(p, file_signature(p)) for p in paths]
+
+        self.config = paramiko.SSHConfig()
+        self.config.parse(io.StringIO(text))
+
+        contexts = self.config._config
+        self._exact = defaultdict(list)
+        self._general = []
+        for i, context in enumerate(contexts):
+            hosts = context.get("host", [])
+            if hosts and "matches" not in context and not any(map(has_pattern, hosts)):
+                for host in hosts:
+                    self._exact[host].append(i)
+            else:
+                self._general.append(i)
+
+        # A lookup with canonicalization may need blocks of another name
+        self._indexed = not any(
+            "canonicalizehostname" in context["config"] for context in contexts
+        )
+        self._memoize = not any("matches" in context for context in contexts)
+        self._lookups = dict()
+
+    def is_fresh(self):
+        return all(file_signature(p) == signature for p, signature in self.files)
+
+    def lookup(self, host):
+        """Same as `paramiko.SSHConfig.lookup(host)`
+
+        Returns:
+            paramiko.config.SSHConfigDict
+        """
+        if host in self._lookups:
+            return copy.deepcopy(self._lookups[host])
+
+        if self._indexed:
+            contexts = self.config._config
+            indices = sorted(self._exact.get(host, []) + self._general)
+
+            conf = paramiko.SSHConfig()
+            conf._config = [contexts[i] for i in indices]
+        else:
+            conf = self.config
+
+        options = conf.lookup(host)
+        if self._memoize:
+            self._lookups[host] = copy.deepcopy(options)
+
+        return options
+
+
+def read_config(path, paths, depth=0):
+    """Read ssh_config with `Include` files expanded inline.
+
+    Args:
+        paths (list): appended with the paths read,
+            and directories of glob patterns to detect new files
+
+    Returns:
+        str: config text
+    """
+    paths.append(path)
+    if not os.path.isfile(path):
+        return ""
+
+    lines = []
+    with open(path) as ssh_config:
+        for line in ssh_config:
+            m = include_pattern.match(line)
+            if not m:
+                lines.append(line)
+                continue
+
+            if depth >= MAX_INCLUDE_DEPTH:
+                continue
+
+            for pattern in m.group(1).split():
+                # Relative paths are relative to ~/.ssh,
+                # same as the user config of OpenSSH
+                pattern = os.path.join(
+                    os.path.expanduser("~/.ssh"), os.path.expanduser(pattern)
+                )
+                if glob.has_magic(pattern):
+                    paths.append(os.path.dirname(pattern))
+                    included = sorted(glob.glob(pattern))
+                else:
+                    included = [pattern]
+
+                for p in included:
+                    lines.append(read_config(p, paths, depth + 1))
+                    lines.append("\n")
+
+    return "".join(lines)
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return (st.st_mtime_ns, st.st_size)
+
+
+def has_pattern(host):
+    return any(c in host for c in "*?[!")
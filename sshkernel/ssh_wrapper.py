@@ -10,16 +10,29 @@ class SSHWrapper(ABC):
         """
 
     @abstractmethod
-    def exec_command(self, cmd, print_function):
+    def exec_command(self, cmd, print_function, error_function=None):
         """
         Args:
             cmd (string)
-            print_function (lambda)
+            print_function (lambda): called with stdout
+            error_function (lambda): called with stderr, defaults to `print_function`
 
         Returns:
             int: exit code
         """
 
+    @abstractmethod
+    def query(self, cmd, timeout):
+        """
+        Run a side query without changing the state of the session
+
+        Returns:
+            list: lines of stdout
+
+        Raises:
+            SSHKernelQueryError
+        """
+
     @abstractmethod
     def connect(self, host):
         """
@@ -29,6 +42,15 @@ class SSHWrapper(ABC):
             SSHConnectionError
         """
 
+    @abstractmethod
+    def reconnect(self):
+        """
+        Connect to the last host again, and restore the session state
+
+        Raises:
+            SSHConnectionError
+        """
+
     @abstractmethod
     def close(self):
         """
@@ -36,9 +58,41 @@ class SSHWrapper(ABC):
         """
 
     @abstractmethod
-    def interrupt(self):
+    def interrupt(self, timeouts=(2.0, 5.0)):
+        """
+        Send SIGINT to halt current execution,
+        escalated to SIGTERM and SIGKILL after each of `timeouts` seconds
+
+        Returns:
+            dict: {"signal": the last signal sent, "elapsed": seconds}
+            or None if nothing was signaled
         """
-        Send SIGINT to halt current execution
+
+    @abstractmethod
+    def get_transport(self):
+        """
+        Transport of the connection, to be probed by keepalive
+
+        Returns:
+            paramiko.Transport or None if not available
+        """
+
+    @abstractmethod
+    def open_sftp(self):
+        """
+        Open an SFTP session on a new channel of the connection
+
+        Returns:
+            paramiko.SFTPClient
+        """
+
+    @abstractmethod
+    def open_channel(self):
+        """
+        Open a session channel of the connection, e.g. to follow a background job
+
+        Returns:
+            paramiko.Channel
         """
 
     @abstractmethod
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from .channel import ChannelReader
+from .channel import aiter_channel
+from .interrupt import DEFAULT_TIMEOUTS
+from .ssh_wrapper_plumbum import OutputRouter
+from .ssh_wrapper_plumbum import SSHWrapperPlumbum
+from .ssh_wrapper_plumbum import append_footer
+from .timing import CellTimer
+
+
+class SSHWrapperAsync(SSHWrapperPlumbum):
+    """
+    A plumbum remote machine wrapper driven by asyncio
+    SSHWrapperAsync reads the channel of a cell from the asyncio event loop
+    instead of blocking the calling thread, and interrupts the cell when
+    the task is cancelled.
+
+    Attributes:
+    * .interrupt_timeouts : timeouts to escalate the signal of a cancelled cell
+    * .last_interrupt : result of `interrupt` for the last cancelled cell
+
+    Usage:
+        SSHKernel(sshwrapper_class=SSHWrapperAsync)
+    """
+
+    interrupt_timeouts = DEFAULT_TIMEOUTS
+    last_interrupt = None
+
+    async def exec_command_async(self, cmd, print_function, error_function=None):
+        """
+        Same as `exec_command`, as a coroutine.
+
+        Raises:
+            asyncio.CancelledError: After interrupting the cell
+        """
+
+        timer = self.last_timing = CellTimer()
+        print_function("[ssh] host = {}, cwd = {}\n".format(self._host, self.get_cwd()))
+
+        marker = str(time.time())[::-1]
+        full_command = append_footer(cmd, marker, self._env_removed, self.rusage)
+        timer.count("sent", len(full_command.encode("utf-8")))
+
+        # Opening a channel waits for the server
+        loop = asyncio.get_running_loop()
+        proc = await loop.run_in_executor(
+            None, self._remote["bash"]["-c", full_command].popen
+        )
+        self._update_interrupt_function(proc)
+        self.last_interrupt = None
+        timer.mark("channel_open")
+
+        reader = ChannelReader(proc.channel)
+        router = OutputRouter(
+            marker,
+            print_function,
+            error_function,
+            header_function=self._timed_header_function(timer),
+            timer=timer,
+        )
+        try:
+            async for stdout, stderr in aiter_channel(proc.channel, reader=reader):
+                router.feed(stdout, stderr)
+        except asyncio.CancelledError:
+            # Waiting for the escalation must not block the event loop
+            self.last_interrupt = await loop.run_in_executor(
+                None, self.interrupt, self.interrupt_timeouts
+            )
+            raise
+
+        return self._finish_cell(router.finish(), reader, timer)
+
+    def exec_command(self, cmd, print_function, error_function=None):
+        """
+        Run `exec_command_async` in a new event loop,
+        for callers without a running loop, e.g. `%%fanout` workers.
+        """
+        return asyncio.run(self.exec_command_async(cmd, print_function, error_function))
@@ -0,0 +1,318 @@
+import re
+import time
+
+from .channel import ChannelReader
+from .channel import iter_channel
+from .exception import SSHKernelNotConnectedException
+from .exception import SSHKernelTransferError
+from .interrupt import DEFAULT_TIMEOUTS
+from .interrupt import escalation_script
+from .interrupt import signal_remote
+from .mux import MuxTransport
+from .query import QueryShell
+from .ssh_wrapper_plumbum import SSHWrapperPlumbum
+from .ssh_wrapper_plumbum import process_output
+from .ssh_wrapper_plumbum import volatile_env_variables
+from .timing import CellTimer
+
+
+class SSHWrapperPersistent(SSHWrapperPlumbum):
+    """
+    A persistent remote shell wrapper
+    SSHWrapperPersistent keeps one bash process alive on a single channel
+    for the life of the login, and feeds cells into its stdin.
+
+    Shell state (functions, aliases, `set` options, background jobs)
+    survives between cells, so the environment is not shipped back and forth.
+
+    With `mux_socket`, channels are opened through the mux daemon
+    (see sshkernel.mux) instead of a connection of its own.
+
+    Attributes:
+    * ._remote : plumbum.machines.paramiko_machine.ParamikoMachine, None with mux
+    * ._transport: paramiko.Transport or sshkernel.mux.MuxTransport
+    * ._channel: paramiko.Channel running the long-lived bash
+    * .mux_hello : dict, {"reused", "handshake_time"} of the mux, or None
+    """
+
+    def __init__(self, envdelta_init=dict(), mux_socket=None):
+        super().__init__(envdelta_init)
+        self.mux_socket = mux_socket
+        self.mux_hello = None
+        self._transport = None
+        self._channel = None
+        self._cwd = ""
+        self._shell_pid = None
+        self._pending_marker = None
+        self._env_login = None
+
+    def exec_command(self, cmd, print_function, error_function=None):
+        """
+        Args:
+            error_function: callback fn for stderr, defaults to `print_function`
+
+        Returns:
+          int: exit_code
+            * Return the last command exit_code
+            * Return 1 if failed to execute a command
+        """
+
+        if self._pending_marker:
+            # Output of an interrupted cell is still in the channel
+            self._drain(self._pending_marker, print_function, error_function)
+
+        print_function("[ssh] host = {}, cwd = {}\n".format(self._host, self.get_cwd()))
+
+        return self._run_cell(cmd, print_function, error_function)
+
+    def connect(self, host):
+        if self.mux_socket:
+            self.close()
+            self._transport = MuxTransport(self.mux_socket, host)
+            self._host = host
+        else:
+            super().connect(host)
+            self._transport = self._remote._client.get_transport()
+
+        channel = self._transport.open_session()
+        # An interactive shell aborts the current cell on SIGINT but survives it
+        channel.exec_command("bash --noediting -i")
+        self._channel = channel
+
+        self.mux_hello = channel.hello if self.mux_socket else None
+
+        self._env_login = None
+        self._env_last = None
+        self._env_fingerprint = ""
+
+        envdelta = {**self.envdelta_init, "PAGER": "cat"}
+        init = ["PS1= PS2= PROMPT_COMMAND=", "set +o history"]
+        init += ["export {}={}".format(k, quote(v)) for k, v in envdelta.items()]
+        init += ["echo pid=$$"]
+
+        chunks = []
+        self._run_cell("\n".join(init), chunks.append)
+        # The prompt on stderr may precede the line
+        self._shell_pid = int(re.search(r"pid=(\d+)\n", "".join(chunks)).group(1))
+
+    def close(self):
+        if self._channel:
+            self._channel.close()
+            self._channel = None
+
+        super().close()
+
+    def isconnected(self):
+        if not self._channel:
+            return False
+
+        channel = self._channel
+        return not (
+            channel.closed or channel.eof_received or channel.exit_status_ready()
+        )
+
+    def reconnect(self):
+        """
+        Start a new shell on the last host, and restore the last known cwd and
+        the environment variables changed since login.
+
+        Functions, aliases and options defined in the lost shell are not restored.
+        """
+        cwd = self._cwd
+        changed, removed = self._env_delta()
+
+        try:
+            self.close()
+        except Exception:
+            # The old connection may be broken
+            pass
+        self._remote = None
+        self._pending_marker = None
+
+        self.connect(self._host)
+
+        restore = ["unset {}".format(k) for k in sorted(removed)]
+        restore += ["export {}={}".format(k, quote(v)) for k, v in changed.items()]
+        if cwd:
+            restore += ["cd -- {}".format(quote(cwd))]
+        if restore:
+            self._run_cell("\n".join(restore), lambda _: None)
+
+    def query(self, cmd, timeout=5.0):
+        """
+        Run `cmd` on a side channel, in the current cwd and environment variables.
+
+        Returns:
+            list: lines of stdout
+
+        Raises:
+            SSHKernelQueryError: If failed or timed out
+        """
+        if self._query_shell is None:
+            self._query_shell = QueryShell(self._transport)
+
+        changed, removed = self._env_delta()
+        envdelta = {**self.envdelta_init, "PAGER": "cat", **changed}
+
+        return self._query_shell.run(
+            cmd, cwd=self._cwd, env=envdelta, unset=removed, timeout=timeout
+        )
+
+    def open_sftp(self):
+        if self.mux_socket:
+            raise SSHKernelTransferError("SFTP is not available through the mux daemon")
+
+        return super().open_sftp()
+
+    def open_channel(self):
+        if self._transport is None:
+            raise SSHKernelNotConnectedException("Not connected")
+
+        # A mux channel when the connection is shared
+        return self._transport.open_session()
+
+    def get_cwd(self):
+        return self._cwd
+
+    def update_workdir(self, newdir):
+        if newdir != self._cwd:
+            if self._cwd:
+                print("[ssh] new cwd: {}".format(newdir))
+            self._cwd = newdir
+
+    def update_env(self, newenv):
+        # The remote shell keeps its own environment, it is only tracked
+        self._env_last = newenv
+        if self._env_login is None:
+            self._env_login = newenv
+
+    def post_exec_command(self, footer):
+        """Receive footer records, update instance state with its value
+
+        Return:
+            int: exit_code
+        """
+        self.update_workdir(footer["pwd"])
+        self._env_fingerprint = footer.get("sum", "")
+        if footer.get("env") is not None:
+            self.update_env(footer["env"])
+        if "names" in footer:
+            self._session_names = footer["names"].split()
+
+        if "code" in footer:
+            return footer["code"]
+        else:
+            print("[ssh] Error: Cannot parse exit_code. As a result, returing code=1")
+            return 1
+
+    # private methods
+    def _env_delta(self):
+        """Environment variables changed and removed since login."""
+        login, last = self._env_login or dict(), self._env_last or dict()
+
+        changed = {
+            k: v
+            for k, v in last.items()
+            if login.get(k) != v and k not in volatile_env_variables
+        }
+        removed = login.keys() - last.keys() - volatile_env_variables
+
+        return changed, removed
+
+    def _run_cell(self, cmd, print_function, error_function=None):
+        timer = self.last_timing = CellTimer()
+        marker = str(time.time())[::-1]
+        script = wrap_cell(cmd, marker, self._env_fingerprint).encode("utf-8")
+        self._channel.sendall(script)
+        self._pending_marker = marker
+        self._update_interrupt_function()
+        timer.count("sent", len(script))
+        timer.mark("send")
+
+        reader = ChannelReader(self._channel)
+        env_info = process_output(
+            iter_channel(self._channel, reader=reader),
+            marker,
+            print_function,
+            error_function,
+            stderr_footer=True,
+            timer=timer,
+        )
+        self._pending_marker = None
+
+        # The shell is already running, and `times` would be of the whole session
+        return self._finish_cell(env_info, reader, timer)
+
+    def _drain(self, marker, print_function, error_function=None):
+        env_info = process_output(
+            iter_channel(self._channel),
+            marker,
+            print_function,
+            error_function,
+            stderr_footer=True,
+        )
+        self._pending_marker = None
+
+        if env_info:
+            self.post_exec_command(env_info)
+
+    def _update_interrupt_function(self):
+        transport = self._transport
+        pid = self._shell_pid
+
+        def to_interrupt(timeouts=DEFAULT_TIMEOUTS):
+            # SIGINT the shell first so that it aborts the rest of the cell,
+            # then its children. Only children are escalated,
+            # the shell is kept for the next cell.
+            if pid:
+                return signal_remote(
+                    transport,
+                    escalation_script(
+                        "kill -INT {0}; pkill -INT -P {0}".format(pid),
+                        "pkill -{{sig}} -P {0}".format(pid),
+                        "pgrep -P {0} >/dev/null".format(pid),
+                        timeouts,
+                    ),
+                )
+
+        self.interrupt_function = to_interrupt
+
+
+def quote(value):
+    """Quote a string for bash."""
+    return "'" + str(value).replace("'", "'\"'\"'") + "'"
+
+
+def wrap_cell(cmd, marker, fingerprint=""):
+    """
+    Wrap `cmd` to be fed into the stdin of the long-lived bash.
+
+    The cell is read into a variable with a heredoc and evaluated in the
+    current shell, so that it can't consume the rest of the script from stdin.
+    The environment is dumped into the footer only when its checksum
+    differs from `fingerprint`. Aliases and public functions are listed
+    in `names` for completion.
+
+    Returns:
+        str: script
+    """
+    script = """
+IFS= read -r -d '' __sshkernel_cell <<'{marker}'
+{cmd}
+{marker}
+eval "$__sshkernel_cell" </dev/null
+__sshkernel_code=$?
+printf '%s\\0%s\\n' {marker} {marker} >&2
+__sshkernel_sum=$(env -0 | cksum)
+printf '%s\\0' {marker} code "$__sshkernel_code" pwd "$PWD" sum "$__sshkernel_sum"
+printf 'names\\0'
+compgen -A alias -A function -X '_*' || true
+printf '\\0'
+if [ "$__sshkernel_sum" != "{fingerprint}" ]; then
+    printf 'env\\0'
+    env -0
+fi
+printf '%s\\n' {marker}
+""".format(cmd=cmd, marker=marker, fingerprint=fingerprint)
+
+    return script
@@ -1,14 +1,42 @@
-import os
+import functools
 import time
 import re
+import zlib
 
 import paramiko
 
 from plumbum.machines.paramiko_machine import ParamikoMachine
 
-import yaml
-
+from .channel import ChannelReader
+from .channel import iter_channel
+from .exception import SSHKernelNotConnectedException
+from .footer import FooterParser
+from .interrupt import DEFAULT_TIMEOUTS
+from .interrupt import group_escalation_script
+from .interrupt import signal_remote
+from .query import QueryShell
+from .ssh_config import load_ssh_config
 from .ssh_wrapper import SSHWrapper
+from .timing import CellTimer
+from .timing import parse_times
+from .transport_options import apply_transport_options
+from .transport_options import connect_options
+from .transport_options import transport_options
+
+# Names `unset` accepts, e.g. not BASH_FUNC_f%% of exported functions
+ENV_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Variables which differ per shell or connection, and are not restored
+volatile_env_variables = {
+    "_",
+    "PWD",
+    "OLDPWD",
+    "SHLVL",
+    "SSH_AUTH_SOCK",
+    "SSH_CLIENT",
+    "SSH_CONNECTION",
+    "SSH_TTY",
+}
 
 
 class SSHWrapperPlumbum(SSHWrapper):
@@ -19,6 +47,9 @@ class SSHWrapperPlumbum(SSHWrapper):
     Attributes:
     * ._remote : plumbum.machines.paramiko_machine.ParamikoMachine
     * ._remote._client: paramiko.SSHClient
+    * .rusage : bool, measure user and system time of the cell by bash `times`
+    * .last_timing : CellTimer of the last cell
+    * .transport_overrides : dict, transport options over ~/.ssh/config at connect
     """
 
     def __init__(self, envdelta_init=dict()):
@@ -26,10 +57,27 @@ class SSHWrapperPlumbum(SSHWrapper):
         self._remote = None
         self.__connected = False
         self._host = ""
-        self.interrupt_function = lambda: None
+        self._query_shell = None
+        self._cell_pgid = None
+        self.interrupt_function = lambda timeouts=DEFAULT_TIMEOUTS: None
+
+        # Variables set and removed by cells since login, and their fingerprint
+        self._env_changed = dict()
+        self._env_removed = set()
+        self._env_fingerprint = ""
+
+        # Aliases and functions of the session shell, unknown to the query shell
+        self._session_names = []
+
+        self.rusage = False
+        self.last_timing = None
+        self.transport_overrides = dict()
 
-    def exec_command(self, cmd, print_function):
+    def exec_command(self, cmd, print_function, error_function=None):
         """
+        Args:
+            error_function: callback fn for stderr, defaults to `print_function`
+
         Returns:
           int: exit_code
             * Return the last command exit_code
@@ -39,21 +87,52 @@ class SSHWrapperPlumbum(SSHWrapper):
             plumbum.commands.processes.ProcessExecutionError: If exit_code is 0
         """
 
+        timer = self.last_timing = CellTimer()
         print_function("[ssh] host = {}, cwd = {}\n".format(self._host, self.get_cwd()))
 
         marker = str(time.time())[::-1]
-        full_command = append_footer(cmd, marker)
+        full_command = append_footer(cmd, marker, self._env_removed, self.rusage)
+        timer.count("sent", len(full_command.encode("utf-8")))
 
         proc = self._remote["bash"]["-c", full_command].popen()
         self._update_interrupt_function(proc)
+        timer.mark("channel_open")
+
+        reader = ChannelReader(proc.channel)
+        env_info = process_output(
+            iter_channel(proc.channel, reader=reader),
+            marker,
+            print_function,
+            error_function,
+            header_function=self._timed_header_function(timer),
+            timer=timer,
+        )
 
-        tuple_iterator = proc.iter_lines()
-        env_info = process_output(tuple_iterator, marker, print_function)
+        return self._finish_cell(env_info, reader, timer)
 
-        if env_info:
-            return self.post_exec_command(env_info)
-        else:
-            return 1
+    def query(self, cmd, timeout=5.0):
+        """
+        Run `cmd` on a side channel, in the current cwd and environment.
+
+        No header and footer are added, and the state of the session
+        (cwd, environment, interrupt function) is not changed.
+
+        Returns:
+            list: lines of stdout
+
+        Raises:
+            SSHKernelQueryError: If failed or timed out
+        """
+        if self._query_shell is None:
+            self._query_shell = QueryShell(self._remote._client.get_transport())
+
+        return self._query_shell.run(
+            cmd,
+            cwd=self.get_cwd(),
+            env=self._remote.env.getdelta(),
+            unset=self._env_removed,
+            timeout=timeout,
+        )
 
     def connect(self, host):
         if self._remote:
@@ -68,59 +147,155 @@ class SSHWrapperPlumbum(SSHWrapper):
         self.__connected = True
         self._host = host
 
-    def _build_remote(self, host):
-        (hostname, plumbum_kwargs, forward_agent) = load_ssh_config_for_plumbum(
-            "~/.ssh/config", host
-        )
-
-        print(
-            "[ssh] host={host} hostname={hostname} other_conf={other_conf}".format(
-                host=host, hostname=hostname, other_conf=plumbum_kwargs
-            )
-        )
-
-        remote = ParamikoMachine(hostname, password=None, **plumbum_kwargs)
+        self._env_changed = dict()
+        self._env_removed = set()
+        self._env_fingerprint = ""
 
-        if forward_agent == "yes":
-            print("[ssh] forwarding local agent")
-            enable_agent_forwarding(remote._client)
-
-        return remote
+    def _build_remote(self, host):
+        return build_remote(host, self.transport_overrides)
 
     def close(self):
         self.__connected = False
 
+        if self._query_shell:
+            self._query_shell.close()
+            self._query_shell = None
+
         if self._remote:
             self._remote.close()
 
-    def interrupt(self):
-        self.interrupt_function()
+    def interrupt(self, timeouts=DEFAULT_TIMEOUTS):
+        """
+        Send SIGINT to the running cell, escalating to SIGTERM and SIGKILL
+        after each of `timeouts` seconds.
+
+        Returns:
+            dict: {"signal": the last signal sent, "elapsed": seconds},
+                or None if the cell was not signaled
+        """
+        return self.interrupt_function(timeouts)
 
     def isconnected(self):
-        return self.__connected
+        if not self.__connected:
+            return False
+
+        # The transport dies without notice when the network is lost
+        transport = self.get_transport()
+        return transport is not None and transport.is_active()
+
+    def get_transport(self):
+        if self._remote is None:
+            return None
+
+        return self._remote._client.get_transport()
+
+    def open_sftp(self):
+        transport = self.get_transport()
+        if transport is None:
+            raise SSHKernelNotConnectedException("Not connected")
+
+        return paramiko.SFTPClient.from_transport(transport)
+
+    def open_channel(self):
+        transport = self.get_transport()
+        if transport is None:
+            raise SSHKernelNotConnectedException("Not connected")
+
+        return transport.open_session()
+
+    def reconnect(self):
+        """
+        Connect to the last host again, and restore the last known cwd and
+        the environment variables changed since login.
+
+        Raises:
+            SSHConnectionError
+        """
+        cwd = self.get_cwd()
+        env_changed = {
+            k: v
+            for k, v in self._env_changed.items()
+            if k not in volatile_env_variables
+        }
+        env_removed = self._env_removed - volatile_env_variables
+
+        try:
+            self.close()
+        except Exception:
+            # The old connection may be broken
+            pass
+        self._remote = None
+
+        self.connect(self._host)
+
+        self.update_env(env_changed, env_removed)
+        self.update_workdir(cwd)
 
     # private methods
     def _update_interrupt_function(self, proc):
-        def to_interrupt():
+        self._cell_pgid = None
+        transport = self.get_transport()
+
+        def to_interrupt(timeouts=DEFAULT_TIMEOUTS):
+            result = None
+            pgid = self._cell_pgid
+            if pgid:
+                # Closing the channel alone leaves the processes of the cell
+                result = signal_remote(
+                    transport, group_escalation_script(pgid, timeouts)
+                )
+
             proc.close()
+            return result
 
         self.interrupt_function = to_interrupt
 
-    def post_exec_command(self, env_out):
-        """Receive yaml string, update instance state with its value
+    def _update_cell_header(self, header):
+        if "pgid" in header:
+            self._cell_pgid = int(header["pgid"])
+
+    def _timed_header_function(self, timer):
+        def header_function(header):
+            # The header is written as soon as bash starts the cell
+            timer.mark("bash_start")
+            self._update_cell_header(header)
+
+        return header_function
+
+    def _finish_cell(self, env_info, reader, timer):
+        timer.mark("footer")
+        for stream, n in reader.received.items():
+            timer.count(stream, n)
+
+        if not env_info:
+            return 1
+
+        timer.rusage = parse_times(env_info.get("rusage"))
+        code = self.post_exec_command(env_info)
+        timer.mark("post_exec")
+
+        return code
+
+    def post_exec_command(self, footer):
+        """Receive footer records, update instance state with its value
 
         Return:
             int: exit_code
         """
-        env_at_footer = yaml.safe_load(env_out)
-
-        newdir = env_at_footer["pwd"]
-        newenv = env_at_footer["env"]
+        newdir = footer["pwd"]
         self.update_workdir(newdir)
-        self.update_env(newenv)
 
-        if "code" in env_at_footer:
-            return env_at_footer["code"]
+        # Variables changed and removed by the cell
+        changed = footer.get("env") or dict()
+        removed = footer.get("unset", "").split()
+        if changed or removed:
+            self.update_env(changed, removed)
+
+        if "names" in footer:
+            self._session_names = footer["names"].split()
+
+        if "code" in footer:
+            return footer["code"]
         else:
             print("[ssh] Error: Cannot parse exit_code. As a result, returing code=1")
             return 1
@@ -134,91 +309,338 @@ class SSHWrapperPlumbum(SSHWrapper):
     def get_cwd(self):
         return self._remote.cwd.getpath()._path
 
-    def update_env(self, newenv):
-        delimiter = "^@"
-        reject_env_variables = ["SSH_CLIENT", "SSH_CONNECTION"]
+    def get_env_fingerprint(self):
+        """Checksum of the variables changed since login."""
+        return self._env_fingerprint
 
-        parsed_newenv = dict([kv.split("=", 1) for kv in newenv.split(delimiter) if kv])
-        parsed_newenv = {
-            k: v for k, v in parsed_newenv.items() if k not in reject_env_variables
-        }
+    def get_session_names(self):
+        """Aliases and functions of the session shell at the last cell."""
+        return self._session_names
+
+    def update_env(self, changed, removed=()):
+        """
+        Apply variables set and removed by a cell to the next commands.
+
+        Args:
+            changed (dict): {name: value}
+            removed (iterable): names
+        """
+        reject_env_variables = {"_", "SSH_CLIENT", "SSH_CONNECTION"}
+
+        changed = {k: v for k, v in changed.items() if k not in reject_env_variables}
+        removed = set(removed) - reject_env_variables
+
+        if changed:
+            self._remote.env.update(changed)
+
+        for k in removed:
+            # Drop from the command prefix, and unset it in the next command
+            # because the login environment may provide it again
+            if k in self._remote.env:
+                del self._remote.env[k]
+            self._env_changed.pop(k, None)
+
+        self._env_changed.update(changed)
+        self._env_removed = (self._env_removed | removed) - changed.keys()
 
-        self._remote.env.update(parsed_newenv)
+        state = sorted(self._env_changed.items()), sorted(self._env_removed)
+        self._env_fingerprint = "{:08x}".format(zlib.crc32(repr(state).encode()))
 
 
-def append_footer(cmd, marker):
+def append_footer(cmd, marker, unset_variables=(), rusage=False):
     """
     Append header/footer to `cmd`.
 
+    The cell runs in a subshell of its own process group, so that an
+    interrupt can signal all of its processes. The subshell writes the
+    process group id to stderr first as a record line, `MARKER\\0pgid\\0<pgid>\\n`.
+
+    The footer is NUL-separated records parsed by `FooterParser`.
+    Only the delta of the environment is sent: the exported variables are
+    recorded before the cell, and the footer has the names removed by the
+    cell as `unset`, and the variables it set or changed as `env`.
+    This needs bash 4 for associative arrays.
+    Aliases and public functions of the shell are listed in `names`.
+
+    Args:
+        unset_variables (iterable): variables removed in the previous cells
+        rusage (bool): add the output of `times` to the footer as `rusage`
+
     Returns:
         str: new_command
     """
     header = ""
+    names = sorted(k for k in unset_variables if ENV_NAME.fullmatch(k))
+    if names:
+        # Readonly variables can't be unset
+        header = "unset {} 2>/dev/null".format(" ".join(names))
+
     footer = """
 EXIT_CODE=$?
-echo {marker}code: ${{EXIT_CODE}}{marker}
-echo {marker}pwd: $(pwd){marker}
-echo {marker}env: $(cat -v <(env -0)){marker}
+printf '%s\\0' {marker}
+{times}printf '%s\\0' code "$EXIT_CODE" pwd "$PWD" names
+compgen -A alias -A function -X '_*' || true
+printf '\\0'
+IFS=$' \\t\\n'
+__sshkernel_removed=
+declare -A __sshkernel_env1
+for __sshkernel_k in $(compgen -e); do __sshkernel_env1[$__sshkernel_k]=1; done
+for __sshkernel_k in "${{!__sshkernel_env0[@]}}"; do
+    [ -n "${{__sshkernel_env1[$__sshkernel_k]+x}}" ] ||
+        __sshkernel_removed+=" $__sshkernel_k"
+done
+printf '%s\\0' unset "${{__sshkernel_removed# }}" env
+for __sshkernel_k in "${{!__sshkernel_env1[@]}}"; do
+    if [ -z "${{__sshkernel_env0[$__sshkernel_k]+x}}" ] ||
+        [ "${{__sshkernel_env0[$__sshkernel_k]}}" != "${{!__sshkernel_k-}}" ]; then
+        printf '%s=%s\\0' "$__sshkernel_k" "${{!__sshkernel_k-}}"
+    fi
+done
+printf '%s\\n' {marker}
 """.format(
-        marker=marker
+        marker=marker,
+        # `times` in a command substitution would measure a new subshell
+        times="printf 'rusage\\0'; times; printf '\\0'\n" if rusage else "",
     )
 
-    full_command = "\n".join([header, cmd, footer])
+    # Job control puts the subshell into a new process group.
+    # Notifications of the job are discarded with stderr of the parent.
+    full_command = """{header}
+set -m
+(
+set +m
+printf '%s\\0pgid\\0%s\\n' {marker} "$BASHPID" >&2
+declare -A __sshkernel_env0
+for __sshkernel_k in $(compgen -e); do
+    __sshkernel_env0[$__sshkernel_k]=${{!__sshkernel_k-}}
+done
+{cmd}
+{footer}
+) &
+exec 2>/dev/null
+wait $!
+""".format(header=header, marker=marker, cmd=cmd, footer=footer)
 
     return full_command
 
 
-def merge_stdout_stderr(iterator):
-    """Merge two iterators returned by Popen.communicate()
+def process_output(
+    tuple_iterator,
+    marker,
+    print_function,
+    error_function=None,
+    stderr_footer=False,
+    header_function=None,
+    timer=None,
+):
+    """Process iterator of output chunks
+
+    For normal output, call callback print-fn as soon as a chunk arrives.
+    The footer is split from stdout by `FooterParser`.
 
     Args:
-        iterator: yields (string, string), either one of two string is None
+        tuple_iterator: yields tuple (string, string)
+        print_function: callback fn for stdout
+        error_function: callback fn for stderr, defaults to `print_function`
+        stderr_footer (bool): stderr also ends with a footer (without records).
+            Stop iteration when both footers are found.
+        header_function: callback fn for the records of the header line of stderr
+        timer (CellTimer): marks "command" when the footer starts,
+            and sums the time of callbacks as "output"
 
     Returns:
-        iterator: yields string
+        dict: footer records, or None if the footer is not found
+    """
+
+    router = OutputRouter(
+        marker, print_function, error_function, stderr_footer, header_function, timer
+    )
+
+    for stdout, stderr in tuple_iterator:
+        if router.feed(stdout, stderr):
+            break
+
+    return router.finish()
+
+
+class OutputRouter:
+    """
+    Pass output chunks to callbacks, splitting the footer.
+    The state of `process_output`, to be driven by other loops.
     """
 
-    for (stdout, stderr) in iterator:
+    def __init__(
+        self,
+        marker,
+        print_function,
+        error_function=None,
+        stderr_footer=False,
+        header_function=None,
+        timer=None,
+    ):
+        error_function = error_function or print_function
+        if timer:
+            print_function = timer.timed("output", print_function)
+            error_function = timer.timed("output", error_function)
+
+        self.print_function = print_function
+        self.error_function = error_function
+        self.timer = timer
+        self.header_function = header_function
+        self.parser = FooterParser(marker)
+        self.stderr_parser = FooterParser(marker) if stderr_footer else None
+
+        self._header_start = marker + "\0"
+        # A line of stderr which may be the header is held until complete
+        self._header = "" if header_function else None
+        self._mid_line = False
+
+    def feed(self, stdout, stderr):
+        """
+        Returns:
+            bool: True if both footers are found with `stderr_footer`
+        """
         if stdout:
-            yield stdout
-        else:
-            yield stderr
+            in_footer = self.parser.in_footer
+            out = self.parser.feed(stdout)
+            if self.timer and self.parser.in_footer and not in_footer:
+                self.timer.mark("command")
+            if out:
+                self.print_function(out)
+        elif stderr:
+            if self._header is not None:
+                stderr = self._split_header(stderr)
+            if self.stderr_parser:
+                stderr = self.stderr_parser.feed(stderr)
+            if stderr:
+                self.error_function(stderr)
+
+        return bool(self.stderr_parser and self.parser.done and self.stderr_parser.done)
+
+    def finish(self):
+        """
+        Returns:
+            dict: footer records, or None if the footer is not found
+        """
+        if self._header:
+            self.error_function(self._header)
+            self._header = None
 
+        rest = self.parser.flush()
+        if rest:
+            self.print_function(rest)
 
-def process_output(tuple_iterator, marker, print_function):
-    """Process iterator which is return of Popen.communicate()
+        return self.parser.records()
 
-    For normal lines, call callback print-fn.
+    def _split_header(self, stderr):
+        """
+        Take the header line out of stderr. Lines before it, e.g. warnings
+        of the login shell, are passed through.
+        """
+        text = self._header + stderr
+        start = self._header_start
+
+        # The header starts a line
+        lead = "" if self._mid_line else "\n"
+        i = (lead + text).find("\n" + start)
+        if i >= 0:
+            i += 1 - len(lead)
+            end = text.find("\n", i)
+            if end < 0:
+                self._header = text[i:]
+                self._mid_line = False
+                return text[:i]
+
+            self._header = None
+            fields = text[i:end].replace(start, "", 1).split("\0")
+            self.header_function(dict(zip(fields[::2], fields[1::2])))
+
+            rest = end + 1
+            return text[:i] + text[rest:]
+
+        # The last line may be the beginning of the header
+        k = text.rfind("\n") + 1
+        tail = text[k:]
+        if (k or not self._mid_line) and start.startswith(tail):
+            self._header = tail
+            self._mid_line = False
+            return text[:k]
+
+        self._header = ""
+        self._mid_line = bool(tail)
+        return text
+
+
+def build_remote(host, transport_overrides=dict()):
+    """Connect to `host` configured in ~/.ssh/config
 
     Args:
-        tuple_iterator: yields tuple (string, string)
-        print_function: callback fn
+        transport_overrides (dict): options of sshkernel.transport_options
+            over ~/.ssh/config, ignored if empty
 
     Returns:
-        string: footer string (YAML format)
+        plumbum.machines.paramiko_machine.ParamikoMachine
     """
+    hostname, plumbum_kwargs, forward_agent, options = load_ssh_config_for_plumbum(
+        "~/.ssh/config", host
+    )
+    options.update({k: v for k, v in transport_overrides.items() if v})
+
+    print(
+        "[ssh] host={host} hostname={hostname} other_conf={other_conf}".format(
+            host=host, hostname=hostname, other_conf=plumbum_kwargs
+        )
+    )
 
-    iterator = merge_stdout_stderr(tuple_iterator)
+    remote = OptionsParamikoMachine(
+        hostname,
+        connect_options(options, paramiko.Transport),
+        password=None,
+        **plumbum_kwargs,
+    )
 
-    env_out = ""
-    for line in iterator:
+    try:
+        negotiated = apply_transport_options(remote._client.get_transport(), options)
+    except Exception:
+        remote.close()
+        raise
+    if negotiated:
+        print(
+            "[ssh] transport renegotiated: "
+            "cipher={cipher} mac={mac} compression={compression}".format(**negotiated)
+        )
 
-        if line.endswith(marker + "\n"):
+    if forward_agent == "yes":
+        print("[ssh] forwarding local agent")
+        enable_agent_forwarding(remote._client)
 
-            if not line.startswith(marker):
-                # The `line` contains 2 markers and trailing newline
-                # e.g "123MARKcode: 0MARK\n".split(marker) =>  ("123", "code: 0", "\n")
-                line1, line2, _ = line.split(marker)
-                print_function(line1)
-                line = line2
+    return remote
 
-            env_out += line.replace(marker, "").rstrip()
-            env_out += "\n"
 
-        else:
-            print_function(line)
+class OptionsParamikoMachine(ParamikoMachine):
+    """ParamikoMachine passing `connect_options` to SSHClient.connect()
+
+    ParamikoMachine creates and connects its SSHClient in __init__ and takes
+    no transport options, so they are bound to `connect` when the client is set.
+    The client is kept in an attribute of this class, not in the slot of
+    ParamikoMachine. If the options miss the connect, apply_transport_options
+    still sets them by renegotiating the keys.
+    """
 
-    return env_out
+    def __init__(self, host, connect_options, **kwargs):
+        self._connect_options = connect_options
+        self._options_client = None
+        super().__init__(host, **kwargs)
+
+    @property
+    def _client(self):
+        return self._options_client
+
+    @_client.setter
+    def _client(self, client):
+        if self._connect_options:
+            client.connect = functools.partial(client.connect, **self._connect_options)
+        self._options_client = client
 
 
 def enable_agent_forwarding(paramiko_sshclient):
@@ -231,10 +653,11 @@ def enable_agent_forwarding(paramiko_sshclient):
 def load_ssh_config_for_plumbum(filename, host):
     """Parse and postprocess ssh_config
     and rename some keys for plumbum.ParamikoMachine.__init__()
-    """
 
-    conf = paramiko.config.SSHConfig()
-    expanded_path = os.path.expanduser(filename)
+    Returns:
+        tuple: (hostname, kwargs of ParamikoMachine, ForwardAgent,
+            dict of sshkernel.transport_options)
+    """
 
     username_from_host = None
     m = re.search("([^@]+)@(.*)", host)
@@ -242,11 +665,7 @@ def load_ssh_config_for_plumbum(filename, host):
         username_from_host = m.group(1)
         host = m.group(2)
 
-    if os.path.exists(expanded_path):
-        with open(expanded_path) as ssh_config:
-            conf.parse(ssh_config)
-
-    lookup = conf.lookup(host)
+    lookup = load_ssh_config(filename).lookup(host)
 
     plumbum_kwargs = dict(
         user=username_from_host,
@@ -290,4 +709,7 @@ def load_ssh_config_for_plumbum(filename, host):
     # Plumbum doesn't support agent-forwarding
     forward_agent = lookup.get("forwardagent")
 
-    return (plumbum_host, plumbum_kwargs, forward_agent)
+    # Nor compression and algorithms, applied after connecting
+    options = transport_options(lookup)
+
+    return (plumbum_host, plumbum_kwargs, forward_agent, options)
@@ -0,0 +1,133 @@
+"""
+Startup profile of the kernel.
+
+Print the import time of the kernel by top-level package, from
+`python -X importtime`, and the time to the first kernel_info reply:
+
+    python -m sshkernel.startup [--top 15] [--no-kernel-info]
+
+The SSH stack (paramiko, plumbum) is imported on the first login,
+so it should not be listed.
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+import time
+
+# Packages imported on the first login, not at startup
+DEFERRED = ("paramiko", "plumbum", "cryptography", "bcrypt", "nacl")
+
+# A line of `-X importtime`, e.g. "import time:   1738 |   1738 |   sshkernel.timing"
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(text):
+    """Sum the self time of each top-level package.
+
+    Returns:
+        dict: {package: seconds}
+    """
+    packages = dict()
+    for line in text.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+
+        package = match.group(4).split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(match.group(1)) / 1e6
+
+    return packages
+
+
+def profile_imports(module="sshkernel.kernel"):
+    """
+    Import `module` in a new interpreter.
+
+    Returns:
+        dict: {package: seconds}
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    return parse_importtime(proc.stderr)
+
+
+def time_to_kernel_info(timeout=60.0):
+    """
+    Launch `python -m sshkernel` and wait for its kernel_info reply.
+
+    Returns:
+        float: seconds
+    """
+    from jupyter_client import KernelManager
+
+    started = time.monotonic()
+
+    manager = KernelManager()
+    manager.kernel_cmd = [sys.executable, "-m", "sshkernel", "-f", "{connection_file}"]
+    manager.start_kernel()
+    client = manager.client()
+    try:
+        client.start_channels()
+        client.wait_for_ready(timeout=timeout)
+        return time.monotonic() - started
+    finally:
+        client.stop_channels()
+        manager.shutdown_kernel(now=True)
+
+
+def format_profile(packages, top=15):
+    """
+    Returns:
+        str: table of the slowest packages, the rest and the total
+    """
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    total = sum(packages.values())
+
+    lines = ["{:<24} {:>10}".format("package", "import")]
+    for package, seconds in ranked[:top]:
+        lines.append("{:<24} {:>8.1f}ms".format(package, seconds * 1000))
+
+    rest = sum(seconds for _, seconds in ranked[top:])
+    if rest:
+        lines.append(
+            "{:<24} {:>8.1f}ms".format(
+                "({} others)".format(len(ranked) - top), rest * 1000
+            )
+        )
+    lines.append("{:<24} {:>8.1f}ms".format("total", total * 1000))
+
+    deferred = [package for package in DEFERRED if package in packages]
+    if deferred:
+        lines.append("[ssh] imported at startup: {}".format(", ".join(deferred)))
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the startup of sshkernel")
+    parser.add_argument(
+        "--top", type=int, default=15, help="Number of packages to list"
+    )
+    parser.add_argument(
+        "--no-kernel-info",
+        action="store_true",
+        help="Skip launching a kernel to time the kernel_info reply",
+    )
+    args = parser.parse_args(argv)
+
+    print(format_profile(profile_imports(), args.top))
+
+    if not args.no_kernel_info:
+        print("time to kernel_info: {:.3f}s".format(time_to_kernel_info()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+Tables parsed from the output of `%%capture_table` cells.
+
+The output is parsed line by line as it is received, so only the partial
+last line is buffered, and rows are stored by column: integers and floats
+in arrays, other values as interned strings. Rows after `max_rows` are
+counted but not stored.
+
+Formats:
+    csv    comma-separated values, a quoted field can not contain a newline
+    tsv    tab-separated values
+    ws     whitespace-separated values, the last column takes the rest of the
+           line, e.g. the command of `ps`
+    jsonl  a JSON object or array per line
+    auto   chosen by the first line
+"""
+
+import array
+import csv
+import html
+import json
+import re
+import sys
+
+FORMATS = ("auto", "csv", "tsv", "ws", "jsonl")
+
+# Fields of a column joined by newlines, to check them by one match
+INT_LINES = re.compile(r"(-?(0|[1-9]\d{0,17})\n)*")
+FLOAT_LINES = re.compile(r"(-?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][-+]?\d+)?\n)*")
+
+
+class Column:
+    """
+    Values of a column, in an array of integers or floats while all values
+    are numbers, otherwise in a list.
+
+    Fields of text are numbers only if all fields of the column are written
+    as numbers, otherwise all of them are kept as text, e.g. "007" or a
+    missing field.
+    """
+
+    def __init__(self, name, length=0):
+        self.name = name
+        self.kind = "int"
+        self.values = array.array("q")
+
+        # Rows before the column appeared
+        for _ in range(length):
+            self.append(None)
+
+    def append(self, value):
+        if self.kind == "int":
+            if type(value) is int and -(2**63) <= value < 2**63:
+                self.values.append(value)
+                return
+            if type(value) is float:
+                self.kind = "float"
+                self.values = array.array("d", self.values)
+            else:
+                self._to_list()
+
+        if self.kind == "float":
+            if type(value) in (int, float):
+                self.values.append(value)
+                return
+            self._to_list()
+
+        if isinstance(value, str):
+            value = sys.intern(value)
+        self.values.append(value)
+
+    def extend(self, values):
+        # An array takes True as 1
+        if self.kind != "object" and not any(type(v) is bool for v in values):
+            length = len(self.values)
+            try:
+                # Much faster than append() while all values are numbers
+                self.values.extend(values)
+                return
+            except (TypeError, OverflowError):
+                del self.values[length:]
+
+        for value in values:
+            self.append(value)
+
+    def extend_text(self, texts):
+        if self.kind != "object" and None not in texts:
+            lines = "\n".join(texts) + "\n"
+            if self.kind == "int" and INT_LINES.fullmatch(lines):
+                self.values.extend(map(int, texts))
+                return
+
+            if FLOAT_LINES.fullmatch(lines):
+                if self.kind == "int":
+                    self.kind = "float"
+                    self.values = array.array("d", self.values)
+                self.values.extend(map(float, texts))
+                return
+
+        if self.kind != "object":
+            self.kind = "object"
+            self.values = [format_value(value) for value in self.values]
+
+        if None in texts:
+            self.values.extend(
+                None if text is None else sys.intern(text) for text in texts
+            )
+        else:
+            self.values.extend(map(sys.intern, texts))
+
+    def __len__(self):
+        return len(self.values)
+
+    def _to_list(self):
+        self.kind = "object"
+        self.values = list(self.values)
+
+
+class Table:
+    """
+    Columns of equal length.
+
+    Usage:
+        table.columns          # names
+        table.column("PID")    # values of a column
+        list(table.rows())     # tuples
+    """
+
+    def __init__(self, names=()):
+        self._columns = dict()
+        self.length = 0
+        # Rows received after `max_rows`, not stored
+        self.dropped = 0
+
+        for name in names:
+            self.add_column(name)
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def add_column(self, name):
+        """Add a column, renamed if the name is used. Returns the name."""
+        unique, n = name, 1
+        while unique in self._columns:
+            n += 1
+            unique = "{}_{}".format(name, n)
+
+        self._columns[unique] = Column(unique, self.length)
+
+        return unique
+
+    def extend(self, rows, text=False):
+        """
+        Append rows of values by position, missing values are None.
+        With `text`, values are fields of text, see Column.
+        """
+        width = max(map(len, rows), default=0)
+        for i in range(len(self._columns), width):
+            self.add_column(str(i + 1))
+
+        width = len(self._columns)
+        rows = [row if len(row) == width else pad(row, width) for row in rows]
+        for column, values in zip(self._columns.values(), zip(*rows)):
+            if text:
+                column.extend_text(values)
+            else:
+                column.extend(values)
+        self.length += len(rows)
+
+    def column(self, name):
+        """
+        Returns:
+            list: values of the column `name`
+
+        Raises:
+            KeyError: If no such column
+        """
+        return list(self._columns[name].values)
+
+    def rows(self, start=0, stop=None):
+        """
+        Yields:
+            tuple: values of a row, from `start` to `stop`
+        """
+        columns = [column.values for column in self._columns.values()]
+        stop = self.length if stop is None else min(stop, self.length)
+        for i in range(start, stop):
+            yield tuple(values[i] for values in columns)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: {column name: list of values}
+        """
+        return {name: self.column(name) for name in self._columns}
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "<Table {} rows x {} columns{}>".format(
+            self.length,
+            len(self._columns),
+            ", {} rows dropped".format(self.dropped) if self.dropped else "",
+        )
+
+    def _repr_html_(self):
+        return self.to_html()
+
+    def to_html(self, max_rows=20):
+        """
+        Returns:
+            str: HTML table of the first `max_rows` rows, and the size
+        """
+        cell = "<td>{}</td>".format
+        lines = [
+            "<table>",
+            "<thead><tr>{}</tr></thead>".format(
+                "".join(
+                    "<th>{}</th>".format(html.escape(name)) for name in self.columns
+                )
+            ),
+            "<tbody>",
+        ]
+        for row in self.rows(0, max_rows):
+            lines.append(
+                "<tr>{}</tr>".format(
+                    "".join(cell(html.escape(format_value(value))) for value in row)
+                )
+            )
+        lines += ["</tbody>", "</table>"]
+
+        summary = "{} rows x {} columns".format(self.length, len(self._columns))
+        if self.length > max_rows:
+            summary += ", first {} shown".format(max_rows)
+        if self.dropped:
+            summary += ", {} rows dropped after the limit".format(self.dropped)
+        lines.append("<p>{}</p>".format(summary))
+
+        return "\n".join(lines)
+
+
+class TableParser:
+    """
+    Parse lines of text into a Table as they are fed.
+
+    Usage:
+        parser = TableParser("ws")
+        with OutputBuffer(kernel.Write, tap=parser.feed) as output:
+            wrapper.exec_command(cmd, output.write, output.write_error)
+        table = parser.close()
+
+    Args:
+        fmt (str): one of FORMATS
+        header (bool): the first line has the names of columns,
+            otherwise columns are named "1", "2", ... (not for jsonl)
+        max_rows (int): rows to keep, 0 for unlimited
+        comment (str): lines starting with it are skipped
+
+    Raises:
+        ValueError: If `fmt` is unknown
+    """
+
+    def __init__(self, fmt="auto", header=True, max_rows=0, comment=None):
+        if fmt not in FORMATS:
+            raise ValueError(
+                "Format must be one of {}, got {!r}".format(", ".join(FORMATS), fmt)
+            )
+
+        self.fmt = fmt
+        self.header = header
+        self.max_rows = max_rows
+        self.comment = comment
+        self.table = Table()
+
+        self._partial = ""
+        self._names = None
+        self._keys = dict()
+        self._merge_header = False
+        # The format and the columns are known, and lines are parsed in bulk
+        self._ready = False
+
+    def feed(self, text):
+        if "\n" not in text:
+            self._partial += text
+            return
+
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        if "\r" in text:
+            lines = [line.rstrip("\r") for line in lines]
+
+        comment = self.comment
+        lines = [
+            line
+            for line in lines
+            if line.strip() and not (comment and line.startswith(comment))
+        ]
+
+        rows = []
+        while lines and not self._ready:
+            row = self._parse_first(lines.pop(0))
+            if row is not None:
+                rows.append(row)
+
+        if lines:
+            rows += self._parse_lines(lines)
+
+        self._store(rows)
+
+    def close(self):
+        """
+        Returns:
+            Table
+        """
+        if self._partial:
+            self.feed("\n")
+
+        if self._names and not self.table.columns:
+            # A header without rows
+            for name in self._names:
+                self.table.add_column(name)
+
+        return self.table
+
+    # private methods
+    def _parse_first(self, line):
+        """
+        Parse a line until the format and the columns are known.
+
+        Returns:
+            list: values of a row, or None if not a row
+        """
+        if self.fmt == "auto":
+            self.fmt = detect_format(line)
+
+        if self.fmt == "jsonl":
+            self._ready = True
+            return self._parse_json(line)
+
+        fields = self._split(line)
+        if self._names is None and self.header:
+            self._names = fields
+            # e.g. "Mounted on" of `df`
+            self._merge_header = self.fmt == "ws"
+            return None
+
+        if self._merge_header:
+            self._merge_header = False
+            count = len(line.split())
+            if 0 < count < len(self._names):
+                last = count - 1
+                self._names = self._names[:last] + [" ".join(self._names[last:])]
+            fields = self._split(line)
+
+        if self._names is not None and not self.table.columns:
+            for name in self._names:
+                self.table.add_column(name)
+
+        self._ready = True
+        return fields
+
+    def _parse_lines(self, lines):
+        """
+        Returns:
+            list: rows of `lines`
+        """
+        if self.fmt == "jsonl":
+            return [self._parse_json(line) for line in lines]
+        if self.fmt == "csv":
+            return list(csv.reader(lines))
+        if self.fmt == "tsv":
+            return [line.split("\t") for line in lines]
+
+        if self._names is None:
+            return [line.split() for line in lines]
+
+        maxsplit = max(len(self._names) - 1, 0)
+        return [line.split(None, maxsplit) for line in lines]
+
+    def _split(self, line):
+        if self.fmt == "csv":
+            return next(csv.reader([line]))
+        if self.fmt == "tsv":
+            return line.split("\t")
+
+        if self._names is None:
+            return line.split()
+
+        return line.split(None, max(len(self._names) - 1, 0))
+
+    def _parse_json(self, line):
+        try:
+            value = json.loads(line)
+        except ValueError:
+            value = [line]
+
+        if isinstance(value, dict):
+            row = [None] * len(self.table.columns)
+            for key, item in value.items():
+                if key not in self._keys:
+                    # Position of the column
+                    self._keys[key] = len(row)
+                    self.table.add_column(key)
+                    row.append(None)
+                row[self._keys[key]] = json_value(item)
+            return row
+
+        if isinstance(value, list):
+            return [json_value(item) for item in value]
+
+        return [json_value(value)]
+
+    def _store(self, rows):
+        if self.max_rows:
+            room = max(self.max_rows - self.table.length, 0)
+            self.table.dropped += max(len(rows) - room, 0)
+            rows = rows[:room]
+
+        if rows:
+            self.table.extend(rows, text=self.fmt != "jsonl")
+
+
+def detect_format(line):
+    stripped = line.lstrip()
+    if stripped[:1] in ("{", "["):
+        try:
+            json.loads(stripped)
+            return "jsonl"
+        except ValueError:
+            pass
+
+    if "\t" in line:
+        return "tsv"
+    if "," in line:
+        return "csv"
+
+    return "ws"
+
+
+def json_value(value):
+    """Nested objects and arrays are kept as JSON text."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+
+    return value
+
+
+def pad(row, width):
+    return list(row) + [None] * (width - len(row))
+
+
+def format_value(value):
+    if value is None:
+        return ""
+
+    return str(value)
@@ -0,0 +1,100 @@
+"""
+`{NAME}` placeholders of `%param` parameters in hosts and cells.
+
+A text is compiled once into literal segments and parameter names, and
+compiled templates are cached, so rendering a cell again only joins the
+segments with the current values.
+
+In cells, placeholders are names of letters, digits and underscores, so that
+shell syntax is left as it is: `${NAME}`, `{a,b}`, `{1..3}`, `{}` and
+`{ cmd; }`. `{{NAME}}` is an escaped placeholder rendered as `{NAME}`.
+In hosts, any text in braces is a name.
+"""
+
+import functools
+import re
+
+PLACEHOLDER = re.compile(
+    r"\{\{(?P<escaped>[A-Za-z_]\w*)\}\}|(?<!\$)\{(?P<name>[A-Za-z_]\w*)\}"
+)
+HOST_PLACEHOLDER = re.compile(r"\{(?P<name>.*?)\}")
+
+
+class Template:
+    """
+    A text compiled into literals and names of parameters in between.
+
+    Usage:
+        template = compile_template("ping -c {COUNT} {HOST}")
+        template.render(dict(COUNT="3", HOST="node01"))
+    """
+
+    def __init__(self, text, pattern=PLACEHOLDER):
+        self.text = text
+        # len(literals) == len(names) + 1
+        self.literals = []
+        self.names = []
+
+        literal, pos = [], 0
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            literal.append(text[pos:start])
+            pos = end
+
+            escaped = match.groupdict().get("escaped")
+            if escaped is not None:
+                literal.append("{" + escaped + "}")
+                continue
+
+            self.literals.append("".join(literal))
+            self.names.append(match.group("name"))
+            literal = []
+
+        literal.append(text[pos:])
+        self.literals.append("".join(literal))
+
+    def render(self, params, strict=False):
+        """
+        Args:
+            params (dict): {name: value}
+            strict (bool): raise on a name not in `params`,
+                otherwise the placeholder is left as it is
+
+        Returns:
+            str
+
+        Raises:
+            KeyError: If `strict` and a name is not in `params`
+        """
+        if not self.names:
+            return self.literals[0]
+
+        parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            value = params.get(name)
+            if value is None:
+                if strict:
+                    raise KeyError(name)
+                value = "{" + name + "}"
+
+            parts.append(str(value))
+            parts.append(literal)
+
+        return "".join(parts)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text, pattern=PLACEHOLDER):
+    """
+    Args:
+        pattern: PLACEHOLDER for cells, or HOST_PLACEHOLDER
+
+    Returns:
+        Template of `text`, cached
+    """
+    return Template(text, pattern)
+
+
+def render(text, params, strict=False, pattern=PLACEHOLDER):
+    """Render `text` by a cached compiled template, see Template.render."""
+    return compile_template(text, pattern).render(params, strict=strict)
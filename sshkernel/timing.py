@@ -0,0 +1,147 @@
+import re
+import time
+from functools import wraps
+
+# A line of bash `times`, e.g. "0m0.004s 0m0.012s"
+TIMES_PATTERN = re.compile(r"(\d+)m([\d.]+)s\s+(\d+)m([\d.]+)s")
+
+
+class CellTimer:
+    """
+    Phase timers and byte counters of a cell.
+
+    Phases are consecutive: `mark(name)` ends the phase `name` which began at
+    the previous mark. Time spent in callbacks wrapped by `timed` is summed
+    separately, as it overlaps the phases.
+
+    Usage:
+        timer = CellTimer()
+        proc = popen()
+        timer.mark("channel_open")
+        print_function = timer.timed("output", print_function)
+        ...
+        timer.count("stdout", 1024)
+        timer.to_dict()
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = self._last = clock()
+        self.phases = dict()
+        self.spent = dict()
+        self.counters = dict()
+        self.rusage = None
+
+    def mark(self, name):
+        now = self.clock()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def count(self, name, n):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name, function):
+        """Wrap `function` to sum the time spent in it as `name`."""
+        self.spent.setdefault(name, 0.0)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = self.clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.spent[name] += self.clock() - started
+
+        return wrapper
+
+    def merge(self, other):
+        """
+        Take phases and counters of `other`, e.g. the timer of a wrapper,
+        as the phases since the last mark.
+        """
+        for name, elapsed in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+        for name, elapsed in other.spent.items():
+            self.spent[name] = self.spent.get(name, 0.0) + elapsed
+        for name, n in other.counters.items():
+            self.count(name, n)
+        if other.rusage is not None:
+            self.rusage = other.rusage
+
+        self._last = self.clock()
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: {"total": sec, "phases": {name: sec}, "spent": {name: sec},
+                "bytes": {name: int}, "rusage": {"user": sec, "sys": sec}}
+                `rusage` is contained only if it is measured.
+        """
+        result = dict(
+            total=self._last - self.started,
+            phases=dict(self.phases),
+            spent=dict(self.spent),
+            bytes=dict(self.counters),
+        )
+        if self.rusage is not None:
+            result["rusage"] = dict(self.rusage)
+
+        return result
+
+
+def parse_times(text):
+    """Parse the output of bash `times`, summing the shell and its children.
+
+    Example:
+        "0m0.010s 0m0.020s\\n0m1.000s 0m0.500s\\n" => {"user": 1.01, "sys": 0.52}
+
+    Returns:
+        dict: {"user": sec, "sys": sec}, or None if not parsed
+    """
+    lines = TIMES_PATTERN.findall(text or "")
+    if not lines:
+        return None
+
+    user = sum(int(m) * 60 + float(s) for m, s, _, _ in lines)
+    system = sum(int(m) * 60 + float(s) for _, _, m, s in lines)
+
+    return dict(user=round(user, 3), sys=round(system, 3))
+
+
+def format_timing(timing):
+    """
+    Returns:
+        str: a line of phases, callback time, bytes and rusage
+    """
+    parts = ["total {}".format(format_seconds(timing["total"]))]
+    parts.append(
+        ", ".join(
+            "{} {}".format(name, format_seconds(elapsed))
+            for name, elapsed in timing["phases"].items()
+        )
+    )
+
+    if timing["spent"]:
+        parts.append(
+            ", ".join(
+                "{} {}".format(name, format_seconds(elapsed))
+                for name, elapsed in timing["spent"].items()
+            )
+        )
+    if timing["bytes"]:
+        parts.append(
+            ", ".join(
+                "{} {}B".format(name, n) for name, n in sorted(timing["bytes"].items())
+            )
+        )
+    if "rusage" in timing:
+        parts.append("user {user:.3f}s, sys {sys:.3f}s".format(**timing["rusage"]))
+
+    return "[ssh] timing: " + " | ".join(part for part in parts if part)
+
+
+def format_seconds(seconds):
+    if seconds < 1.0:
+        return "{:.1f}ms".format(seconds * 1000)
+
+    return "{:.3f}s".format(seconds)
@@ -0,0 +1,335 @@
+"""
+Bulk file transfer over SFTP for `%upload` and `%download`.
+
+A file is split into chunks of `chunk_size` bytes, copied by up to `streams`
+SFTP channels at the same time. Remote reads are pipelined by `readv` and
+remote writes by `set_pipelined`, so that a channel does not wait for a round
+trip per request.
+
+The destination is written to "PATH.part" and renamed when complete.
+Completed chunks are recorded in "PATH.part.json" next to it, so that an
+interrupted transfer of the same source resumes with the remaining chunks.
+"""
+
+import json
+import os
+import posixpath
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from .exception import SSHKernelTransferError
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bytes requested at a time in a chunk
+BLOCK_SIZE = 256 * 1024
+
+TransferResult = namedtuple(
+    "TransferResult", ["source", "destination", "size", "resumed", "elapsed", "streams"]
+)
+
+
+class LocalFiles:
+    """Files on the notebook host."""
+
+    path = os.path
+
+    def open(self, filename, mode):
+        return open(filename, mode)
+
+    def stat(self, filename):
+        return os.stat(filename)
+
+    def exists(self, filename):
+        return os.path.exists(filename)
+
+    def isdir(self, filename):
+        return os.path.isdir(filename)
+
+    def rename(self, src, dst):
+        os.replace(src, dst)
+
+    def remove(self, filename):
+        os.remove(filename)
+
+    def read_blocks(self, f, offset, length):
+        f.seek(offset)
+        while length > 0:
+            block = f.read(min(BLOCK_SIZE, length))
+            if not block:
+                raise SSHKernelTransferError("Unexpected end of {}".format(f.name))
+
+            length -= len(block)
+            yield block
+
+    def close(self):
+        pass
+
+
+class RemoteFiles:
+    """Files on the remote host through an SFTP client."""
+
+    path = posixpath
+
+    def __init__(self, sftp):
+        self.sftp = sftp
+
+    def open(self, filename, mode):
+        f = self.sftp.open(filename, mode)
+        if mode != "rb":
+            # Responses are collected at close, which raises the first error
+            f.set_pipelined(True)
+
+        return f
+
+    def stat(self, filename):
+        return self.sftp.stat(filename)
+
+    def exists(self, filename):
+        try:
+            self.sftp.stat(filename)
+        except IOError:
+            return False
+
+        return True
+
+    def isdir(self, filename):
+        try:
+            return self.sftp.stat(filename).st_mode & 0o170000 == 0o040000
+        except IOError:
+            return False
+
+    def rename(self, src, dst):
+        self.sftp.posix_rename(src, dst)
+
+    def remove(self, filename):
+        self.sftp.remove(filename)
+
+    def read_blocks(self, f, offset, length):
+        blocks = [
+            (start, min(BLOCK_SIZE, offset + length - start))
+            for start in range(offset, offset + length, BLOCK_SIZE)
+        ]
+        return f.readv(blocks)
+
+    def close(self):
+        self.sftp.close()
+
+
+class Transfer:
+    """
+    Copy a file between LocalFiles and RemoteFiles with parallel streams.
+
+    Each stream opens files of its own from the factories, e.g. a new SFTP
+    channel on the same connection.
+
+    Usage:
+        transfer = Transfer(LocalFiles, lambda: RemoteFiles(wrapper.open_sftp()))
+        result = transfer.run("data.csv", "/home/user/data.csv")
+    """
+
+    def __init__(
+        self,
+        source_factory,
+        destination_factory,
+        streams=4,
+        chunk_size=CHUNK_SIZE,
+        clock=time.monotonic,
+    ):
+        self.source_factory = source_factory
+        self.destination_factory = destination_factory
+        self.streams = streams
+        self.chunk_size = chunk_size
+        self.clock = clock
+
+        self._stopped = threading.Event()
+
+    def run(self, src, dst, restart=False):
+        """
+        Args:
+            src: source file
+            dst: destination file, or directory to put the file in
+            restart: discard a partial transfer instead of resuming it
+
+        Returns:
+            TransferResult
+
+        Raises:
+            KeyboardInterrupt: After the running chunks are stopped,
+                the transfer can be resumed
+        """
+        started = self.clock()
+        self._stopped.clear()
+
+        source = self.source_factory()
+        destination = self.destination_factory()
+        try:
+            if destination.isdir(dst):
+                dst = destination.path.join(dst, source.path.basename(src))
+
+            stat = source.stat(src)
+            journal = dict(
+                size=stat.st_size, mtime=int(stat.st_mtime), chunk_size=self.chunk_size
+            )
+
+            part = dst + ".part"
+            done = set() if restart else load_journal(destination, part, journal)
+            if not done:
+                # Create or truncate the file, written by the streams at offsets
+                destination.open(part, "wb").close()
+
+            todo = queue.Queue()
+            for index in range(-(-stat.st_size // self.chunk_size)):
+                if index not in done:
+                    todo.put(index)
+
+            resumed = sum(self._chunk_length(index, stat.st_size) for index in done)
+            streams = max(1, min(self.streams, todo.qsize()))
+            if todo.qsize():
+                self._copy(
+                    src, part, stat.st_size, todo, streams, destination, journal, done
+                )
+
+            destination.rename(part, dst)
+            if destination.exists(part + ".json"):
+                destination.remove(part + ".json")
+        finally:
+            source.close()
+            destination.close()
+
+        return TransferResult(
+            src, dst, stat.st_size, resumed, self.clock() - started, streams
+        )
+
+    def _copy(self, src, part, size, todo, streams, destination, journal, done):
+        completed = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=streams)
+        futures = [
+            executor.submit(self._run_stream, src, part, size, todo, completed)
+            for _ in range(streams)
+        ]
+
+        try:
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=0.1)
+                self._record(completed, destination, part, journal, done)
+
+            for future in futures:
+                # Raise the first error of the streams
+                future.result()
+        except BaseException:
+            self._stopped.set()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            self._record(completed, destination, part, journal, done)
+
+    def _run_stream(self, src, part, size, todo, completed):
+        source = self.source_factory()
+        destination = self.destination_factory()
+        try:
+            with source.open(src, "rb") as fin:
+                while not self._stopped.is_set():
+                    try:
+                        index = todo.get_nowait()
+                    except queue.Empty:
+                        return
+
+                    offset = index * self.chunk_size
+                    length = self._chunk_length(index, size)
+
+                    # Closing the file waits for the pipelined writes of the chunk
+                    with destination.open(part, "r+b") as fout:
+                        fout.seek(offset)
+                        for block in source.read_blocks(fin, offset, length):
+                            if self._stopped.is_set():
+                                return
+                            fout.write(block)
+
+                    completed.put(index)
+        except BaseException:
+            # Stop the other streams at the first error
+            self._stopped.set()
+            raise
+        finally:
+            source.close()
+            destination.close()
+
+    def _record(self, completed, destination, part, journal, done):
+        """Write the journal if any chunk is completed."""
+        updated = False
+        while True:
+            try:
+                done.add(completed.get_nowait())
+                updated = True
+            except queue.Empty:
+                break
+
+        if updated:
+            with destination.open(part + ".json", "wb") as f:
+                f.write(json.dumps(dict(journal, done=sorted(done))).encode("utf-8"))
+
+    def _chunk_length(self, index, size):
+        return min(self.chunk_size, size - index * self.chunk_size)
+
+
+def load_journal(files, part, journal):
+    """
+    Returns:
+        set: indices of completed chunks, empty unless the partial file
+            was written from the same source with the same chunk size
+    """
+    if not (files.exists(part) and files.exists(part + ".json")):
+        return set()
+
+    try:
+        with files.open(part + ".json", "rb") as f:
+            saved = json.loads(f.read().decode("utf-8"))
+    except ValueError:
+        return set()
+
+    if any(saved.get(key) != value for key, value in journal.items()):
+        return set()
+
+    return set(saved.get("done", []))
+
+
+def format_transfer(verb, result):
+    """
+    Example:
+        "[ssh] uploaded a.bin -> /srv/a.bin: 104.9 MB in 2.31s (45.4 MB/s, 4 streams)"
+    """
+    transferred = result.size - result.resumed
+    rate = transferred / result.elapsed if result.elapsed > 0 else 0.0
+
+    text = "[ssh] {} {} -> {}: {} in {:.2f}s ({}/s, {} stream{}".format(
+        verb,
+        result.source,
+        result.destination,
+        format_bytes(transferred),
+        result.elapsed,
+        format_bytes(rate),
+        result.streams,
+        "" if result.streams == 1 else "s",
+    )
+    if result.resumed:
+        text += ", resumed after {}".format(format_bytes(result.resumed))
+
+    return text + ")"
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1000 or unit == "TB":
+            break
+        n /= 1000.0
+
+    if unit == "B":
+        return "{:.0f} B".format(n)
+
+    return "{:.1f} {}".format(n, unit)
@@ -0,0 +1,148 @@
+"""
+Compression and algorithm preferences of the SSH transport.
+
+`Compression`, `Ciphers`, `MACs` and `KexAlgorithms` of ~/.ssh/config, or
+the kernel settings of the same names, are applied in two steps:
+
+1. connect_options(): algorithms not selected are disabled and compression
+   is requested before the first key exchange, so the handshake and the
+   authentication never use them.
+2. apply_transport_options(): paramiko can only disable its defaults at
+   connect time, so a changed order of preference, or an algorithm appended
+   to the defaults, is set after login by renegotiating the keys.
+"""
+
+# ssh_config keys => (SecurityOptions attribute,
+#                     Transport table of supported algorithms,
+#                     key of Transport.disabled_algorithms)
+ALGORITHMS = {
+    "ciphers": ("ciphers", "_cipher_info", "ciphers"),
+    "macs": ("digests", "_mac_info", "macs"),
+    "kexalgorithms": ("kex", "_kex_info", "kex"),
+}
+
+OPTIONS = ("compression",) + tuple(ALGORITHMS)
+
+
+def transport_options(lookup):
+    """
+    Returns:
+        dict: {ssh_config key: value} of OPTIONS set in `lookup`
+    """
+    return {key: lookup[key] for key in OPTIONS if lookup.get(key)}
+
+
+def select_algorithms(spec, current, supported):
+    """Order of algorithms by an OpenSSH-style list.
+
+    "a,b" replaces the preference, "+a,b" appends to it, "-a,b" removes from it,
+    and "^a,b" puts them first. Algorithms not supported by paramiko are dropped,
+    e.g. chacha20-poly1305@openssh.com.
+
+    Returns:
+        tuple: algorithms
+
+    Raises:
+        ValueError: If no supported algorithm is left
+    """
+    prefix = spec[:1] if spec[:1] in "+-^" else ""
+    body = spec[1:] if prefix else spec
+    names = [name.strip() for name in body.split(",") if name.strip()]
+    names = [name for name in names if name in supported]
+
+    if prefix == "+":
+        selected = list(current) + [name for name in names if name not in current]
+    elif prefix == "-":
+        selected = [name for name in current if name not in names]
+    elif prefix == "^":
+        selected = names + [name for name in current if name not in names]
+    else:
+        selected = names
+
+    if not selected:
+        raise ValueError("No supported algorithm in {!r}".format(spec))
+
+    return tuple(selected)
+
+
+def connect_options(options, transport_class):
+    """
+    Keyword arguments of paramiko.SSHClient.connect() applying `options`
+    from the first key exchange.
+
+    Args:
+        transport_class: paramiko.Transport, for the defaults and
+            the supported algorithms
+
+    Returns:
+        dict: "disabled_algorithms" and "compress" if set by `options`
+
+    Raises:
+        ValueError: If an option has no supported algorithm
+    """
+    disabled = dict()
+    for key, (_, table, kind) in ALGORITHMS.items():
+        if key not in options:
+            continue
+
+        current = getattr(transport_class, "_preferred_" + kind)
+        selected = select_algorithms(
+            options[key], current, getattr(transport_class, table)
+        )
+        disabled[kind] = [name for name in current if name not in selected]
+
+    kwargs = dict()
+    if any(disabled.values()):
+        kwargs["disabled_algorithms"] = disabled
+    if options.get("compression", "").lower() == "yes":
+        kwargs["compress"] = True
+
+    return kwargs
+
+
+def apply_transport_options(transport, options):
+    """
+    Set the preferences of `options` on an authenticated transport,
+    and renegotiate the keys if they differ from the ones in use.
+
+    Algorithms disabled by connect_options() are not in use, so removing
+    them does not renegotiate.
+
+    Returns:
+        dict: {"cipher", "mac", "compression"} negotiated, or None if unchanged
+
+    Raises:
+        ValueError: If an option has no supported algorithm
+        paramiko.SSHException: If the renegotiation failed
+    """
+    security = transport.get_security_options()
+    disabled = getattr(transport, "disabled_algorithms", None) or dict()
+
+    changed = False
+    for key, (attribute, table, kind) in ALGORITHMS.items():
+        if key not in options:
+            continue
+
+        current = getattr(security, attribute)
+        selected = select_algorithms(options[key], current, getattr(transport, table))
+        in_use = tuple(name for name in current if name not in disabled.get(kind, ()))
+        if selected != in_use:
+            setattr(security, attribute, selected)
+            changed = True
+
+    if "compression" in options:
+        compress = options["compression"].lower() == "yes"
+        if compress != (transport.local_compression != "none"):
+            transport.use_compression(compress)
+            changed = True
+
+    if not changed:
+        return None
+
+    transport.renegotiate_keys()
+
+    return dict(
+        cipher=transport.local_cipher,
+        mac=transport.local_mac,
+        compression=transport.local_compression,
+    )
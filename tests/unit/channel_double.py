@@ -0,0 +1,49 @@
+class ChannelDouble:
+    """Replay (stream, bytes) chunks like paramiko.Channel"""
+
+    def __init__(self, chunks, eof=True):
+        self.chunks = list(chunks)
+        self.sent = b""
+        self.closed = False
+        self.eof = eof
+
+    @property
+    def eof_received(self):
+        return self.eof and not self.chunks
+
+    def _ready(self, stream):
+        return bool(self.chunks) and self.chunks[0][0] == stream
+
+    def _recv(self, stream):
+        assert self._ready(stream)
+        return self.chunks.pop(0)[1]
+
+    def recv_ready(self):
+        return self._ready("stdout")
+
+    def recv_stderr_ready(self):
+        return self._ready("stderr")
+
+    def recv(self, size):
+        return self._recv("stdout")
+
+    def recv_stderr(self, size):
+        return self._recv("stderr")
+
+    def sendall(self, data):
+        self.sent += data
+
+    def exec_command(self, command):
+        self.command = command
+
+    def close(self):
+        self.closed = True
+
+    def recv_exit_status(self):
+        return 0
+
+    def exit_status_ready(self):
+        return self.eof_received
+
+    def fileno(self):
+        raise AssertionError("should not block")
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+from channel_double import ChannelDouble
+
+from sshkernel.channel import ChannelReader
+from sshkernel.channel import aiter_channel
+from sshkernel.channel import iter_channel
+
+
+class IterChannelTest(unittest.TestCase):
+    def test_iter_channel(self):
+        channel = ChannelDouble(
+            [
+                ("stdout", b"line1\nprogress 10%\r"),
+                ("stderr", b"err"),
+                ("stdout", b"progress 20%\r \xe3"),
+                ("stdout", b"\x81\x82"),
+                ("stderr", b" \xe3\x81"),
+            ]
+        )
+
+        got = list(iter_channel(channel))
+
+        self.assertEqual(
+            got,
+            [
+                ("line1\nprogress 10%\r", None),
+                (None, "err"),
+                ("progress 20%\r ", None),
+                ("あ", None),
+                (None, " "),
+                (None, "�"),
+            ],
+        )
+
+    def test_iter_channel_counts_bytes(self):
+        channel = ChannelDouble([("stdout", b"\xe3\x81\x82\n"), ("stderr", b"err")])
+        reader = ChannelReader(channel)
+
+        list(iter_channel(channel, reader=reader))
+
+        self.assertEqual(reader.received, dict(stdout=4, stderr=3))
+
+    def test_iter_channel_is_lazy(self):
+        channel = ChannelDouble([("stdout", b"1"), ("stdout", b"2")], eof=False)
+        iterator = iter_channel(channel)
+
+        self.assertEqual(next(iterator), ("1", None))
+        self.assertEqual(channel.chunks, [("stdout", b"2")])
+
+    def test_aiter_channel(self):
+        chunks = [
+            ("stdout", b"out \xe3"),
+            ("stderr", b"err"),
+            ("stdout", b"\x81\x82"),
+        ]
+
+        async def collect():
+            return [chunk async for chunk in aiter_channel(ChannelDouble(chunks))]
+
+        self.assertEqual(
+            list(iter_channel(ChannelDouble(chunks))), asyncio.run(collect())
+        )
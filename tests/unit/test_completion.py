@@ -0,0 +1,48 @@
+import unittest
+
+from sshkernel.completion import CompletionCache
+
+
+class CompletionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.instance = CompletionCache(ttl=10, clock=lambda: self.now)
+
+    def test_get_narrower_prefix(self):
+        ret = self.instance.put("command", "l", "ctx", ["ls", "less", "lsof", "a"])
+
+        self.assertEqual(ret, ["less", "ls", "lsof"])
+        self.assertEqual(self.instance.get("command", "ls", "ctx"), ["ls", "lsof"])
+        self.assertEqual(
+            self.instance.get("command", "l", "ctx"), ["less", "ls", "lsof"]
+        )
+        self.assertIsNone(self.instance.get("command", "", "ctx"))
+        self.assertIsNone(self.instance.get("variable", "ls", "ctx"))
+
+    def test_get_other_directory(self):
+        self.instance.put("command", "", "ctx", ["dir/", "ls"])
+
+        self.assertEqual(self.instance.get("command", "di", "ctx"), ["dir/"])
+        self.assertIsNone(self.instance.get("command", "dir/a", "ctx"))
+
+        self.instance.put("command", "dir/", "ctx", ["dir/a", "dir/b"])
+        self.assertEqual(self.instance.get("command", "dir/a", "ctx"), ["dir/a"])
+
+    def test_ttl(self):
+        self.instance.put("command", "l", "ctx", ["ls"])
+
+        self.now = 10
+        self.assertEqual(self.instance.get("command", "l", "ctx"), ["ls"])
+
+        self.now = 11
+        self.assertIsNone(self.instance.get("command", "l", "ctx"))
+
+    def test_invalidate_on_context_change(self):
+        self.instance.put("command", "l", "ctx", ["ls"])
+
+        self.assertIsNone(self.instance.get("command", "l", "other"))
+
+        self.instance.put("variable", "A", "other", ["AB"])
+        self.assertIsNone(self.instance.get("command", "l", "ctx"))
+        self.assertEqual(self.instance.get("variable", "A", "other"), ["AB"])
+        self.assertEqual((self.instance.hits, self.instance.misses), (1, 2))
@@ -0,0 +1,94 @@
+import unittest
+from unittest.mock import Mock
+
+from sshkernel.fanout import Fanout
+from sshkernel.fanout import FanoutResult
+from sshkernel.fanout import LinePrefixer
+from sshkernel.fanout import format_summary
+from sshkernel.fanout import parse_hosts
+
+
+class SSHWrapperDouble:
+    def __init__(self):
+        self.host = None
+        self.closed = False
+
+    def connect(self, host):
+        if host == "down":
+            raise OSError("unreachable")
+        self.host = host
+
+    def exec_command(self, cmd, print_function, error_function):
+        print_function("out of ")
+        print_function("{}\nlast".format(self.host))
+        error_function("err\n")
+        return len(self.host)
+
+    def close(self):
+        self.closed = True
+
+
+class FanoutTest(unittest.TestCase):
+    def test_run(self):
+        wrappers = []
+
+        def factory():
+            wrappers.append(SSHWrapperDouble())
+            return wrappers[-1]
+
+        out, err = [], []
+        results = Fanout(factory, concurrency=2).run(
+            ["a", "bb", "down"], "ls", out.append, err.append
+        )
+
+        self.assertEqual([r.host for r in results], ["a", "bb", "down"])
+        self.assertEqual([r.code for r in results], [1, 2, None])
+        self.assertEqual(results[2].error, "OSError: unreachable")
+        self.assertTrue(all(w.closed for w in wrappers))
+
+        lines = "".join(out).splitlines()
+        self.assertEqual(
+            sorted(lines), ["[a] last", "[a] out of a", "[bb] last", "[bb] out of bb"]
+        )
+        self.assertEqual(sorted(err), ["[a] err\n", "[bb] err\n"])
+
+    def test_interrupt(self):
+        instance = Fanout(SSHWrapperDouble)
+        wrapper = Mock()
+        instance._wrappers["a"] = wrapper
+
+        instance.interrupt()
+
+        wrapper.interrupt.assert_called_once()
+
+
+class UtilityTest(unittest.TestCase):
+    def test_line_prefixer(self):
+        out = []
+        instance = LinePrefixer("[h] ", out.append)
+
+        instance.write("a\nb")
+        instance.write("c\n\nd")
+        self.assertEqual(out, ["[h] a\n", "[h] bc\n[h] \n"])
+
+        instance.flush()
+        self.assertEqual(out[-1], "[h] d\n")
+
+    def test_parse_hosts(self):
+        self.assertEqual(parse_hosts("a, b,,a,c "), ["a", "b", "c"])
+        self.assertEqual(parse_hosts(""), [])
+
+    def test_format_summary(self):
+        results = [
+            FanoutResult("host1", 0, None, 1.25),
+            FanoutResult("h2", None, "OSError: down", 0.0),
+        ]
+
+        self.assertEqual(
+            format_summary(results).splitlines(),
+            [
+                "host      time  exit",
+                "host1     1.2s  0",
+                "h2        0.0s  OSError: down",
+            ],
+        )
@@ -0,0 +1,81 @@
+import unittest
+
+from sshkernel.footer import FooterParser
+from sshkernel.footer import partial_suffix_length
+
+
+class FooterParserTest(unittest.TestCase):
+    marker = "12345.678"
+    stream = (
+        "out1\nout2 12345"
+        "12345.678\0code\x00127\0pwd\0/a: b\0sum\x001 2\0"
+        "env\0A=1\0B=x=y\0C=multi\nline\0"
+        "12345.678\n"
+    )
+
+    def parse(self, chunks):
+        parser = FooterParser(self.marker)
+        out = "".join(parser.feed(chunk) for chunk in chunks) + parser.flush()
+
+        return out, parser.records()
+
+    def test_records(self):
+        out, records = self.parse([self.stream])
+
+        self.assertEqual(out, "out1\nout2 12345")
+        self.assertEqual(
+            records,
+            dict(
+                code=127,
+                pwd="/a: b",
+                sum="1 2",
+                env=dict(A="1", B="x=y", C="multi\nline"),
+            ),
+        )
+
+    def test_split_at_every_position(self):
+        expected = self.parse([self.stream])
+
+        for i in range(len(self.stream)):
+            for size in [1, 3]:
+                chunks = [self.stream[:i]]
+                for start in range(i, len(self.stream), size):
+                    end = start + size
+                    chunks.append(self.stream[start:end])
+
+                self.assertEqual(self.parse(chunks), expected)
+
+    def test_without_env(self):
+        _, records = self.parse(
+            ["12345.678\0code\x000\0pwd\0/\0sum\x001\x0012345.678\n"]
+        )
+
+        self.assertEqual(records, dict(code=0, pwd="/", sum="1"))
+
+    def test_incomplete(self):
+        out, records = self.parse(["out", "12345.6"])
+
+        self.assertEqual(out, "out12345.6")
+        self.assertIsNone(records)
+
+        parser = FooterParser(self.marker)
+        parser.feed("12345.678\0code\x000\0")
+        self.assertIsNone(parser.records())
+
+    def test_output_after_footer(self):
+        parser = FooterParser(self.marker)
+
+        self.assertEqual(parser.feed("12345.678\0code\x000\x0012345.678\nrest"), "rest")
+        self.assertEqual(parser.feed("more"), "more")
+        self.assertEqual(parser.records(), dict(code=0))
+
+    def test_broken_code(self):
+        _, records = self.parse(["12345.678\0code\0x\0pwd\0/\x0012345.678\n"])
+
+        self.assertEqual(records, dict(pwd="/"))
+
+    def test_partial_suffix_length(self):
+        self.assertEqual(partial_suffix_length("abcMAR", "MARKER"), 3)
+        self.assertEqual(partial_suffix_length("abc", "MARKER"), 0)
+        self.assertEqual(partial_suffix_length("MARKER", "MARKER"), 0)
+        self.assertEqual(partial_suffix_length("M", "MARKER"), 1)
@@ -0,0 +1,48 @@
+import subprocess
+import unittest
+from unittest.mock import Mock
+
+from channel_double import ChannelDouble
+
+from sshkernel.interrupt import escalation_script
+from sshkernel.interrupt import group_escalation_script
+from sshkernel.interrupt import signal_remote
+
+
+def run_script(script):
+    return subprocess.run(
+        ["/bin/sh", "-c", script], stdout=subprocess.PIPE, check=True
+    ).stdout.decode()
+
+
+class InterruptTest(unittest.TestCase):
+    def test_escalation_script_stops_when_terminated(self):
+        script = escalation_script("true", "echo {sig} >&2", "false", (1.0, 1.0))
+
+        self.assertEqual(run_script(script), "INT\n")
+
+    def test_escalation_script_escalates(self):
+        script = escalation_script("true", ": {sig}", "true", (0.1, 0.0))
+
+        self.assertEqual(run_script(script), "KILL\n")
+
+    def test_group_escalation_script(self):
+        script = group_escalation_script(123, (0.5, 1.0))
+
+        self.assertTrue(script.startswith("kill -s INT -- -123 "))
+        self.assertIn("kill -s TERM -- -123", script)
+        self.assertIn("kill -s KILL -- -123", script)
+        self.assertIn("__sshkernel_n=5\n", script)
+        self.assertIn("__sshkernel_n=10\n", script)
+
+    def test_signal_remote(self):
+        channel = ChannelDouble([("stdout", b"TERM\n")])
+        transport = Mock()
+        transport.open_session.return_value = channel
+
+        result = signal_remote(transport, "script")
+
+        self.assertEqual(channel.command, "script")
+        self.assertTrue(channel.closed)
+        self.assertEqual(result["signal"], "TERM")
+        self.assertGreaterEqual(result["elapsed"], 0)
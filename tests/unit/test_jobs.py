@@ -0,0 +1,136 @@
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+from channel_double import ChannelDouble
+
+from sshkernel.jobs import follow
+from sshkernel.jobs import follow_script
+from sshkernel.jobs import format_jobs
+from sshkernel.jobs import launch_script
+from sshkernel.jobs import list_script
+from sshkernel.jobs import parse_jobs
+from sshkernel.jobs import JobStatus
+
+
+class JobsTest(unittest.TestCase):
+    def test_parse_jobs(self):
+        lines = [
+            "bbbb\trunning\t1200\t200\tmake -j8",
+            "aaaa\texit 1\t0\t100\techo 'a\tb'",
+            "broken line",
+        ]
+
+        jobs = parse_jobs(lines)
+
+        self.assertEqual(
+            jobs,
+            [
+                JobStatus("aaaa", "exit 1", 0, 100, "echo 'a\tb'"),
+                JobStatus("bbbb", "running", 1200, 200, "make -j8"),
+            ],
+        )
+
+    def test_format_jobs(self):
+        jobs = [JobStatus("bbbb", "running", 1200, 200, "make -j8")]
+
+        text = format_jobs(jobs, dict(bbbb=200), now=500)
+
+        self.assertIn("bbbb      running     1.2 KB    1.0 KB  5m ago   make -j8", text)
+        self.assertEqual(format_jobs([], dict()), "[ssh] No jobs.")
+
+    def test_follow(self):
+        channel = ChannelDouble(
+            [
+                ("stdout", b"line 1\n\xe3\x81"),
+                ("stdout", b"\x82\n"),
+                ("stderr", b"exit 3\n"),
+            ]
+        )
+        offsets = dict(job=10)
+        written = []
+
+        code = follow(channel, "job", offsets, written.append)
+
+        self.assertEqual(code, 3)
+        self.assertEqual("".join(written), "line 1\nあ\n")
+        self.assertEqual(offsets, dict(job=21))
+        self.assertIn(b"off=10\n", channel.sent)
+        self.assertTrue(channel.closed)
+
+    def test_follow_running(self):
+        channel = ChannelDouble([("stdout", b"a\n\xe3\x81"), ("stderr", b"running\n")])
+        offsets = dict()
+        written = []
+
+        code = follow(channel, "job", offsets, written.append, follow=False)
+
+        self.assertIsNone(code)
+        self.assertEqual(written, ["a\n"])
+        # The incomplete character is received again next time
+        self.assertEqual(offsets, dict(job=2))
+
+    def test_follow_truncated_character(self):
+        channel = ChannelDouble([("stdout", b"a\xe3\x81"), ("stderr", b"exit 0\n")])
+        offsets = dict()
+        written = []
+
+        follow(channel, "job", offsets, written.append)
+
+        self.assertEqual("".join(written), "a\ufffd")
+        self.assertEqual(offsets, dict(job=3))
+
+    def test_follow_missing(self):
+        channel = ChannelDouble([("stderr", b"missing\n")])
+
+        with self.assertRaises(KeyError):
+            follow(channel, "job", dict(), lambda _: None)
+
+
+class JobScriptsTest(unittest.TestCase):
+    """Run the scripts with a local shell, in a temporary HOME."""
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.env = dict(os.environ, HOME=tempdir.name)
+
+    def run_script(self, shell, script):
+        return subprocess.run(
+            [shell],
+            input=script,
+            env=self.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+    def test_launch_follow_and_list(self):
+        cell = "echo one\necho 'two' >&2\nexit 3\n"
+
+        proc = self.run_script("bash", launch_script("j1", cell))
+        self.assertRegex(proc.stdout, r"^j1 \d+\n$")
+
+        proc = self.run_script("sh", follow_script("j1", interval=0.05))
+        self.assertEqual(proc.stdout, "one\ntwo\n")
+        self.assertEqual(proc.stderr, "exit 3\n")
+
+        proc = self.run_script("sh", follow_script("j1", offset=4, follow=False))
+        self.assertEqual(proc.stdout, "two\n")
+
+        jobs = parse_jobs(self.run_script("sh", list_script()).stdout.splitlines())
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0][:3], ("j1", "exit 3", 8))
+        self.assertLessEqual(abs(jobs[0].started - time.time()), 60)
+        self.assertEqual(jobs[0].command, "echo one")
+
+        self.run_script("sh", list_script(clean=True))
+        self.assertEqual(self.run_script("sh", list_script()).stdout, "")
+
+    def test_follow_missing_job(self):
+        proc = self.run_script("sh", follow_script("nosuch"))
+
+        self.assertEqual(proc.returncode, 1)
+        self.assertEqual(proc.stderr, "missing\n")
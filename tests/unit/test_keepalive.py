@@ -0,0 +1,108 @@
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+from sshkernel.keepalive import Keepalive
+from sshkernel.keepalive import RollingHistogram
+from sshkernel.keepalive import TrafficCounter
+from sshkernel.keepalive import traffic_counter
+
+
+class RollingHistogramTest(unittest.TestCase):
+    def test_percentile(self):
+        histogram = RollingHistogram(size=100)
+        self.assertIsNone(histogram.percentile(50))
+
+        for i in range(1, 101):
+            histogram.add(i)
+
+        self.assertEqual(histogram.percentile(50), 50)
+        self.assertEqual(histogram.percentile(99), 99)
+        self.assertEqual(histogram.percentile(100), 100)
+        self.assertEqual(histogram.percentile(0), 1)
+
+    def test_keeps_last_samples(self):
+        histogram = RollingHistogram(size=3)
+        for i in [100, 1, 2, 3]:
+            histogram.add(i)
+
+        self.assertEqual(len(histogram), 3)
+        self.assertEqual(histogram.percentile(100), 3)
+
+
+class TrafficCounterTest(unittest.TestCase):
+    def test_count(self):
+        transport = Mock()
+        transport.packetizer.read_all.return_value = b"abc"
+        write_all = transport.packetizer.write_all
+
+        counter = TrafficCounter(transport)
+        transport.packetizer.write_all(b"12345")
+        transport.packetizer.read_all(3, check_rekey=True)
+
+        write_all.assert_called_once_with(b"12345")
+        self.assertEqual((counter.sent, counter.received), (5, 3))
+
+    def test_one_counter_per_transport(self):
+        transport = Mock()
+        counter = traffic_counter(transport)
+        write_all = transport.packetizer.write_all
+
+        self.assertIs(traffic_counter(transport), counter)
+        self.assertIs(Keepalive(transport).traffic, counter)
+        self.assertIs(transport.packetizer.write_all, write_all)
+
+
+class KeepaliveTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.transport = Mock()
+        self.transport.is_active.return_value = True
+        self.instance = Keepalive(self.transport, clock=lambda: self.now)
+
+    def test_probe(self):
+        def reply(kind, wait):
+            self.now += 0.25
+
+        self.transport.global_request.side_effect = reply
+
+        self.assertIsNone(self.instance.since_last_success())
+        self.assertEqual(self.instance.probe(), 0.25)
+
+        self.transport.global_request.assert_called_once_with(
+            "keepalive@openssh.com", wait=True
+        )
+        self.assertEqual(self.instance.rtt.percentile(50), 0.25)
+        self.now += 1
+        self.assertEqual(self.instance.since_last_success(), 1.0)
+
+    def test_probe_closed(self):
+        self.transport.is_active.return_value = False
+
+        self.assertIsNone(self.instance.probe())
+        self.assertEqual(self.instance.failures, 1)
+        self.assertEqual(len(self.instance.rtt), 0)
+
+    def test_close_without_reply(self):
+        blocked = threading.Event()
+        self.addCleanup(blocked.set)
+        self.transport.global_request.side_effect = lambda *_, **__: blocked.wait()
+        instance = Keepalive(self.transport, interval=0.01, count_max=2)
+
+        instance.start()
+        instance._thread.join(timeout=5)
+
+        self.assertFalse(instance._thread.is_alive())
+        self.transport.close.assert_called_once()
+        self.assertEqual(instance.failures, 1)
+
+    def test_stop(self):
+        instance = Keepalive(self.transport, interval=0.01)
+        instance.start()
+        time.sleep(0.05)
+        instance.stop()
+        instance._thread.join(timeout=5)
+
+        self.assertFalse(instance._thread.is_alive())
+        self.assertGreater(instance.probes, 0)
@@ -1,28 +1,68 @@
+import asyncio
+import errno
+import json
+import os
+import tempfile
+import threading
+from logging import INFO
 from textwrap import dedent
+from unittest.mock import AsyncMock
 from unittest.mock import Mock
 from unittest.mock import PropertyMock
 from unittest.mock import patch
 import unittest
 
+import zmq
 from ipykernel.kernelbase import Kernel
+from jupyter_client.session import Session
 from sshkernel import ExceptionWrapper
 from sshkernel import SSHException
 from sshkernel.exception import SSHKernelNotConnectedException
+from sshkernel.exception import SSHKernelQueryError
+from sshkernel.exception import SSHKernelQueryTimeout
+from sshkernel.keepalive import Keepalive
 from sshkernel.kernel import SSHKernel
+from sshkernel.kernel import request_type
 from sshkernel.ssh_wrapper import SSHWrapper
+from sshkernel.ssh_wrapper_async import SSHWrapperAsync
+from sshkernel.timing import CellTimer
 
 
 class SSHWrapperDummy:
     def __init__(self, *args):
-        pass
+        self.host = None
+        self.closed = False
 
     def connect(self, host):
-        pass
+        self.host = host
+
+    def close(self):
+        self.closed = True
+
+    def query(self, cmd, timeout):
+        return ["ls"]
+
+    def get_cwd(self):
+        return "/"
+
+    def get_env_fingerprint(self):
+        return ""
+
+    def get_session_names(self):
+        return []
+
+    def get_transport(self):
+        return None
 
 
 class SSHKernelTest(unittest.TestCase):
     def setUp(self):
         self.instance = SSHKernel(sshwrapper_class=SSHWrapperDummy)
+        self.addCleanup(self.instance.spools.clear)
+
+        patcher = patch("sshkernel.kernel.Keepalive")
+        self.keepalive_class = patcher.start()
+        self.addCleanup(patcher.stop)
         # type(self.instance).sshwrapper = PropertyMock(return_value=Mock(spec=SSHWrapper))
         self.instance.Error = Mock()
         self.instance.Print = Mock()
@@ -42,6 +82,133 @@ class SSHKernelTest(unittest.TestCase):
     def test_do_login(self):
         self.instance.do_login("dummy")
 
+    def test_do_login_prefetches_completions(self):
+        self.instance.do_login("dummy")
+
+        self.assertEqual(
+            self.instance.completion_cache.get("command", "l", ("/", "")), ["ls"]
+        )
+
+    @patch("sshkernel.ssh_wrapper_persistent.SSHWrapperPersistent")
+    def test_do_login_persistent(self, wrapper_class):
+        self.instance.do_login("dummy", persistent=True)
+
+        wrapper_class.return_value.connect.assert_called_once_with("dummy")
+        self.assertEqual(self.instance.sshwrapper, wrapper_class.return_value)
+
+    @patch("sshkernel.ssh_wrapper_persistent.SSHWrapperPersistent")
+    def test_do_login_logs_mux_hello(self, wrapper_class):
+        wrapper_class.return_value.mux_socket = "/tmp/mux.sock"
+        wrapper_class.return_value.mux_hello = dict(reused=True, handshake_time=0.5)
+
+        with self.assertLogs(self.instance.log, "INFO") as logs:
+            self.instance.do_login("dummy", persistent=True)
+
+        self.assertIn(
+            "attached to mux /tmp/mux.sock reused=True handshake_time=0.500s",
+            logs.output[0],
+        )
+
+    @patch("sshkernel.ssh_wrapper_persistent.SSHWrapperPersistent")
+    def test_do_login_starts_keepalive(self, wrapper_class):
+        transport = wrapper_class.return_value.get_transport.return_value
+
+        self.instance.do_login("dummy", persistent=True)
+
+        self.keepalive_class.assert_called_once_with(transport, 30.0, count_max=3)
+        keepalive = self.instance.keepalive
+        keepalive.start.assert_called_once()
+
+        self.instance.do_logout()
+        keepalive.stop.assert_called_once()
+        self.assertIsNone(self.instance.keepalive)
+
+    def test_do_login_keepalive_disabled(self):
+        self.instance.set_param("SSHKERNEL_KEEPALIVE_INTERVAL", "0")
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+
+        self.instance.start_keepalive()
+
+        self.keepalive_class.assert_not_called()
+        self.assertIsNone(self.instance.keepalive)
+
+    def test_named_sessions(self):
+        self.instance.do_login("host1")
+        default = self.instance.sshwrapper
+        self.instance.do_login("host2", name="db")
+        db = self.instance.sshwrapper
+
+        self.assertEqual(self.instance.session_name, "db")
+        self.assertEqual(db.host, "host2")
+        self.assertFalse(default.closed)
+
+        self.instance.do_use("default")
+        self.assertIs(self.instance.sshwrapper, default)
+        self.assertIs(
+            self.instance.completion_cache,
+            self.instance.sessions.get("default").completion_cache,
+        )
+
+        # Replace a session of the same name
+        self.instance.do_login("host3", name="db")
+        self.assertTrue(db.closed)
+        self.assertEqual(self.instance.sshwrapper.host, "host3")
+
+        self.instance.do_logout()
+        self.assertIsNone(self.instance.sshwrapper)
+        self.assertEqual(
+            [s.name for s in self.instance.sessions.sessions()], ["default"]
+        )
+
+        with self.assertRaises(KeyError):
+            self.instance.do_use("db")
+
+    def test_use_keeps_traffic_counter(self):
+        self.keepalive_class.side_effect = Keepalive
+        self.addCleanup(self.instance.stop_keepalive)
+        transport = Mock()
+
+        self.instance.do_login("host1")
+        self.instance.sshwrapper.get_transport = lambda: transport
+        self.instance.do_login("host2", name="db")
+
+        self.instance.do_use("default")
+        transport.packetizer.write_all(b"12345")
+        write_all = transport.packetizer.write_all
+
+        self.instance.do_use("db")
+        self.instance.do_use("default")
+        transport.packetizer.write_all(b"12345")
+
+        self.assertIs(transport.packetizer.write_all, write_all)
+        self.assertEqual(self.instance.keepalive.traffic.sent, 10)
+
+    def test_sessions_max(self):
+        self.instance.set_param("SSHKERNEL_SESSIONS_MAX", "2")
+        for name in ["a", "b", "c"]:
+            self.instance.do_login(name, name=name)
+
+        self.assertEqual(
+            [s.name for s in self.instance.sessions.sessions()], ["b", "c"]
+        )
+        self.assertNotIn("a", self.instance.sessions)
+
+    def test_idle_sessions_are_closed(self):
+        now = [0.0]
+        self.instance.sessions.clock = lambda: now[0]
+        self.instance.do_login("host1", name="idle")
+        idle = self.instance.sshwrapper
+        self.instance.do_login("host2", name="busy")
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sessions.get("busy").wrapper = self.instance.sshwrapper
+        self.instance.sshwrapper.exec_command.return_value = 0
+
+        now[0] = 3601.0
+        self.instance.do_execute_direct("ls")
+
+        self.assertTrue(idle.closed)
+        self.assertEqual([s.name for s in self.instance.sessions.sessions()], ["busy"])
+
     def test_do_execute_direct_should_return_exception_value(self):
         err = self.instance.do_execute_direct("ls")
         self.assertIsInstance(err, ExceptionWrapper)
@@ -71,6 +238,54 @@ class SSHKernelTest(unittest.TestCase):
         self.assertIsInstance(err, ExceptionWrapper)
         self.assertEqual(err.evalue, "1")
 
+    def test_do_execute_direct_records_timing(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.exec_command.return_value = 0
+        wrapper_timer = CellTimer()
+        wrapper_timer.mark("command")
+        wrapper_timer.count("stdout", 3)
+        self.instance.sshwrapper.last_timing = wrapper_timer
+
+        self.instance.do_execute_direct("ls")
+        self.assertEqual(
+            list(self.instance.last_timing["phases"]), ["prepare", "command", "flush"]
+        )
+        self.instance.Print.assert_not_called()
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.instance.set_param("SSHKERNEL_TIMING_LOG", path)
+        self.instance.timing = self.instance.timing_rusage = True
+
+        metadata = self.instance.init_metadata(dict(header=dict()))
+        self.instance.do_execute_direct("ls")
+        metadata = self.instance.finish_metadata(dict(), metadata, dict())
+
+        self.assertTrue(self.instance.sshwrapper.rusage)
+        self.assertIn("[ssh] timing: total", self.instance.Print.call_args[0][0])
+        self.assertEqual(metadata["sshkernel"]["timing"]["bytes"], dict(stdout=3))
+        with open(path) as f:
+            logged = [json.loads(line) for line in f]
+        self.assertEqual(len(logged), 1)
+        self.assertEqual(logged[0]["code"], 0)
+
+        metadata = self.instance.init_metadata(dict(header=dict()))
+        self.assertNotIn("sshkernel", self.instance.finish_metadata({}, metadata, {}))
+
+    def test_record_timing_disables_unwritable_log(self):
+        self.instance.Print = Mock()
+        self.instance.timing = True
+        with tempfile.TemporaryDirectory() as path:
+            self.instance.set_param("SSHKERNEL_TIMING_LOG", path)
+
+            with self.assertLogs(self.instance.log, INFO) as logs:
+                self.instance.record_timing(CellTimer(), 0)
+
+        levels = [r.levelname for r in logs.records]
+        self.assertEqual(levels, ["WARNING", "INFO"])
+        self.assertEqual(self.instance.get_setting("TIMING_LOG"), "")
+
     def test_exec_with_exception_should_return_exception(self):
         self.instance.sshwrapper = PropertyMock(spec=SSHWrapper)
         self.instance.sshwrapper.exec_command = Mock(side_effect=SSHException("boom"))
@@ -79,9 +294,210 @@ class SSHKernelTest(unittest.TestCase):
 
         self.assertIsInstance(err, ExceptionWrapper)
 
+    def test_exec_with_exception_should_reconnect(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.exec_command = Mock(side_effect=EOFError("boom"))
+
+        err = self.instance.do_execute_direct("sl")
+
+        self.assertEqual(err.ename, "ssh_exception")
+        self.instance.sshwrapper.reconnect.assert_called_once()
+        self.assertEqual(self.instance.reconnect_stats["reconnects"], 1)
+
+        self.instance.sshwrapper.exec_command.side_effect = OSError("Socket is closed")
+        err = self.instance.do_execute_direct("sl")
+        self.assertEqual(err.ename, "ssh_exception")
+        self.assertEqual(self.instance.sshwrapper.reconnect.call_count, 2)
+
+    def test_exec_local_os_error_is_not_reconnected(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.exec_command = Mock(
+            side_effect=OSError(errno.ENOSPC, "No space left on device")
+        )
+
+        with self.assertRaises(OSError):
+            self.instance.do_execute_direct("sl")
+
+        self.instance.sshwrapper.reconnect.assert_not_called()
+
+    def test_do_shutdown_with_sync_metakernel(self):
+        reply = dict(status="ok", restart=True)
+
+        with patch("metakernel.MetaKernel.do_shutdown", Mock(return_value=reply)):
+            self.assertEqual(asyncio.run(self.instance.do_shutdown(True)), reply)
+
+    def test_exec_reconnects_before_execution(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.isconnected.side_effect = [False, True, True]
+        self.instance.sshwrapper.exec_command.return_value = 0
+
+        err = self.instance.do_execute_direct("ls")
+
+        self.assertIsNone(err)
+        self.instance.sshwrapper.reconnect.assert_called_once()
+        self.instance.sshwrapper.exec_command.assert_called_once()
+
+    def test_do_execute_async(self):
+        async def exec_double(cmd, callback, error_callback):
+            callback("out\n")
+            return 2
+
+        self.instance.sshwrapper = Mock(spec=SSHWrapperAsync)
+        self.instance.sshwrapper.exec_command_async = exec_double
+
+        coroutine = self.instance.do_execute_direct("ls")
+        err = asyncio.run(coroutine)
+
+        self.assertEqual(err.evalue, "2")
+        self.instance.Write.assert_called_once_with("out\n")
+        self.instance.sshwrapper.exec_command.assert_not_called()
+
+    def test_do_execute_async_cancelled(self):
+        async def exec_double(cmd, callback, error_callback):
+            await asyncio.sleep(10)
+
+        self.instance.sshwrapper = Mock(spec=SSHWrapperAsync)
+        self.instance.sshwrapper.exec_command_async = exec_double
+        self.instance.sshwrapper.last_interrupt = dict(signal="TERM", elapsed=2.5)
+        self.instance.set_param("SSHKERNEL_INTERRUPT_TERM_TIMEOUT", "1")
+
+        async def run_and_cancel():
+            task = asyncio.ensure_future(self.instance.do_execute_direct("sleep"))
+            await asyncio.sleep(0.01)
+            # Same as SIGINT
+            for handle in asyncio.all_tasks():
+                if handle is not task and handle is not asyncio.current_task():
+                    handle.cancel()
+            return await task
+
+        err = asyncio.run(run_and_cancel())
+
+        self.assertEqual(err.ename, "abort")
+        self.assertEqual(self.instance.sshwrapper.interrupt_timeouts, (1.0, 5.0))
+        self.instance.Error.assert_any_call("[ssh] Terminated by SIGTERM in 2.5s")
+
+    @patch("sshkernel.kernel.Fanout")
+    def test_do_fanout(self, fanout_class):
+        self.instance.set_param("SSHKERNEL_FANOUT_CONCURRENCY", "4")
+
+        def run_double(hosts, cmd, write, write_error):
+            write("[a] out\n")
+            return ["result"]
+
+        fanout_class.return_value.run.side_effect = run_double
+
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "on")
+        self.instance.set_param("DIR", "/tmp")
+        self.assertEqual(self.instance.do_fanout(["a"], "ls {DIR}"), ["result"])
+
+        self.assertEqual(fanout_class.call_args[1], dict(concurrency=4))
+        self.assertEqual(fanout_class.return_value.run.call_args[0][1], "ls /tmp")
+        self.assertIsInstance(fanout_class.call_args[0][0](), SSHWrapperDummy)
+        self.instance.Write.assert_called_once_with("[a] out\n")
+
+    def test_new_wrapper_takes_transport_overrides(self):
+        self.instance.set_param("SSHKERNEL_COMPRESSION", "yes")
+
+        wrapper = self.instance.new_wrapper()
+
+        self.assertEqual(
+            wrapper.transport_overrides,
+            dict(compression="yes", ciphers="", macs="", kexalgorithms=""),
+        )
+
+    @patch("sshkernel.kernel.Transfer")
+    def test_do_transfer(self, transfer_class):
+        self.instance.do_login("host")
+        self.instance.set_param("SSHKERNEL_TRANSFER_STREAMS", "2")
+
+        self.instance.do_transfer(True, "a.bin")
+        transfer_class.return_value.run.assert_called_with(
+            os.path.abspath("a.bin"), "/", restart=False
+        )
+        self.assertEqual(transfer_class.call_args[1]["streams"], 2)
+
+        self.instance.do_transfer(False, "data/b.csv", "/tmp", restart=True)
+        transfer_class.return_value.run.assert_called_with(
+            "/data/b.csv", "/tmp", restart=True
+        )
+
+    def test_do_transfer_without_login(self):
+        with self.assertRaises(SSHKernelNotConnectedException):
+            self.instance.do_transfer(True, "a.bin")
+
+    def test_get_variable(self):
+        self.instance.tables["t"] = table = Mock()
+
+        self.assertIs(self.instance.get_variable("t"), table)
+        self.assertIsNone(self.instance.get_variable("missing"))
+
+    def test_do_background(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.query.side_effect = lambda script, timeout: [
+            script.splitlines()[-1].split()[1] + " 4242"
+        ]
+
+        job_id, pid = self.instance.do_background("make -j8")
+
+        self.assertEqual(pid, 4242)
+        self.assertEqual(self.instance.job_offsets, {job_id: 0})
+        self.assertIn("make -j8", self.instance.sshwrapper.query.call_args[0][0])
+
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "on")
+        self.instance.set_param("J", "16")
+        self.instance.do_background("make -j{J}")
+        self.assertIn("make -j16", self.instance.sshwrapper.query.call_args[0][0])
+
+    def test_do_background_fails(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.query.return_value = []
+
+        with self.assertRaises(SSHKernelQueryError):
+            self.instance.do_background("make -j8")
+
+    @patch("sshkernel.kernel.follow")
+    def test_do_attach(self, follow):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.job_offsets["abc"] = 100
+        follow.return_value = 0
+
+        self.assertEqual(self.instance.do_attach("abc", from_start=True), 0)
+
+        channel = self.instance.sshwrapper.open_channel.return_value
+        self.assertEqual(follow.call_args[0][:3], (channel, "abc", dict(abc=0)))
+        self.assertEqual(follow.call_args[1], dict(follow=True))
+
+    def test_do_attach_reconnects(self):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.isconnected.return_value = False
+        self.instance.reconnect = Mock(return_value=False)
+
+        with self.assertRaises(SSHKernelNotConnectedException):
+            self.instance.do_attach("abc")
+        self.instance.reconnect.assert_called_once_with()
+
+    @patch("time.sleep")
+    def test_reconnect_with_backoff(self, sleep):
+        self.instance.sshwrapper = Mock(spec=SSHWrapper)
+        self.instance.sshwrapper.reconnect.side_effect = [OSError, OSError, None]
+
+        self.assertTrue(self.instance.reconnect())
+
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1.0, 2.0])
+        self.assertEqual(self.instance.reconnect_stats["reconnects"], 1)
+        # Probe the new transport
+        self.keepalive_class.return_value.start.assert_called_once()
+
+        self.instance.set_param("SSHKERNEL_RECONNECT_RETRIES", "2")
+        self.instance.sshwrapper.reconnect.side_effect = OSError
+
+        self.assertFalse(self.instance.reconnect())
+        self.assertEqual(self.instance.reconnect_stats["failures"], 1)
+
     def test_exec_with_interrupt_should_return_exception(self):
         self.instance.sshwrapper = PropertyMock(spec=SSHWrapper)
         self.instance.sshwrapper.exec_command = Mock(side_effect=KeyboardInterrupt())
+        self.instance.sshwrapper.interrupt.return_value = None
 
         err = self.instance.do_execute_direct("sleep 10000")
 
@@ -92,6 +508,19 @@ class SSHKernelTest(unittest.TestCase):
         self.assertIsInstance(err.evalue, str)
         self.assertIsInstance(err.traceback, list)
 
+    def test_exec_with_interrupt_should_report_signal(self):
+        self.instance.sshwrapper = PropertyMock(spec=SSHWrapper)
+        self.instance.sshwrapper.exec_command = Mock(side_effect=KeyboardInterrupt())
+        self.instance.sshwrapper.interrupt.return_value = dict(
+            signal="KILL", elapsed=7.04
+        )
+        self.instance.set_param("SSHKERNEL_INTERRUPT_KILL_TIMEOUT", "5")
+
+        self.instance.do_execute_direct("sleep 10000")
+
+        self.instance.sshwrapper.interrupt.assert_called_once_with((2.0, 5.0))
+        self.instance.Error.assert_any_call("[ssh] Terminated by SIGKILL in 7.0s")
+
         self.instance.Error.assert_called()
 
     @unittest.skip
@@ -125,7 +554,7 @@ class SSHKernelTest(unittest.TestCase):
 
         self.instance.assert_connected = connected_double
 
-        matches = self.instance.do_complete("code", len("code"))
+        matches = self.instance.complete("code", len("code"))
 
         connected_double.assert_called_once()
         self.assertEqual(matches["matches"], [])
@@ -135,7 +564,7 @@ class SSHKernelTest(unittest.TestCase):
             connected_double = Mock(return_value=True)
             self.instance.assert_connected = connected_double
 
-            matches = self.instance.do_complete("", 0)
+            matches = self.instance.complete("", 0)
 
             connected_double.assert_called_once()
             self.assertEqual(matches["matches"], [])
@@ -151,7 +580,7 @@ class SSHKernelTest(unittest.TestCase):
 
     @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
     def test_complete_bash_variables(self, mock):
-        def exec_double(cmd, callback):
+        def query_double(cmd, timeout):
             result = dedent(
                 """\
                 BASH_ARGC
@@ -160,15 +589,12 @@ class SSHKernelTest(unittest.TestCase):
                 BASH_REMATCH
                 """
             )
-            for line in result.split():
-                callback(line)
-
-            return 0
+            return result.splitlines()
 
         # Replace with double without Mock()
-        self.instance.sshwrapper.exec_command = exec_double
+        self.instance.sshwrapper.query = query_double
 
-        res = self.instance.do_complete("$BASH", 5)
+        res = self.instance.complete("$BASH", 5)
 
         self.check_completion(res)
 
@@ -179,7 +605,7 @@ class SSHKernelTest(unittest.TestCase):
 
     @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
     def test_complete_bash_commands(self, mock):
-        def exec_double(cmd, callback):
+        def query_double(cmd, timeout):
             result = dedent(
                 """\
                 ls
@@ -188,18 +614,152 @@ class SSHKernelTest(unittest.TestCase):
                 lslogins
                 """
             )
-            for line in result.split():
-                callback(line)
-            return 0
+            return result.splitlines()
 
         # Replace with double without Mock()
-        self.instance.sshwrapper.exec_command = exec_double
+        self.instance.sshwrapper.query = query_double
 
-        res = self.instance.do_complete("ls", 3)
+        res = self.instance.complete("ls", 3)
         self.check_completion(res)
 
         self.assertEqual(res["matches"], ["ls", "lslogins", "lspcmcia"])
 
+    @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
+    def test_complete_uses_cache(self, mock):
+        wrapper = mock.return_value
+        wrapper.get_cwd.return_value = "/home"
+        wrapper.get_env_fingerprint.return_value = "1 2"
+
+        wrapper.query = Mock(return_value=["ls", "lslogins", "lspcmcia"])
+
+        self.instance.complete("l", 1)
+        res = self.instance.complete("lsl", 3)
+
+        self.assertEqual(res["matches"], ["lslogins"])
+        wrapper.query.assert_called_once_with("compgen -cdfa l", 5.0)
+        wrapper.exec_command.assert_not_called()
+
+        wrapper.get_cwd.return_value = "/tmp"
+        self.instance.complete("lsl", 3)
+        self.assertEqual(wrapper.query.call_count, 2)
+
+    @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
+    def test_complete_session_names(self, mock):
+        wrapper = mock.return_value
+        wrapper.get_cwd.return_value = "/home"
+        wrapper.get_env_fingerprint.return_value = ""
+        wrapper.get_session_names.return_value = ["ll", "lsx", "ls", "gs"]
+        wrapper.query = Mock(return_value=["ls", "lsblk"])
+
+        res = self.instance.complete("l", 1)
+
+        self.assertEqual(res["matches"], ["ll", "ls", "lsblk", "lsx"])
+
+    @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
+    def test_complete_query_error(self, mock):
+        mock.return_value.query = Mock(side_effect=SSHKernelQueryTimeout)
+
+        res = self.instance.complete("ls", 2)
+
+        self.assertEqual(res["matches"], [])
+
+    @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
+    def test_do_complete_in_query_thread(self, mock):
+        threads = []
+        mock.return_value.query = Mock(
+            side_effect=lambda cmd, timeout: threads.append(threading.current_thread())
+            or ["ls", "lsblk"]
+        )
+        mock.return_value.get_cwd.return_value = "/"
+        mock.return_value.get_env_fingerprint.return_value = ""
+
+        res = asyncio.run(self.instance.do_complete("ls", 2))
+
+        self.assertEqual(res["matches"], ["ls", "lsblk"])
+        self.assertTrue(threads[0].name.startswith("sshkernel-query"))
+
+    @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
+    def test_do_inspect_in_query_thread(self, mock):
+        threads = []
+        mock.return_value.query = Mock(
+            side_effect=lambda cmd, timeout: threads.append(threading.current_thread())
+            or ["ls is /usr/bin/ls"]
+        )
+
+        res = asyncio.run(self.instance.do_inspect("ls", 2))
+
+        self.assertTrue(res["found"])
+        self.assertEqual(res["data"]["text/plain"], "ls is /usr/bin/ls")
+        self.assertTrue(threads[0].name.startswith("sshkernel-query"))
+
+    def test_do_inspect_with_sync_metakernel(self):
+        reply = dict(status="ok", found=False)
+
+        with patch("metakernel.MetaKernel.do_inspect", Mock(return_value=reply)):
+            res = asyncio.run(self.instance.do_inspect("ls", 2))
+
+        self.assertEqual(res, reply)
+
+    def test_shell_main_answers_side_requests_during_cell(self):
+        session = Session(key=b"")
+        self.instance.session = session
+        self.instance.dispatch_shell = AsyncMock()
+
+        def raw(msg_type):
+            msg = session.msg(msg_type, dict(code="ls", cursor_pos=2))
+            return [zmq.Frame(f) for f in session.serialize(msg, ident=[b"id"])]
+
+        async def shell_main_during_cell(msg):
+            lock = self.instance._main_asyncio_lock = asyncio.Lock()
+            async with lock:
+                await self.instance.shell_main(None, msg)
+
+        complete = raw("complete_request")
+        asyncio.run(shell_main_during_cell(complete))
+        self.instance.dispatch_shell.assert_awaited_once_with(
+            complete, subshell_id=None, concurrent=True
+        )
+
+        # Other requests wait for the cell
+        with patch.object(Kernel, "shell_main", AsyncMock()) as shell_main:
+            execute = raw("execute_request")
+            asyncio.run(shell_main_during_cell(execute))
+            shell_main.assert_awaited_once_with(None, execute)
+        self.instance.dispatch_shell.assert_awaited_once()
+
+        # Without the internals of ipykernel 7, all requests wait for the cell
+        with patch("sshkernel.kernel.CONCURRENT_DISPATCH", False), patch.object(
+            Kernel, "shell_main", AsyncMock()
+        ) as shell_main:
+            asyncio.run(shell_main_during_cell(complete))
+            shell_main.assert_awaited_once_with(None, complete)
+        self.instance.dispatch_shell.assert_awaited_once()
+
+    def test_request_type(self):
+        session = Session(key=b"")
+        msg = session.msg("inspect_request", dict())
+        frames = [zmq.Frame(f) for f in session.serialize(msg, ident=[b"id"])]
+
+        self.assertEqual(request_type(session, frames), "inspect_request")
+        self.assertIsNone(request_type(session, [zmq.Frame(b"broken")]))
+
+    @patch("sshkernel.kernel.SSHKernel.sshwrapper", new_callable=PropertyMock)
+    def test_get_kernel_help_on(self, mock):
+        mock.return_value.query = Mock(
+            return_value=["ls is /usr/bin/ls", "ls (1) - list"]
+        )
+
+        info = self.instance.parse_code("ls")
+        text = self.instance.get_kernel_help_on(info, 0, none_on_fail=True)
+
+        self.assertEqual(text, "ls is /usr/bin/ls\nls (1) - list")
+        mock.return_value.query.assert_called_once_with(
+            "type ls; help -d ls; man -f ls", 5.0
+        )
+
+        mock.return_value.query = Mock(side_effect=SSHKernelQueryTimeout)
+        self.assertIsNone(self.instance.get_kernel_help_on(info, 0, none_on_fail=True))
+
     def test_sshwrapper_setter(self):
         self.assertIsNone(self.instance.sshwrapper)
         self.assertIsNone(self.instance._sshwrapper)
@@ -223,3 +783,113 @@ class SSHKernelTest(unittest.TestCase):
         self.instance.set_param("KEY1", "VALUE1")
         self.assertEqual({"KEY1": "VALUE1"}, self.instance.get_params())
 
+    def test_new_output_buffer_spools_the_cell(self):
+        self.instance.execution_count = 7
+
+        with self.instance.new_output_buffer(Mock()) as output:
+            output.write("out\n")
+
+        self.assertIs(self.instance.spools.get(), output.spool)
+        self.assertEqual(output.spool.label, 7)
+        with open(output.spool.path) as f:
+            self.assertEqual(f.read(), "out\n")
+
+        self.instance.set_param("SSHKERNEL_SPOOL_KEEP", "0")
+        self.assertIsNone(self.instance.new_output_buffer(Mock()).spool)
+
+    def test_settings(self):
+        self.assertEqual(self.instance.get_setting("OUTPUT_LIMIT"), 1000000)
+
+        self.instance.set_param("SSHKERNEL_OUTPUT_LIMIT", "100")
+        self.instance.set_param("KEY1", "VALUE1")
+
+        self.assertEqual(self.instance.get_setting("OUTPUT_LIMIT"), 100)
+        self.assertEqual({"KEY1": "VALUE1"}, self.instance.get_env_params())
+
+        with self.assertRaises(ValueError):
+            self.instance.set_param("SSHKERNEL_OUTPUT_LIMIT", "many")
+        with self.assertRaises(KeyError):
+            self.instance.set_param("SSHKERNEL_NOTFOUND", "1")
+
+    def test_param_export(self):
+        self.instance.set_param("KEY1", "VALUE1")
+        self.instance.set_param("SSHKERNEL_PARAM_EXPORT", "no")
+
+        self.assertEqual(self.instance.get_env_params(), dict())
+        self.assertEqual(self.instance.get_params()["KEY1"], "VALUE1")
+
+    def test_expand_cell(self):
+        self.instance.set_param("DIR", "/data")
+        self.assertEqual(self.instance.expand_cell("ls {DIR}"), "ls {DIR}")
+
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "on")
+        self.assertEqual(
+            self.instance.expand_cell("ls {DIR} {{DIR}} ${DIR} {OTHER}"),
+            "ls /data {DIR} ${DIR} {OTHER}",
+        )
+        # Kernel settings are not parameters of cells
+        self.assertEqual(
+            self.instance.expand_cell("echo {SSHKERNEL_TEMPLATE}"),
+            "echo {SSHKERNEL_TEMPLATE}",
+        )
+
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "strict")
+        with self.assertRaisesRegex(KeyError, r"\{OTHER\}"):
+            self.instance.expand_cell("ls {OTHER}")
+
+    def test_expand_cell_escapes_without_parameters(self):
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "on")
+
+        self.assertEqual(self.instance.expand_cell("echo {{X}}"), "echo {X}")
+
+    def test_do_execute_direct_expands_parameters(self):
+        self.instance.sshwrapper = Mock()
+        self.instance.sshwrapper.exec_command.return_value = 0
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "on")
+        self.instance.set_param("N", "3")
+
+        self.assertIsNone(self.instance.do_execute_direct("seq {N}"))
+        self.assertEqual(self.instance.sshwrapper.exec_command.call_args[0][0], "seq 3")
+
+        self.instance.set_param("SSHKERNEL_TEMPLATE", "strict")
+        err = self.instance.do_execute_direct("seq {M}")
+
+        self.assertIsInstance(err, ExceptionWrapper)
+        self.assertEqual(self.instance.sshwrapper.exec_command.call_count, 1)
+        self.instance.Error.assert_called_once_with("[ssh] Undefined parameter {M}")
+
+    def test_do_execute_direct_coalesces_output(self):
+        def exec_double(cmd, callback, error_callback):
+            for i in range(3):
+                callback("line{}\n".format(i))
+            return 0
+
+        self.instance.sshwrapper = Mock()
+        self.instance.sshwrapper.exec_command = exec_double
+
+        err = self.instance.do_execute_direct("seq 3")
+
+        self.assertIsNone(err)
+        self.instance.Write.assert_called_once_with("line0\nline1\nline2\n")
+
+    def test_do_execute_direct_routes_stderr(self):
+        def exec_double(cmd, callback, error_callback):
+            callback("out1\n")
+            error_callback("err1\n")
+            error_callback("err2\n")
+            callback("out2\n")
+            return 0
+
+        self.instance.sshwrapper = Mock()
+        self.instance.sshwrapper.exec_command = exec_double
+        self.instance.set_param("SSHKERNEL_CAPTURE_SIZE", "6")
+
+        self.instance.do_execute_direct("cmd")
+
+        self.assertEqual(
+            [c.args[0] for c in self.instance.Write.call_args_list],
+            ["out1\n", "out2\n"],
+        )
+        self.instance.Error.assert_called_once_with("err1\nerr2\n", end="")
+        self.assertEqual(self.instance.captured["stdout"].getvalue(), "\nout2\n")
+        self.assertEqual(self.instance.captured["stderr"].getvalue(), "\nerr2\n")
@@ -1,8 +1,14 @@
+import tempfile
 import unittest
 from unittest.mock import Mock
 
+from sshkernel.fanout import FanoutResult
+from sshkernel.keepalive import Keepalive
 from sshkernel.kernel import SSHKernel
 from sshkernel.magics.magics import SSHKernelMagics
+from sshkernel.session import SessionRegistry
+from sshkernel.spool import SpoolRegistry
+from sshkernel.transfer import TransferResult
 from sshkernel.magics.magics import expand_parameters
 from sshkernel.magics.magics import validate_value_string
 
@@ -20,9 +26,57 @@ class MagicTest(unittest.TestCase):
         host = "dummy"
         self.instance.line_login(host)
 
-        self.kernel.do_login.assert_called_once_with(host)
+        self.kernel.do_login.assert_called_once_with(host, persistent=False, name=None)
         self.assertIsNone(self.instance.retval)
 
+    def test_login_persistent(self):
+        self.instance.line_login("dummy", persistent=True)
+
+        self.kernel.do_login.assert_called_once_with(
+            "dummy", persistent=True, name=None
+        )
+
+    def test_login_as(self):
+        self.instance.line_login("dummy", name="db")
+
+        self.kernel.do_login.assert_called_once_with(
+            "dummy", persistent=False, name="db"
+        )
+
+    def test_use(self):
+        self.kernel.do_use.return_value.host = "dbhost"
+
+        self.instance.line_use("db")
+
+        self.kernel.do_use.assert_called_once_with("db")
+        self.assertIn("host = dbhost", self.kernel.Print.call_args[0][0])
+        self.assertIsNone(self.instance.retval)
+
+    def test_use_unknown(self):
+        self.kernel.do_use.side_effect = KeyError("db")
+
+        self.instance.line_use("db")
+
+        self.kernel.Error.assert_called_once()
+        self.assertIsNotNone(self.instance.retval)
+
+    def test_use_lists_sessions(self):
+        registry = SessionRegistry(clock=lambda: 10.0)
+        registry.add("default", "host1", Mock(**{"get_cwd.return_value": "/"}))
+        registry.add("db", "host2", Mock(**{"get_cwd.return_value": "/tmp"}))
+        self.kernel.sessions = registry
+        self.kernel.session_name = "default"
+
+        self.instance.line_use()
+
+        self.assertEqual(
+            self.kernel.Print.call_args[0][0].splitlines(),
+            [
+                "  db  host = host2, cwd = /tmp, idle 0s",
+                "* default  host = host1, cwd = /, idle 0s",
+            ],
+        )
+
     def test_logout_should_call_logout(self):
         self.instance.line_logout()
 
@@ -34,6 +88,200 @@ class MagicTest(unittest.TestCase):
         self.instance.line_login("dummy")
         self.assertIsNotNone(self.instance.retval)
 
+    def test_captured(self):
+        ring = Mock()
+        ring.getvalue.return_value = "err\n"
+        self.kernel.captured = dict(stdout=Mock(), stderr=ring)
+
+        self.instance.line_captured("stderr")
+
+        self.kernel.Write.assert_called_once_with("err\n")
+
+    def test_captured_disabled(self):
+        self.kernel.captured = dict()
+
+        self.instance.line_captured()
+
+        self.kernel.Error.assert_called_once()
+        self.kernel.Write.assert_not_called()
+
+    def test_capture_table(self):
+        self.kernel.get_setting.return_value = 0
+        self.kernel.tables = dict()
+
+        self.instance.cell_capture_table("disks", fmt="ws")
+        self.kernel.output_tap("Size Used\n1G 2G\n")
+        retval = self.instance.post_process("cell retval")
+
+        self.assertEqual(retval, "cell retval")
+        self.assertIsNone(self.kernel.output_tap)
+        self.assertEqual(
+            self.kernel.tables["disks"].to_dict(), dict(Size=["1G"], Used=["2G"])
+        )
+        self.kernel.Display.assert_called_once()
+
+    def test_capture_table_unknown_format(self):
+        self.instance.code = "df"
+
+        self.instance.cell_capture_table("disks", fmt="xml")
+
+        self.assertEqual(self.instance.code, "")
+        self.assertEqual(self.instance.retval.ename, "ValueError")
+        self.assertIsNone(self.instance.table_capture)
+
+    def test_ssh_status(self):
+        keepalive = Keepalive(Mock(), clock=lambda: 10.0)
+        keepalive.rtt.add(0.0125)
+        keepalive.last_success = 7.5
+        keepalive.traffic.sent = 100
+        self.kernel.keepalive = keepalive
+        self.kernel.reconnect_stats = dict(reconnects=1, failures=0, last_latency=2.0)
+
+        self.instance.line_ssh_status()
+
+        out = self.kernel.Print.call_args[0][0]
+        self.assertIn("p50=12.5ms", out)
+        self.assertIn("last reply: 2.5s ago", out)
+        self.assertIn("bytes: sent 100, received 0", out)
+        self.assertIn("reconnects: 1", out)
+
+    def test_ssh_status_not_logged_in(self):
+        self.kernel.sshwrapper = None
+
+        self.instance.line_ssh_status()
+
+        self.kernel.Error.assert_called_once()
+        self.kernel.Print.assert_not_called()
+
+    def test_timing(self):
+        self.instance.line_timing("on", rusage=True)
+        self.assertTrue(self.kernel.timing)
+        self.assertTrue(self.kernel.timing_rusage)
+
+        self.instance.line_timing("off", rusage=True)
+        self.assertFalse(self.kernel.timing)
+        self.assertFalse(self.kernel.timing_rusage)
+
+        self.instance.line_timing("yes")
+        self.assertEqual(self.instance.retval.ename, "ValueError")
+
+    def test_timing_shows_last_cell(self):
+        self.kernel.last_timing = None
+        self.instance.line_timing()
+        self.kernel.Error.assert_called_once()
+
+        self.kernel.last_timing = dict(
+            total=0.5, phases=dict(command=0.5), spent=dict(), bytes=dict()
+        )
+        self.instance.line_timing()
+        self.kernel.Print.assert_called_once_with(
+            "[ssh] timing: total 500.0ms | command 500.0ms"
+        )
+
+    def test_fanout(self):
+        self.kernel.get_params.return_value = dict(NODES="b,c")
+        self.kernel.do_fanout.return_value = [
+            FanoutResult("a", 0, None, 1.0),
+            FanoutResult("b", 2, None, 1.0),
+            FanoutResult("c", None, "OSError: down", 1.0),
+        ]
+        self.instance.code = "uptime\n"
+
+        self.instance.cell_fanout("a,{NODES}")
+
+        self.kernel.do_fanout.assert_called_once_with(["a", "b", "c"], "uptime\n")
+        self.assertIn("OSError: down", self.kernel.Print.call_args[0][0])
+        self.assertEqual(self.instance.retval.evalue, "2 of 3 hosts")
+        # The cell is not executed on the current login
+        self.assertEqual(self.instance.code, "")
+
+    def test_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = SpoolRegistry(directory)
+            spool = registry.create(5)
+            spool.write("ok\nERROR disk full\nok\n")
+            spool.close()
+            self.kernel.spools = registry
+
+            self.instance.line_output("5", grep="ERROR")
+            self.assertIn("      2  ERROR disk full", self.kernel.Print.call_args[0][0])
+
+            self.instance.line_output("4")
+            self.assertEqual(self.instance.retval.ename, "KeyError")
+
+            self.instance.line_output(lines_range="x")
+            self.assertEqual(self.instance.retval.ename, "ValueError")
+
+    def test_upload(self):
+        self.kernel.do_transfer.return_value = TransferResult(
+            "/tmp/a.bin", "/home/user/a.bin", 2000000, 0, 1.0, 4
+        )
+
+        self.instance.line_upload("a.bin")
+
+        self.kernel.do_transfer.assert_called_once_with(
+            True, "a.bin", None, restart=False
+        )
+        self.kernel.Print.assert_called_once_with(
+            "[ssh] uploaded /tmp/a.bin -> /home/user/a.bin: "
+            "2.0 MB in 1.00s (2.0 MB/s, 4 streams)"
+        )
+        self.assertIsNone(self.instance.retval)
+
+    def test_download_fails(self):
+        self.kernel.do_transfer.side_effect = IOError("No such file")
+
+        self.instance.line_download("missing.csv", "out/", restart=True)
+
+        self.kernel.do_transfer.assert_called_once_with(
+            False, "missing.csv", "out/", restart=True
+        )
+        self.assertEqual(self.instance.retval.ename, "OSError")
+
+    def test_bg(self):
+        self.kernel.do_background.return_value = ("3f2a91bc", 4242)
+        self.instance.code = "make -j8\n"
+
+        self.instance.cell_bg()
+
+        self.kernel.do_background.assert_called_once_with("make -j8\n")
+        self.kernel.Print.assert_called_once_with(
+            "[ssh] job 3f2a91bc started (pid 4242), see %attach 3f2a91bc"
+        )
+        self.assertEqual(self.instance.code, "")
+        self.assertIsNone(self.instance.retval)
+
+    def test_jobs(self):
+        self.kernel.do_jobs.return_value = []
+        self.kernel.job_offsets = dict()
+
+        self.instance.line_jobs(clean=True)
+
+        self.kernel.do_jobs.assert_called_once_with(True)
+        self.kernel.Print.assert_called_once_with("[ssh] No jobs.")
+
+    def test_attach(self):
+        self.kernel.do_attach.return_value = 2
+
+        self.instance.line_attach("3f2a91bc", no_follow=True)
+
+        self.kernel.do_attach.assert_called_once_with(
+            "3f2a91bc", follow_output=False, from_start=False
+        )
+        self.assertEqual(self.instance.retval.ename, "job failed")
+
+        self.kernel.do_attach.side_effect = KeyError("nosuch")
+        self.instance.line_attach("nosuch")
+        self.assertEqual(self.instance.retval.ename, "KeyError")
+
+    def test_attach_detaches_on_interrupt(self):
+        self.kernel.do_attach.side_effect = KeyboardInterrupt
+
+        self.instance.line_attach("3f2a91bc")
+
+        self.assertIsNone(self.instance.retval)
+        self.assertIn("keeps running", self.kernel.Error.call_args[0][0])
+
     def test_expand_parameters(self):
         params = dict(A="1", B="3")
         s = "{A}2{B}"
@@ -45,6 +293,12 @@ class MagicTest(unittest.TestCase):
         with self.assertRaises(KeyError):
             expand_parameters("{NOTFOUND}", {})
 
+    def test_expand_parameters_any_name(self):
+        params = {"host-name": "a", "SSHKERNEL_X": "b"}
+
+        self.assertEqual(expand_parameters("{host-name}.example", params), "a.example")
+        self.assertEqual(expand_parameters("{SSHKERNEL_X}", params), "b")
+
     def test_expand_parameters_with_unclosed_string(self):
         ret = expand_parameters("{YO", {})
         self.assertEqual(ret, "{YO")
@@ -68,3 +322,16 @@ class MagicTest(unittest.TestCase):
         for ng in ng_cases:
             with self.assertRaises(ValueError):
                 func(ng)
+
+        self.assertIsNone(func("~/timing.jsonl", home=True))
+        with self.assertRaises(ValueError):
+            func("~/timing.jsonl")
+        with self.assertRaises(ValueError):
+            func("/tmp/~x", home=True)
+
+    def test_param_path_setting(self):
+        self.instance.line_param("SSHKERNEL_TIMING_LOG", "~/timing.jsonl")
+
+        self.kernel.set_param.assert_called_once_with(
+            "SSHKERNEL_TIMING_LOG", "~/timing.jsonl"
+        )
@@ -0,0 +1,212 @@
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from paramiko.ssh_exception import SSHException
+
+from sshkernel.channel import iter_channel
+from sshkernel.mux import EXIT
+from sshkernel.mux import FAIL
+from sshkernel.mux import HELLO
+from sshkernel.mux import STDERR
+from sshkernel.mux import STDIN
+from sshkernel.mux import STDOUT
+from sshkernel.mux import FrameReader
+from sshkernel.mux import MuxChannel
+from sshkernel.mux import MuxServer
+from sshkernel.mux import send_frame
+
+
+class FrameReaderTest(unittest.TestCase):
+    def test_feed(self):
+        a, b = socket.socketpair()
+        send_frame(a, STDOUT, b"out")
+        send_frame(a, EXIT, b"0")
+        data = b.recv(1024)
+
+        reader = FrameReader()
+        self.assertEqual(reader.feed(data[:2]), [])
+        self.assertEqual(reader.feed(data[2:10]), [(STDOUT, b"out")])
+        self.assertEqual(reader.feed(data[10:]), [(EXIT, b"0")])
+
+
+class MuxChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.daemon, sock = socket.socketpair()
+        self.instance = MuxChannel(sock, "host")
+
+    def tearDown(self):
+        self.daemon.close()
+        self.instance.close()
+
+    def test_exec_command(self):
+        send_frame(self.daemon, HELLO, b'{"reused": true, "handshake_time": 0.5}')
+        send_frame(self.daemon, STDOUT, b"out\xe3")
+        send_frame(self.daemon, STDERR, b"err")
+        send_frame(self.daemon, STDOUT, b"\x81\x82")
+        send_frame(self.daemon, EXIT, b"3")
+        self.daemon.shutdown(socket.SHUT_WR)
+
+        self.instance.exec_command("bash")
+        self.instance.sendall(b"ls\n")
+
+        self.assertEqual(self.instance.hello, dict(reused=True, handshake_time=0.5))
+        self.assertEqual(
+            list(iter_channel(self.instance)),
+            [(None, "err"), ("outあ", None)],
+        )
+        self.assertEqual(self.instance.recv_exit_status(), 3)
+
+        reader = FrameReader()
+        frames = reader.feed(self.daemon.recv(1024))
+        self.assertEqual(frames[-1], (STDIN, b"ls\n"))
+
+    def test_exec_command_fail(self):
+        send_frame(self.daemon, FAIL, b"auth failed")
+
+        with self.assertRaises(SSHException):
+            self.instance.exec_command("bash")
+
+        self.assertTrue(self.instance.closed)
+
+
+class MuxServerTest(unittest.TestCase):
+    def setUp(self):
+        self.connect_function = Mock()
+        self.instance = MuxServer(
+            "/nonexistent", idle_timeout=0.01, connect_function=self.connect_function
+        )
+
+        patcher = patch(
+            "sshkernel.mux.load_ssh_config_for_plumbum",
+            return_value=("10.0.0.1", dict(user="u", port=22), None),
+        )
+        self.loader = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_acquire_and_release(self):
+        conn1, reused1 = self.instance.acquire("host")
+        conn2, reused2 = self.instance.acquire("alias")
+        conn3, _ = self.instance.acquire("host", attach=False)
+
+        self.assertIs(conn1, conn2)
+        self.assertIs(conn1, conn3)
+        self.assertEqual((reused1, reused2), (False, True))
+        self.assertEqual(conn1.key, ("u", "10.0.0.1", 22))
+        self.assertEqual(conn1.refs, 3)
+        self.assertEqual(self.instance.stats["handshakes"], 1)
+        self.assertEqual(self.instance.stats["reused"], 1)
+        self.connect_function.assert_called_once_with("host")
+
+        for conn in (conn1, conn2, conn3):
+            self.instance.release(conn)
+        time.sleep(0.2)
+
+        conn1.remote.close.assert_called_once()
+        _, reused = self.instance.acquire("host")
+        self.assertFalse(reused)
+        self.assertEqual(self.instance.stats["handshakes"], 2)
+
+    def test_acquire_cancels_expiry(self):
+        conn, _ = self.instance.acquire("host")
+        self.instance.idle_timeout = 60
+        self.instance.release(conn)
+        self.assertIsNotNone(conn.idle_timer)
+
+        self.instance.acquire("host")
+        self.assertIsNone(conn.idle_timer)
+        conn.remote.close.assert_not_called()
+
+    def test_acquire_reconnects_inactive(self):
+        conn, _ = self.instance.acquire("host")
+        conn.remote._client.get_transport.return_value.is_active.return_value = False
+
+        conn2, reused = self.instance.acquire("host")
+
+        self.assertFalse(reused)
+        self.assertIsNot(conn, conn2)
+        conn.remote.close.assert_called_once()
+
+    def test_handshake_does_not_block_other_hosts(self):
+        self.loader.side_effect = lambda path, host: (host, dict(user="u", port=22))
+        entered, unblock = threading.Event(), threading.Event()
+
+        def connect(host):
+            if host == "slow":
+                entered.set()
+                unblock.wait(5)
+            return Mock()
+
+        self.connect_function.side_effect = connect
+        slow = threading.Thread(target=self.instance.acquire, args=["slow"])
+        slow.start()
+        self.assertTrue(entered.wait(5))
+
+        # The lock is free while connecting to the slow host
+        conn, reused = self.instance.acquire("fast")
+        self.assertEqual((conn.key[1], reused), ("fast", False))
+
+        self.instance.release(conn)
+        unblock.set()
+        slow.join(5)
+        self.assertEqual(self.instance.stats["handshakes"], 2)
+
+    def test_concurrent_acquire_waits_for_handshake(self):
+        unblock = threading.Event()
+
+        def connect(host):
+            unblock.wait(5)
+            return Mock()
+
+        self.connect_function.side_effect = connect
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.instance.acquire("h")))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        unblock.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.connect_function.assert_called_once_with("h")
+        self.assertEqual(len({id(conn) for conn, _ in results}), 1)
+        self.assertEqual(sorted(reused for _, reused in results), [False, True, True])
+        self.assertEqual(results[0][0].refs, 3)
+
+    def test_failed_handshake_is_raised_to_waiters(self):
+        unblock = threading.Event()
+
+        def connect(host):
+            unblock.wait(5)
+            raise OSError("unreachable")
+
+        self.connect_function.side_effect = connect
+        errors = []
+
+        def acquire():
+            try:
+                self.instance.acquire("h")
+            except OSError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=acquire) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        unblock.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.connect_function.assert_called_once()
+
+        # The next caller tries again
+        self.connect_function.side_effect = None
+        _, reused = self.instance.acquire("h")
+        self.assertFalse(reused)
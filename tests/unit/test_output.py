@@ -0,0 +1,136 @@
+import contextvars
+import time
+import unittest
+from unittest.mock import Mock
+
+from sshkernel.output import OutputBuffer
+from sshkernel.output import RingBuffer
+
+
+class OutputBufferTest(unittest.TestCase):
+    def test_coalesce_until_close(self):
+        write = Mock()
+
+        with OutputBuffer(write, flush_interval=60) as output:
+            for i in range(100):
+                output.write("line{}\n".format(i))
+
+            write.assert_not_called()
+
+        write.assert_called_once_with("".join("line{}\n".format(i) for i in range(100)))
+
+    def test_flush_by_size(self):
+        write = Mock()
+        output = OutputBuffer(write, flush_interval=60, flush_size=10)
+
+        output.write("12345")
+        write.assert_not_called()
+        output.write("67890")
+        write.assert_called_once_with("1234567890")
+
+        output.close()
+        write.assert_called_once()
+
+    def test_flush_by_interval(self):
+        write = Mock()
+        output = OutputBuffer(write, flush_interval=0.01)
+
+        output.write("partial")
+        time.sleep(0.2)
+
+        write.assert_called_once_with("partial")
+        output.close()
+        write.assert_called_once()
+
+    def test_flush_by_interval_in_writer_context(self):
+        request = contextvars.ContextVar("request", default=None)
+        write = Mock(side_effect=lambda text: seen.append(request.get()))
+        seen = []
+        output = OutputBuffer(write, flush_interval=0.01)
+
+        request.set("cell")
+        output.write("partial")
+        time.sleep(0.2)
+
+        self.assertEqual(seen, ["cell"])
+        output.close()
+
+    def test_limit(self):
+        write = Mock()
+
+        with OutputBuffer(write, flush_size=4, limit=10) as output:
+            output.write("123\n")
+            output.write("456\n")
+            output.write("789\nabc\n")
+            output.write("def\n")
+
+        written = "".join(c.args[0] for c in write.call_args_list)
+        self.assertTrue(written.startswith("123\n456\n78\n"))
+        self.assertIn("truncated: 10 characters (3 lines)", written)
+        self.assertEqual(output.written, 10)
+
+    def test_limit_with_tail_and_spool(self):
+        write = Mock()
+        spool = Mock(label=3)
+
+        with OutputBuffer(write, limit=4, tail_size=5, spool=spool) as output:
+            output.write("123\n")
+            output.write("456\n789\n")
+            output.write_error("abc\n")
+
+        written = "".join(c.args[0] for c in write.call_args_list)
+        self.assertEqual(
+            written,
+            "123\n\n[ssh] Output truncated: 8 characters (2 lines) omitted, "
+            "see %output 3\nabc\n",
+        )
+        self.assertEqual(
+            [c.args[0] for c in spool.write.call_args_list],
+            ["123\n", "456\n789\n", "abc\n"],
+        )
+        spool.close.assert_called_once_with()
+
+    def test_tap(self):
+        write = Mock()
+        tapped = []
+
+        with OutputBuffer(write, limit=2, tap=tapped.append) as output:
+            output.write("a,b\n")
+            output.write_error("err\n")
+            output.write("1,2\n")
+
+        self.assertEqual(tapped, ["a,b\n", "1,2\n"])
+        self.assertEqual(write.call_args_list[0].args, ("er",))
+
+    def test_flush_on_stream_change(self):
+        write = Mock()
+        error = Mock()
+
+        with OutputBuffer(write, error, flush_interval=60) as output:
+            output.write("a")
+            output.write("b")
+            output.write_error("c")
+            write.assert_called_once_with("ab")
+            error.assert_not_called()
+            output.write("d")
+            error.assert_called_once_with("c")
+
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(output.captured, dict())
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_ring_buffer(self):
+        ring = RingBuffer(5)
+
+        ring.append("ab")
+        self.assertEqual(ring.getvalue(), "ab")
+
+        ring.append("cdef")
+        ring.append("g")
+        self.assertEqual(ring.getvalue(), "cdefg")
+        self.assertEqual(len(ring), 5)
+        self.assertEqual(ring.total, 7)
+
+        ring.append("0123456789")
+        self.assertEqual(ring.getvalue(), "56789")
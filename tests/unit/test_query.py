@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from channel_double import ChannelDouble
+
+from sshkernel.exception import SSHKernelQueryError
+from sshkernel.exception import SSHKernelQueryTimeout
+from sshkernel.query import QueryShell
+from sshkernel.query import wrap_query
+
+
+class QueryShellTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = Mock()
+        self.instance = QueryShell(self.transport)
+
+    def test_run(self):
+        channel = ChannelDouble(
+            [("stdout", b"ls\nls"), ("stderr", b"error"), ("stdout", b"of\n1.2\n")],
+            eof=False,
+        )
+        self.transport.open_session.return_value = channel
+
+        with patch("time.time", return_value=2.1):
+            lines = self.instance.run("compgen -c ls", cwd="/tmp")
+
+        self.assertEqual(lines, ["ls", "lsof"])
+        self.assertIn(b"compgen -c ls\n", channel.sent)
+        self.assertIn(b"cd -- /tmp", channel.sent)
+        self.assertFalse(channel.closed)
+
+        self.transport.open_session.assert_called_once()
+
+    @patch("select.select")
+    def test_run_timeout(self, select):
+        channel = ChannelDouble([], eof=False)
+        self.transport.open_session.return_value = channel
+
+        with self.assertRaises(SSHKernelQueryTimeout):
+            self.instance.run("sleep 10", timeout=0)
+
+        self.assertTrue(channel.closed)
+
+    def test_run_closed(self):
+        self.transport.open_session.return_value = ChannelDouble([("stdout", b"a")])
+
+        with self.assertRaises(SSHKernelQueryError):
+            self.instance.run("exit")
+
+        self.transport.open_session.return_value = ChannelDouble([("stdout", b"1.2\n")])
+        with patch("time.time", return_value=2.1):
+            self.assertEqual(self.instance.run("true"), [])
+        self.assertEqual(self.transport.open_session.call_count, 2)
+
+
+class UtilityTest(unittest.TestCase):
+    def test_wrap_query(self):
+        script = wrap_query("type ls", "MARKER", "/a b", dict(A="x y"), {"B"})
+
+        self.assertIn("cd -- '/a b'", script)
+        self.assertIn("unset B\n", script)
+        self.assertIn("export A='x y'\n", script)
+        self.assertIn("\ntype ls\n", script)
+        self.assertTrue(script.endswith("printf '%s\\n' MARKER\n"))
@@ -0,0 +1,45 @@
+import unittest
+
+from sshkernel.session import SessionRegistry
+
+
+class SessionRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.instance = SessionRegistry(clock=lambda: self.now)
+
+    def test_add_evicts_least_recently_used(self):
+        for name in ["a", "b", "c"]:
+            self.assertEqual(self.instance.add(name, "host", name, max_sessions=3), [])
+        self.instance.get("a")
+
+        evicted = self.instance.add("d", "host", "d", max_sessions=3)
+
+        self.assertEqual([s.name for s in evicted], ["b"])
+        self.assertEqual([s.name for s in self.instance.sessions()], ["c", "a", "d"])
+
+    def test_add_replaces_same_name(self):
+        self.instance.add("a", "host1", "old")
+        self.instance.add("a", "host2", "new")
+
+        self.assertEqual(len(self.instance), 1)
+        self.assertEqual(self.instance.get("a").wrapper, "new")
+
+    def test_get_unknown(self):
+        with self.assertRaises(KeyError):
+            self.instance.get("a")
+
+    def test_expire(self):
+        self.instance.add("a", "host", "a")
+        self.instance.add("b", "host", "b")
+        self.now = 5.0
+        self.instance.touch("b")
+        self.now = 11.0
+
+        self.assertEqual(self.instance.expire(20.0), [])
+        self.assertEqual(self.instance.expire(8.0, keep="a"), [])
+
+        expired = self.instance.expire(5.0, keep="a")
+        self.assertEqual([s.name for s in expired], ["b"])
+        self.assertEqual([s.name for s in self.instance.expire(5.0)], ["a"])
+        self.assertEqual(len(self.instance), 0)
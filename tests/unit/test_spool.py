@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sshkernel import spool as spool_module
+from sshkernel.spool import SpoolReader
+from sshkernel.spool import SpoolRegistry
+from sshkernel.spool import format_page
+from sshkernel.spool import parse_range
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.registry = SpoolRegistry(self.dir, keep=2)
+
+    def tearDown(self):
+        self.registry.clear()
+        shutil.rmtree(self.dir)
+
+    def spool(self, label, text):
+        spool = self.registry.create(label)
+        spool.write(text)
+        spool.close()
+
+        return spool
+
+    def test_registry_keeps_last_cells(self):
+        first = self.spool(1, "a\n")
+        self.spool(2, "b\n")
+        last = self.spool(3, "c\n")
+
+        self.assertFalse(os.path.exists(first.path))
+        self.assertIs(self.registry.get(), last)
+        with self.assertRaises(KeyError):
+            self.registry.get(1)
+
+        self.registry.clear()
+        self.assertFalse(os.path.exists(last.path))
+        with self.assertRaises(KeyError):
+            self.registry.get()
+
+    def test_registry_in_temporary_directory(self):
+        registry = SpoolRegistry()
+        spool = registry.create(1)
+        spool.close()
+
+        directory = os.path.dirname(spool.path)
+        self.assertTrue(os.path.isdir(directory))
+        registry.clear()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_reader(self):
+        spool = self.spool(1, "".join("line{}\n".format(i) for i in range(1, 11)))
+
+        with SpoolReader(spool.path) as reader:
+            self.assertEqual(reader.line_count(), 10)
+            self.assertEqual(reader.offset(1), 0)
+            self.assertEqual(reader.offset(3), 12)
+            self.assertEqual(reader.offset(100), reader.size)
+            self.assertEqual(list(reader.lines(9)), [(9, "line9"), (10, "line10")])
+            self.assertEqual(
+                list(reader.grep(r"^line1\d*$")), [(1, "line1"), (10, "line10")]
+            )
+            self.assertEqual(
+                list(reader.grep("line", 4, 5)), [(4, "line4"), (5, "line5")]
+            )
+            # A line with many matches is yielded once
+            self.assertEqual(list(reader.grep("[ei]", 2, 2)), [(2, "line2")])
+
+    def test_reader_across_blocks(self):
+        original = spool_module.BLOCK_SIZE
+        spool_module.BLOCK_SIZE = 7
+        self.addCleanup(setattr, spool_module, "BLOCK_SIZE", original)
+
+        spool = self.spool(1, "a\nbb\nccc\ndddd\nlast")
+
+        with SpoolReader(spool.path) as reader:
+            self.assertEqual(reader.line_count(), 5)
+            self.assertEqual(list(reader.lines(4)), [(4, "dddd"), (5, "last")])
+
+    def test_reader_empty(self):
+        spool = self.spool(1, "")
+
+        with SpoolReader(spool.path) as reader:
+            self.assertEqual(reader.line_count(), 0)
+            self.assertEqual(list(reader.lines()), [])
+            self.assertEqual(list(reader.grep("x")), [])
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range(":", 100), (1, 100))
+        self.assertEqual(parse_range("10:20", 100), (10, 20))
+        self.assertEqual(parse_range("-5:", 100), (96, 100))
+        self.assertEqual(parse_range(":500", 100), (1, 100))
+        with self.assertRaises(ValueError):
+            parse_range("10-20", 100)
+
+    def test_format_page(self):
+        spool = self.spool(7, "".join("line{}\n".format(i) for i in range(1, 11)))
+
+        text = format_page(spool, lines_range="2:", max_lines=2)
+
+        self.assertEqual(
+            text.splitlines()[1:],
+            [
+                "      2  line2",
+                "      3  line3",
+                "[ssh] More lines from 4, see %output 7 --range 4:",
+            ],
+        )
+        self.assertIn("10 lines", text.splitlines()[0])
+        self.assertIn("[ssh] No lines matching.", format_page(spool, grep="nothing"))
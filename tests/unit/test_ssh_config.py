@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from textwrap import dedent
+
+import paramiko
+
+from sshkernel.ssh_config import load_ssh_config
+
+
+class LoadSSHConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as f:
+            f.write(dedent(text))
+
+        return path
+
+    def test_lookup_same_as_paramiko(self):
+        path = self.write(
+            "config",
+            """
+            Host a b
+                HostName 10.0.0.1
+                IdentityFile ~/.ssh/id_a
+            Host a*
+                User admin
+                IdentityFile ~/.ssh/id_any
+            Host c
+                Port 2222
+            Host !b *
+                User default
+            """,
+        )
+        conf = paramiko.SSHConfig()
+        with open(path) as f:
+            conf.parse(f)
+
+        cached = load_ssh_config(path)
+        for host in ["a", "b", "c", "ab", "x"]:
+            self.assertEqual(cached.lookup(host), conf.lookup(host), host)
+            self.assertEqual(cached.lookup(host), conf.lookup(host), host)
+
+        cached.lookup("a")["user"] = "changed"
+        self.assertEqual(cached.lookup("a")["user"], "admin")
+
+    def test_include(self):
+        os.mkdir(os.path.join(self.tmpdir.name, "conf.d"))
+        self.write("conf.d/1.conf", "Host a\n    Port 2201\n")
+        self.write("other", "Host b\n    Port 2202")
+        path = self.write(
+            "config",
+            """
+            Include {0}/conf.d/*.conf {0}/other
+            Host *
+                User default
+            """.format(
+                self.tmpdir.name
+            ),
+        )
+
+        cached = load_ssh_config(path)
+
+        self.assertEqual(cached.lookup("a")["port"], "2201")
+        self.assertEqual(cached.lookup("b")["port"], "2202")
+        self.assertEqual(cached.lookup("b")["user"], "default")
+
+        # A new file matching the glob invalidates the cache
+        self.write("conf.d/2.conf", "Host c\n    Port 2203\n")
+        os.utime(os.path.join(self.tmpdir.name, "conf.d"), ns=(0, 0))
+        self.assertEqual(load_ssh_config(path).lookup("c")["port"], "2203")
+
+    def test_cache_invalidated_by_mtime(self):
+        path = self.write("config", "Host a\n    Port 2201\n")
+
+        cached = load_ssh_config(path)
+        self.assertIs(load_ssh_config(path), cached)
+
+        self.write("config", "Host a\n    Port 2202\n")
+        os.utime(path, ns=(0, 0))
+
+        self.assertIsNot(load_ssh_config(path), cached)
+        self.assertEqual(load_ssh_config(path).lookup("a")["port"], "2202")
+
+    def test_missing_file(self):
+        cached = load_ssh_config(os.path.join(self.tmpdir.name, "missing"))
+
+        self.assertEqual(cached.lookup("a")["hostname"], "a")
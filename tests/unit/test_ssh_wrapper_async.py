@@ -0,0 +1,103 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from channel_double import ChannelDouble
+
+from sshkernel.ssh_wrapper_async import SSHWrapperAsync
+
+
+class IdleChannel(ChannelDouble):
+    """A channel which never receives data"""
+
+    def __init__(self):
+        super().__init__([], eof=False)
+        self._pipe = os.pipe()
+
+    def fileno(self):
+        return self._pipe[0]
+
+    def close(self):
+        super().close()
+        for fd in self._pipe:
+            os.close(fd)
+
+
+class SSHWrapperAsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.proc = Mock()
+        remote = MagicMock()
+        remote.__getitem__.return_value.__getitem__.return_value.popen.return_value = (
+            self.proc
+        )
+        remote.cwd.getpath.return_value._path = "/home"
+
+        instance = SSHWrapperAsync()
+        instance._remote = remote
+        instance._host = "host"
+        self.instance = instance
+
+    def test_exec_command(self):
+        marker = "1.2"
+        self.proc.channel = ChannelDouble(
+            [
+                ("stdout", b"out\n"),
+                ("stderr", b"err\n"),
+                (
+                    "stdout",
+                    "{m}\0code\0003\0pwd\0/home\0{m}\n".format(m=marker).encode(),
+                ),
+            ]
+        )
+        out, err = [], []
+
+        with patch("time.time", return_value=2.1):
+            code = self.instance.exec_command("ls", out.append, err.append)
+
+        self.assertEqual(code, 3)
+        self.assertEqual(out, ["[ssh] host = host, cwd = /home\n", "out\n"])
+        self.assertEqual(err, ["err\n"])
+
+    def test_cancel_closes_channel(self):
+        self.proc.channel = channel = IdleChannel()
+        self.proc.close.side_effect = channel.close
+
+        async def run_and_cancel():
+            task = asyncio.ensure_future(
+                self.instance.exec_command_async("sleep 10", Mock())
+            )
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(run_and_cancel())
+
+        self.assertTrue(channel.closed)
+        self.assertIsNone(self.instance.last_interrupt)
+
+    @patch("sshkernel.ssh_wrapper_plumbum.signal_remote")
+    def test_cancel_signals_cell(self, signal_remote):
+        signal_remote.return_value = dict(signal="INT", elapsed=0.1)
+        self.proc.channel = channel = IdleChannel()
+        self.proc.close.side_effect = channel.close
+        self.instance.interrupt_timeouts = (0.5, 0.5)
+
+        async def run_and_cancel():
+            task = asyncio.ensure_future(
+                self.instance.exec_command_async("sleep 10", Mock())
+            )
+            await asyncio.sleep(0.1)
+            self.instance._update_cell_header(dict(pgid="99"))
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(run_and_cancel())
+
+        self.assertEqual(self.instance.last_interrupt, dict(signal="INT", elapsed=0.1))
+        self.assertIn("-- -99", signal_remote.call_args[0][1])
+        self.assertTrue(channel.closed)
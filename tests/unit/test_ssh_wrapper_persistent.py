@@ -0,0 +1,127 @@
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from channel_double import ChannelDouble
+
+from sshkernel.ssh_wrapper_persistent import SSHWrapperPersistent
+from sshkernel.ssh_wrapper_persistent import quote
+from sshkernel.ssh_wrapper_persistent import wrap_cell
+
+
+def footer_chunks(marker, code=0, pwd="/tmp"):
+    return [
+        ("stderr", "{m}\0{m}\n".format(m=marker).encode()),
+        ("stdout", "{m}\0code\0{c}\0".format(m=marker, c=code).encode()),
+        ("stdout", "pwd\0{p}\0{m}\n".format(m=marker, p=pwd).encode()),
+    ]
+
+
+class SSHWrapperPersistentTest(unittest.TestCase):
+    def setUp(self):
+        instance = SSHWrapperPersistent()
+        instance._remote = Mock()
+        instance._SSHWrapperPlumbum__connected = True
+        instance._cwd = "/home"
+
+        self.instance = instance
+
+    def run_cell(self, chunks, marker="MARKER"):
+        self.instance._channel = ChannelDouble(chunks + footer_chunks(marker, 3))
+        print_mock = Mock()
+
+        with patch("time.time", return_value=float(marker[::-1])):
+            code = self.instance.exec_command("ls", print_mock)
+
+        return code, print_mock
+
+    def test_exec_command_return_exit_code(self):
+        code, print_mock = self.run_cell([("stdout", b"out\n")], marker="1.2")
+
+        self.assertEqual(code, 3)
+        print_mock.assert_any_call("out\n")
+        self.assertEqual(self.instance.get_cwd(), "/tmp")
+        self.assertIn(b"ls\n", self.instance._channel.sent)
+        self.assertIsNone(self.instance._pending_marker)
+
+    def test_exec_command_stops_at_footer(self):
+        marker = "1.2"
+        chunks = [("stdout", b"out"), ("stderr", b"err\n" + marker.encode())]
+        chunks += footer_chunks(marker, 0)
+        chunks[-1:] = [("stdout", b"pwd\0/\0" + marker.encode()), ("stdout", b"\n")]
+        self.instance._channel = ChannelDouble(chunks + [("stdout", b"next")])
+        print_mock = Mock()
+
+        with patch("time.time", return_value=float(marker[::-1])):
+            code = self.instance.exec_command("ls", print_mock)
+
+        self.assertEqual(code, 0)
+        print_mock.assert_any_call("out")
+        print_mock.assert_any_call("err\n")
+        self.assertEqual(self.instance._channel.chunks, [("stdout", b"next")])
+
+    def test_isconnected_follows_channel(self):
+        self.instance._channel = ChannelDouble([], eof=False)
+        self.assertTrue(self.instance.isconnected())
+
+        self.instance._channel.eof = True
+        self.assertFalse(self.instance.isconnected())
+
+    def test_footer_env_is_tracked(self):
+        marker = "1.2"
+        chunks = footer_chunks(marker)
+        chunks[-1] = (
+            "stdout",
+            "pwd\0/tmp\0sum\0001 2\0names\0ll\nf\n\0env\0A=1\0B=2\0{m}\n".format(
+                m=marker
+            ).encode(),
+        )
+        self.instance._env_login = dict(A="0", C="3", SHLVL="1", SSH_AUTH_SOCK="/a")
+        self.instance._channel = ChannelDouble(chunks)
+
+        with patch("time.time", return_value=2.1):
+            self.instance.exec_command("ls", Mock())
+
+        self.assertEqual(self.instance._env_fingerprint, "1 2")
+        self.assertEqual(self.instance._env_delta(), (dict(A="1", B="2"), {"C"}))
+        self.assertEqual(self.instance.get_session_names(), ["ll", "f"])
+
+    def test_reconnect_restores_state(self):
+        self.instance._host = "host"
+        self.instance._cwd = "/a b"
+        self.instance._env_login = dict(A="0", C="3")
+        self.instance._env_last = dict(A="1", B="2")
+        run_cell = Mock()
+
+        with patch.object(SSHWrapperPersistent, "connect") as connect, patch.object(
+            SSHWrapperPersistent, "_run_cell", run_cell
+        ):
+            self.instance.reconnect()
+
+        connect.assert_called_once_with("host")
+        script = run_cell.call_args[0][0]
+        self.assertEqual(
+            script.splitlines(),
+            ["unset C", "export A='1'", "export B='2'", "cd -- '/a b'"],
+        )
+
+    def test_close_should_close_channel(self):
+        channel = Mock()
+        self.instance._channel = channel
+        self.instance.close()
+
+        channel.close.assert_called_once()
+        self.assertFalse(self.instance.isconnected())
+
+
+class UtilityTest(unittest.TestCase):
+    def test_wrap_cell(self):
+        marker = "THISISMARKER"
+        script = wrap_cell("echo 1\necho 2", marker)
+
+        self.assertIn("\necho 1\necho 2\n{}\n".format(marker), script)
+        self.assertEqual(script.count(marker), 6)
+
+    def test_quote(self):
+        self.assertEqual(quote("a b"), "'a b'")
+        self.assertEqual(quote("it's"), "'it'\"'\"'s'")
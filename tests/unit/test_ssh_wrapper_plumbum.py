@@ -1,18 +1,21 @@
 import io
 import os
 import socket
+import subprocess
 import tempfile
 import unittest
 from textwrap import dedent
+from unittest.mock import MagicMock
 from unittest.mock import Mock
 from unittest.mock import patch
 
+from channel_double import ChannelDouble
 from plumbum.machines.paramiko_machine import ParamikoMachine
 
+from sshkernel.ssh_wrapper_plumbum import OptionsParamikoMachine
 from sshkernel.ssh_wrapper_plumbum import SSHWrapperPlumbum
 from sshkernel.ssh_wrapper_plumbum import append_footer
 from sshkernel.ssh_wrapper_plumbum import load_ssh_config_for_plumbum
-from sshkernel.ssh_wrapper_plumbum import merge_stdout_stderr
 from sshkernel.ssh_wrapper_plumbum import process_output
 
 
@@ -22,8 +25,8 @@ class SSHWrapperPlumbumTest(unittest.TestCase):
             subscriptable = Mock()
             subscriptable.popen = Mock(return_value=subscriptable)
             subscriptable.__getitem__ = Mock(return_value=subscriptable)
-            subscriptable.iter_lines = Mock(
-                return_value=([("output", None), (None, "err")])
+            subscriptable.channel = ChannelDouble(
+                [("stdout", b"output"), ("stderr", b"err")]
             )
 
             remote_double = Mock(spec=ParamikoMachine)
@@ -44,6 +47,49 @@ class SSHWrapperPlumbumTest(unittest.TestCase):
         with self.assertRaises(socket.gaierror):
             self.instance.connect("dummy")
 
+    def test_isconnected_checks_transport(self):
+        remote_double = Mock()
+        self.instance._build_remote = Mock(return_value=remote_double)
+        self.instance.connect("dummy")
+
+        transport = remote_double._client.get_transport.return_value
+        transport.is_active.return_value = True
+        self.assertTrue(self.instance.isconnected())
+
+        transport.is_active.return_value = False
+        self.assertFalse(self.instance.isconnected())
+
+    def test_reconnect_restores_state(self):
+        old_remote, new_remote = MagicMock(), MagicMock()
+        old_remote.close.side_effect = EOFError
+        old_remote.cwd.getpath.return_value._path = "/tmp"
+        new_remote.cwd.getpath.return_value._path = "/home"
+        self.instance._build_remote = Mock(side_effect=[old_remote, new_remote])
+        self.instance.connect("dummy")
+        self.instance.update_env(dict(A="1"), {"B"})
+        fingerprint = self.instance.get_env_fingerprint()
+
+        self.instance.reconnect()
+
+        self.instance._build_remote.assert_called_with("dummy")
+        new_remote.env.update.assert_called_with(dict(A="1"))
+        new_remote.cwd.chdir.assert_called_once_with("/tmp")
+        self.assertEqual(self.instance._env_removed, {"B"})
+        self.assertEqual(self.instance.get_env_fingerprint(), fingerprint)
+
+    def test_reconnect_keeps_connection_variables(self):
+        old_remote, new_remote = MagicMock(), MagicMock()
+        self.instance._build_remote = Mock(side_effect=[old_remote, new_remote])
+        self.instance.connect("dummy")
+        self.instance.update_env(dict(A="1", SSH_AUTH_SOCK="/tmp/old", OLDPWD="/"))
+        self.instance.update_env(dict(), {"SSH_TTY"})
+
+        self.instance.reconnect()
+
+        new_remote.env.update.assert_called_with(dict(A="1"))
+        new_remote.env.__delitem__.assert_not_called()
+        self.assertEqual(self.instance._env_removed, set())
+
     def test_connect_updates_attributes(self):
         remote_double = Mock()
         self.instance._build_remote = Mock(return_value=remote_double)
@@ -77,6 +123,39 @@ class SSHWrapperPlumbumTest(unittest.TestCase):
 
         self.assertIsInstance(code, int)
 
+    def test_exec_command_records_timing(self):
+        self.instance._remote.cwd.getpath.return_value._path = "/tmp"
+        proc = self.instance._remote["bash"]
+        proc.channel = ChannelDouble(
+            [
+                ("stderr", b"1.2\x00pgid\x00123\n"),
+                ("stdout", b"out\n"),
+                (
+                    "stdout",
+                    b"1.2\0rusage\0000m0.010s 0m0.020s\n0m1.000s 0m0.500s\n\0"
+                    b"code\0000\0pwd\0/tmp\0sum\0001\0" + b"1.2\n",
+                ),
+            ]
+        )
+        self.instance.rusage = True
+
+        with patch("time.time", return_value=2.1):
+            code = self.instance.exec_command("ls", Mock())
+
+        self.assertEqual(code, 0)
+        self.assertIn("times;", proc.__getitem__.call_args[0][0][1])
+
+        timing = self.instance.last_timing.to_dict()
+        self.assertEqual(
+            list(timing["phases"]),
+            ["channel_open", "bash_start", "command", "footer", "post_exec"],
+        )
+        self.assertIn("output", timing["spent"])
+        self.assertEqual(timing["bytes"]["stdout"], 78)
+        self.assertEqual(timing["bytes"]["stderr"], 13)
+        self.assertGreater(timing["bytes"]["sent"], 0)
+        self.assertEqual(timing["rusage"], dict(user=1.01, sys=0.52))
+
     def test_close_should_delegate(self):
         mock = Mock()
         self.instance._remote.close = mock
@@ -95,7 +174,69 @@ yo
         full_command = append_footer(cmd, marker)
 
         self.assertIsInstance(full_command, str)
-        self.assertEqual(full_command.count(marker), 6)
+        # header record, and two of the footer
+        self.assertEqual(full_command.count(marker), 3)
+        self.assertFalse(full_command.startswith("unset"))
+
+    def test_append_footer_with_rusage(self):
+        self.assertNotIn("times", append_footer("ls", "MARKER"))
+
+        full_command = append_footer("ls", "MARKER", rusage=True)
+        self.assertIn("printf 'rusage\\0'; times; printf '\\0'", full_command)
+        self.assertEqual(full_command.count("MARKER"), 3)
+
+    def test_append_footer_with_env_state(self):
+        full_command = append_footer("ls", "MARKER", {"B", "A", "BASH_FUNC_f%%"})
+
+        self.assertTrue(full_command.startswith("unset A B 2>/dev/null\n"))
+        self.assertNotIn("env -0", full_command)
+
+    def test_append_footer_sends_env_delta(self):
+        cell = "export NEW='a\nb'; KEEP=2; unset GONE; export SPACE='a  b'; f() { :; }"
+        env = dict(PATH=os.environ["PATH"], KEEP="1", GONE="x", SPACE="a b", SAME="1")
+
+        stdout = subprocess.run(
+            ["bash", "-c", append_footer(cell, "MARKER")],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode()
+        footer = process_output([(stdout, None)], "MARKER", Mock())
+
+        self.assertEqual(footer["unset"], "GONE")
+        self.assertEqual(footer["env"], dict(NEW="a\nb", KEEP="2", SPACE="a  b"))
+        self.assertIn("f", footer["names"].split())
+
+    def test_update_env_applies_delta(self):
+        env = dict(A="1", B="2", C="3")
+        self.instance._remote.env = env
+
+        self.instance.update_env(dict(B="20", D="4", SSH_CLIENT="x"), ["C"])
+        self.assertEqual(env, dict(A="1", B="20", D="4"))
+        self.assertEqual(self.instance._env_changed, dict(B="20", D="4"))
+        self.assertEqual(self.instance._env_removed, {"C"})
+        fingerprint = self.instance.get_env_fingerprint()
+        self.assertTrue(fingerprint)
+
+        self.instance.update_env(dict(C="5"), ["D"])
+        self.assertEqual(env, dict(A="1", B="20", C="5"))
+        self.assertEqual(self.instance._env_changed, dict(B="20", C="5"))
+        self.assertEqual(self.instance._env_removed, {"D"})
+        self.assertNotEqual(self.instance.get_env_fingerprint(), fingerprint)
+
+    def test_post_exec_applies_env_delta(self):
+        self.instance.update_workdir = Mock()
+        self.instance.update_env = Mock()
+
+        footer = dict(code=0, pwd="/", unset="B C", env=dict(A="1"))
+        code = self.instance.post_exec_command(footer)
+        self.assertEqual(code, 0)
+        self.instance.update_env.assert_called_once_with(dict(A="1"), ["B", "C"])
+
+        code = self.instance.post_exec_command(dict(code=3, pwd="/", unset="", env={}))
+        self.assertEqual(code, 3)
+        self.instance.update_env.assert_called_once()
 
     @unittest.skip("Fail to patch plumbum")
     @patch(
@@ -115,16 +256,17 @@ yo
 
         mock.assert_called_once()
 
-    @unittest.skip("Fail to patch the instance created in setUp()")
-    def test_post_exec(self, env_mock):
-        self.instance._remote.env = env_mock
-        env_out = """code: 255
-env: A=1^@B=2^@TOKEN=AAAA9B==
-pwd: /some/where
-"""
+    def test_post_exec(self):
+        self.instance._remote.env = MagicMock()
+        self.instance.update_workdir = Mock()
+        footer = dict(
+            code=255, pwd="/some/where", sum="1 2", env=dict(A="1", TOKEN="AAAA9B==")
+        )
 
-        code = self.instance.post_exec_command(env_out)
+        code = self.instance.post_exec_command(footer)
         self.assertEqual(255, code)
+        self.instance._remote.env.update.assert_called_once_with(footer["env"])
+        self.instance.update_workdir.assert_called_once_with("/some/where")
 
     @patch("sshkernel.ssh_wrapper_plumbum.SSHWrapperPlumbum")
     def test__update_interrupt_function(self, proc):
@@ -145,26 +287,40 @@ pwd: /some/where
         fn_after()
         proc.close.assert_called_once()
 
+    @patch("sshkernel.ssh_wrapper_plumbum.signal_remote")
+    def test_interrupt_signals_cell_process_group(self, signal_remote):
+        signal_remote.return_value = dict(signal="TERM", elapsed=2.1)
+        proc = Mock()
+
+        self.instance._update_interrupt_function(proc)
+        self.assertIsNone(self.instance.interrupt())
+        signal_remote.assert_not_called()
+
+        self.instance._update_cell_header(dict(pgid="4321"))
+        result = self.instance.interrupt((1.0, 3.0))
+
+        self.assertEqual(result, dict(signal="TERM", elapsed=2.1))
+        script = signal_remote.call_args[0][1]
+        self.assertIn("kill -s INT -- -4321", script)
+        self.assertIn("kill -s KILL -- -4321", script)
+        proc.close.assert_called()
+
 
 class UtilityTest(unittest.TestCase):
-    def test_merge_stdout_stderr(self):
-        lines = [
-            ("a", None),
-            ("b\n", None),
-            (None, "c"),
-            ("d", None),
-        ]
+    def test_options_paramiko_machine_connects_with_options(self):
+        client = Mock()
+        connect = client.connect
 
-        def outs():
-            for line in lines:
-                yield line
+        def init(machine, host, **kwargs):
+            # As ParamikoMachine.__init__
+            machine._client = client
+            machine._client.connect(host, port=22)
 
-        merged = merge_stdout_stderr(outs())
-        lines = list(merged)
+        with patch.object(ParamikoMachine, "__init__", init):
+            remote = OptionsParamikoMachine("h", dict(compress=True))
 
-        self.assertEqual(len(lines), 4)
-        for line in lines:
-            self.assertIsNotNone(line)
+        connect.assert_called_once_with("h", port=22, compress=True)
+        self.assertIs(remote._client, client)
 
     def test_process_output_with_newline(self):
         marker = "MARKER"
@@ -173,8 +329,7 @@ class UtilityTest(unittest.TestCase):
             lines = io.StringIO(
                 """line1
 line2
-{marker}code: 0{marker}
-{marker}pwd: /tmp{marker}
+{marker}\0code\0000\0pwd\0/tmp\0{marker}
 """.format(
                     marker=marker
                 )
@@ -186,9 +341,10 @@ line2
         print_function = Mock()
 
         env_info = process_output(iterator, marker, print_function)
-        env_info_expected = "code: 0\npwd: /tmp\n"
+        env_info_expected = dict(code=0, pwd="/tmp")
 
         self.assertEqual(env_info, env_info_expected)
+        self.assertEqual(print_function.call_count, 2)
         print_function.assert_any_call("line1\n")
         print_function.assert_any_call("line2\n")
 
@@ -199,8 +355,8 @@ line2
             lines = io.StringIO(
                 """line1
 line2
-line3{marker}code: 0{marker}
-{marker}pwd: /tmp{marker}
+line3{marker}\0code\0000\0pwd\0/tmp\0env\0A=1\0B=x
+y\0{marker}
 """.format(
                     marker=marker
                 )
@@ -215,7 +371,92 @@ line3{marker}code: 0{marker}
         print_function.assert_any_call("line1\n")
         print_function.assert_any_call("line2\n")
         print_function.assert_any_call("line3")  # without newline
-        self.assertEqual(env_info, "code: 0\npwd: /tmp\n")
+        self.assertEqual(print_function.call_count, 3)
+        self.assertEqual(env_info, dict(code=0, pwd="/tmp", env=dict(A="1", B="x\ny")))
+
+    def test_process_output_without_footer(self):
+        print_function = Mock()
+        iterator = iter([("out\n", None), (None, "err\n"), ("MAR", None)])
+
+        env_info = process_output(iterator, "MARKER", print_function)
+
+        self.assertIsNone(env_info)
+        print_function.assert_any_call("err\n")
+        print_function.assert_any_call("MAR")
+
+    def test_process_output_separates_stderr(self):
+        print_function = Mock()
+        error_function = Mock()
+        iterator = iter(
+            [("out\n", None), (None, "err\n"), ("MARKER\0code\0003\0MARKER\n", None)]
+        )
+
+        env_info = process_output(iterator, "MARKER", print_function, error_function)
+
+        self.assertEqual(env_info, dict(code=3))
+        print_function.assert_called_once_with("out\n")
+        error_function.assert_called_once_with("err\n")
+
+    def test_process_output_reads_header(self):
+        print_function = Mock()
+        error_function = Mock()
+        header_function = Mock()
+        iterator = iter(
+            [
+                (None, "MAR"),
+                (None, "KER\0pgid\0"),
+                (None, "123\nerr\n"),
+                ("MARKER\0code\0000\0MARKER\n", None),
+            ]
+        )
+
+        env_info = process_output(
+            iterator,
+            "MARKER",
+            print_function,
+            error_function,
+            header_function=header_function,
+        )
+
+        self.assertEqual(env_info, dict(code=0))
+        header_function.assert_called_once_with(dict(pgid="123"))
+        error_function.assert_called_once_with("err\n")
+
+    def test_process_output_without_header(self):
+        error_function = Mock()
+        header_function = Mock()
+        iterator = iter(
+            [(None, "MA"), (None, "IL\n"), ("MARKER\0code\0000\0MARKER\n", None)]
+        )
+
+        process_output(
+            iterator, "MARKER", Mock(), error_function, header_function=header_function
+        )
+
+        header_function.assert_not_called()
+        error_function.assert_called_once_with("MAIL\n")
+
+    def test_process_output_reads_header_after_other_lines(self):
+        error_function = Mock()
+        header_function = Mock()
+        iterator = iter(
+            [
+                (None, "bashrc: warning\n"),
+                (None, "a MARKER\0 b\nMAR"),
+                (None, "KER\0pgid\x00123\nerr\n"),
+                ("MARKER\0code\0000\0MARKER\n", None),
+            ]
+        )
+
+        process_output(
+            iterator, "MARKER", Mock(), error_function, header_function=header_function
+        )
+
+        header_function.assert_called_once_with(dict(pgid="123"))
+        self.assertEqual(
+            "".join(c.args[0] for c in error_function.call_args_list),
+            "bashrc: warning\na MARKER\0 b\nerr\n",
+        )
 
     def test_load_ssh_config_for_plumbum(self):
         skip = "skip_dict_equality_test"
@@ -287,6 +528,21 @@ line3{marker}code: 0{marker}
             ),
         ]
 
+        with tempfile.NamedTemporaryFile("w") as f:
+            f.write(
+                dedent(
+                    """
+                    Host test
+                        Compression yes
+                        Ciphers ^aes256-ctr
+                    """
+                )
+            )
+            f.seek(0)
+            got = load_ssh_config_for_plumbum(f.name, "test")
+
+        self.assertEqual(got[3], dict(compression="yes", ciphers="^aes256-ctr"))
+
         case_raises = dedent(
             """
             Host test
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from sshkernel.startup import format_profile
+from sshkernel.startup import parse_importtime
+from sshkernel.startup import time_to_kernel_info
+
+# Seconds from launching `python -m sshkernel` to the kernel_info reply
+STARTUP_BUDGET = float(os.environ.get("SSHKERNEL_STARTUP_BUDGET", "5.0"))
+
+
+class StartupTest(unittest.TestCase):
+    def test_parse_importtime(self):
+        text = "\n".join(
+            [
+                "import time: self [us] | cumulative | imported package",
+                "import time:       500 |        500 |     paramiko.util",
+                "import time:      1500 |       2000 |   paramiko",
+                "import time:      1000 |       3000 | sshkernel",
+                "unrelated",
+            ]
+        )
+
+        packages = parse_importtime(text)
+
+        self.assertEqual(packages, dict(paramiko=0.002, sshkernel=0.001))
+
+    def test_format_profile(self):
+        packages = dict(a=0.003, b=0.002, paramiko=0.001)
+
+        text = format_profile(packages, top=1)
+
+        self.assertIn("a                             3.0ms", text)
+        self.assertIn("(2 others)                    3.0ms", text)
+        self.assertIn("total                         6.0ms", text)
+        self.assertIn("[ssh] imported at startup: paramiko", text)
+
+    def test_ssh_stack_is_not_imported_at_startup(self):
+        code = (
+            "import sys\n"
+            "from sshkernel.kernel import SSHKernel\n"
+            "SSHKernel()\n"
+            "print(' '.join(m for m in ('paramiko', 'plumbum') if m in sys.modules))\n"
+        )
+
+        out = subprocess.check_output(
+            [sys.executable, "-W", "ignore", "-c", code],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+
+        self.assertEqual(out.strip(), "")
+
+    def test_time_to_kernel_info(self):
+        elapsed = time_to_kernel_info()
+
+        self.assertLess(elapsed, STARTUP_BUDGET)
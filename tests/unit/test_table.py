@@ -0,0 +1,108 @@
+import unittest
+
+from sshkernel.table import Table
+from sshkernel.table import TableParser
+from sshkernel.table import detect_format
+
+
+def parse(chunks, **kwargs):
+    parser = TableParser(**kwargs)
+    for chunk in chunks:
+        parser.feed(chunk)
+
+    return parser.close()
+
+
+class TableParserTest(unittest.TestCase):
+    def test_csv_in_chunks(self):
+        table = parse(["pid,cpu,na", "me\n1,0.5,", 'bash\n2,1,"a, b"\n', "3,2.5,x"])
+
+        self.assertEqual(table.columns, ["pid", "cpu", "name"])
+        self.assertEqual(
+            table.to_dict(),
+            dict(pid=[1, 2, 3], cpu=[0.5, 1.0, 2.5], name=["bash", "a, b", "x"]),
+        )
+        self.assertEqual(table._columns["pid"].kind, "int")
+        self.assertEqual(table._columns["cpu"].kind, "float")
+
+    def test_whitespace(self):
+        table = parse(
+            [
+                "[ssh] host = h, cwd = /\n",
+                "Filesystem  Size  Used Avail Use% Mounted on\r\n",
+                "/dev/sda1    20G     0   15G  25% /\n",
+                "tmpfs       1.0G    0  1.0G   0% /dev/shm\n\n",
+            ],
+            comment="[ssh] ",
+        )
+
+        self.assertEqual(
+            table.columns, ["Filesystem", "Size", "Used", "Avail", "Use%", "Mounted on"]
+        )
+        self.assertEqual(
+            list(table.rows(1)), [("tmpfs", "1.0G", 0, "1.0G", "0%", "/dev/shm")]
+        )
+
+    def test_last_column_takes_the_rest(self):
+        table = parse(["PID CMD\n1 /sbin/init splash\n"], fmt="ws")
+
+        self.assertEqual(table.column("CMD"), ["/sbin/init splash"])
+
+    def test_text_column(self):
+        table = parse(["a\tb\n1\t007\n2\t8\n", "x\t9\n"])
+
+        self.assertEqual(table.to_dict(), dict(a=["1", "2", "x"], b=["007", "8", "9"]))
+
+    def test_jsonl(self):
+        table = parse(['{"a": 1, "b": "7"}\n{"c": [1], "a": 2.5}\n[3]\n'])
+
+        self.assertEqual(
+            table.to_dict(),
+            dict(a=[1.0, 2.5, 3.0], b=["7", None, None], c=[None, "[1]", None]),
+        )
+
+    def test_no_header(self):
+        table = parse(["1 2\n3 4 5\n"], header=False)
+
+        # A column with missing values is kept as text
+        self.assertEqual(table.to_dict(), {"1": [1, 3], "2": [2, 4], "3": [None, "5"]})
+
+    def test_max_rows(self):
+        table = parse(["n\n1\n2\n", "3\n4\n"], max_rows=3)
+
+        self.assertEqual(table.column("n"), [1, 2, 3])
+        self.assertEqual(table.dropped, 1)
+        self.assertEqual(repr(table), "<Table 3 rows x 1 columns, 1 rows dropped>")
+
+    def test_header_only(self):
+        table = parse(["a,b\n"])
+
+        self.assertEqual((table.columns, len(table)), (["a", "b"], 0))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            TableParser("xml")
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('{"a": 1}'), "jsonl")
+        self.assertEqual(detect_format("a\tb"), "tsv")
+        self.assertEqual(detect_format("a,b"), "csv")
+        self.assertEqual(detect_format("[a] b"), "ws")
+
+
+class TableTest(unittest.TestCase):
+    def test_duplicate_names(self):
+        table = Table(["a", "a"])
+
+        self.assertEqual(table.columns, ["a", "a_2"])
+
+    def test_to_html(self):
+        table = Table(["<x>"])
+        table.extend([["1"], ["2"], ["3"]], text=True)
+
+        text = table.to_html(max_rows=2)
+
+        self.assertIn("<th>&lt;x&gt;</th>", text)
+        self.assertIn("<tr><td>2</td></tr>", text)
+        self.assertNotIn("<td>3</td>", text)
+        self.assertIn("3 rows x 1 columns, first 2 shown", text)
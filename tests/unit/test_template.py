@@ -0,0 +1,54 @@
+import unittest
+
+from sshkernel.template import HOST_PLACEHOLDER
+from sshkernel.template import compile_template
+from sshkernel.template import render
+
+
+class TemplateTest(unittest.TestCase):
+    def test_compile(self):
+        template = compile_template("a{X}b{{Y}}c{Z}")
+
+        self.assertEqual(template.literals, ["a", "b{Y}c", ""])
+        self.assertEqual(template.names, ["X", "Z"])
+        self.assertIs(compile_template("a{X}b{{Y}}c{Z}"), template)
+
+    def test_render(self):
+        params = dict(HOST="node01", N="3")
+
+        self.assertEqual(render("ping -c {N} {HOST}", params), "ping -c 3 node01")
+        self.assertEqual(render("{N}{N}", params), "33")
+        self.assertEqual(render("no placeholder", params), "no placeholder")
+
+    def test_shell_syntax_is_kept(self):
+        params = dict(HOME="/param", a="x", b="y")
+        cases = [
+            "echo ${HOME}",
+            "echo {a,b} {1..3}",
+            "find . -exec rm {} +",
+            "f() { echo; }",
+            "awk '{ print $1 }'",
+            "echo {YO",
+        ]
+
+        for text in cases:
+            self.assertEqual(render(text, params), text)
+
+    def test_escape(self):
+        self.assertEqual(render("{{N}} {N}", dict(N="1")), "{N} 1")
+
+    def test_host_pattern(self):
+        params = {"host-name": "a", "B": "b"}
+
+        self.assertEqual(
+            render("{host-name}.{B}", params, pattern=HOST_PLACEHOLDER), "a.b"
+        )
+        # No escape in hosts, "{B" is a name
+        with self.assertRaises(KeyError):
+            render("{{B}}", params, strict=True, pattern=HOST_PLACEHOLDER)
+
+    def test_missing(self):
+        self.assertEqual(render("{A} {B}", dict(A="1")), "1 {B}")
+
+        with self.assertRaises(KeyError):
+            render("{A} {B}", dict(A="1"), strict=True)
@@ -0,0 +1,93 @@
+import unittest
+
+from sshkernel.timing import CellTimer
+from sshkernel.timing import format_timing
+from sshkernel.timing import parse_times
+
+
+class ClockDouble:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CellTimerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = ClockDouble()
+        self.timer = CellTimer(clock=self.clock)
+
+    def test_mark(self):
+        self.clock.now = 0.5
+        self.timer.mark("open")
+        self.clock.now = 2.0
+        self.timer.mark("command")
+        self.timer.count("stdout", 10)
+        self.timer.count("stdout", 5)
+
+        self.assertEqual(
+            self.timer.to_dict(),
+            dict(
+                total=2.0,
+                phases=dict(open=0.5, command=1.5),
+                spent=dict(),
+                bytes=dict(stdout=15),
+            ),
+        )
+
+    def test_timed(self):
+        def callback(text):
+            self.clock.now += 0.25
+            return text
+
+        timed = self.timer.timed("output", callback)
+
+        self.assertEqual(timed("a"), "a")
+        timed("b")
+        self.assertEqual(self.timer.spent, dict(output=0.5))
+
+    def test_merge(self):
+        self.clock.now = 1.0
+        self.timer.mark("prepare")
+
+        other = CellTimer(clock=self.clock)
+        self.clock.now = 3.0
+        other.mark("command")
+        other.count("sent", 7)
+        other.rusage = dict(user=0.1, sys=0.2)
+
+        self.timer.merge(other)
+        self.clock.now = 3.5
+        self.timer.mark("flush")
+
+        timing = self.timer.to_dict()
+        self.assertEqual(list(timing["phases"]), ["prepare", "command", "flush"])
+        self.assertEqual(timing["phases"]["flush"], 0.5)
+        self.assertEqual(timing["total"], 3.5)
+        self.assertEqual(timing["bytes"], dict(sent=7))
+        self.assertEqual(timing["rusage"], dict(user=0.1, sys=0.2))
+
+
+class UtilityTest(unittest.TestCase):
+    def test_parse_times(self):
+        text = "0m0.010s 0m0.020s\n1m1.000s 0m0.500s\n"
+
+        self.assertEqual(parse_times(text), dict(user=61.01, sys=0.52))
+        self.assertIsNone(parse_times(None))
+        self.assertIsNone(parse_times("times: not found"))
+
+    def test_format_timing(self):
+        timing = dict(
+            total=1.5,
+            phases=dict(channel_open=0.0123, command=1.4),
+            spent=dict(output=0.002),
+            bytes=dict(stdout=10, sent=5),
+            rusage=dict(user=0.25, sys=0.125),
+        )
+
+        self.assertEqual(
+            format_timing(timing),
+            "[ssh] timing: total 1.500s | channel_open 12.3ms, command 1.400s"
+            " | output 2.0ms | sent 5B, stdout 10B | user 0.250s, sys 0.125s",
+        )
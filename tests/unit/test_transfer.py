@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sshkernel.transfer import LocalFiles
+from sshkernel.transfer import Transfer
+from sshkernel.transfer import TransferResult
+from sshkernel.transfer import format_bytes
+from sshkernel.transfer import format_transfer
+
+CHUNK = 1024
+
+
+class BrokenFiles(LocalFiles):
+    """Fails to read the chunk at `offset`."""
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def read_blocks(self, f, offset, length):
+        if offset == self.offset:
+            raise IOError("connection lost")
+
+        return super().read_blocks(f, offset, length)
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, "src.bin")
+        self.dst = os.path.join(self.dir, "dst.bin")
+        self.data = os.urandom(CHUNK * 5 + 100)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_run(self):
+        transfer = Transfer(LocalFiles, LocalFiles, streams=3, chunk_size=CHUNK)
+
+        result = transfer.run(self.src, self.dst)
+
+        self.assertEqual(self.read(self.dst), self.data)
+        self.assertEqual(result.size, len(self.data))
+        self.assertEqual(result.resumed, 0)
+        self.assertEqual(result.streams, 3)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["dst.bin", "src.bin"])
+
+    def test_run_to_directory(self):
+        os.mkdir(os.path.join(self.dir, "out"))
+        transfer = Transfer(LocalFiles, LocalFiles, chunk_size=CHUNK)
+
+        result = transfer.run(self.src, os.path.join(self.dir, "out"))
+
+        self.assertEqual(result.destination, os.path.join(self.dir, "out", "src.bin"))
+        self.assertEqual(self.read(result.destination), self.data)
+
+    def test_run_empty_file(self):
+        open(self.src, "wb").close()
+        transfer = Transfer(LocalFiles, LocalFiles, chunk_size=CHUNK)
+
+        result = transfer.run(self.src, self.dst)
+
+        self.assertEqual(self.read(self.dst), b"")
+        self.assertEqual(result.streams, 1)
+
+    def test_failed_transfer_is_resumed(self):
+        failing = Transfer(
+            lambda: BrokenFiles(CHUNK * 3), LocalFiles, streams=1, chunk_size=CHUNK
+        )
+        with self.assertRaises(IOError):
+            failing.run(self.src, self.dst)
+
+        self.assertFalse(os.path.exists(self.dst))
+        with open(self.dst + ".part.json") as f:
+            self.assertEqual(json.load(f)["done"], [0, 1, 2])
+
+        # Chunks recorded as done are not read again
+        transfer = Transfer(
+            lambda: BrokenFiles(0), LocalFiles, streams=2, chunk_size=CHUNK
+        )
+        result = transfer.run(self.src, self.dst)
+
+        self.assertEqual(self.read(self.dst), self.data)
+        self.assertEqual(result.resumed, CHUNK * 3)
+        self.assertFalse(os.path.exists(self.dst + ".part.json"))
+
+    def test_changed_source_is_not_resumed(self):
+        failing = Transfer(
+            lambda: BrokenFiles(CHUNK * 3), LocalFiles, streams=1, chunk_size=CHUNK
+        )
+        with self.assertRaises(IOError):
+            failing.run(self.src, self.dst)
+
+        self.data = self.data[:-1]
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+        result = Transfer(LocalFiles, LocalFiles, chunk_size=CHUNK).run(
+            self.src, self.dst
+        )
+
+        self.assertEqual(result.resumed, 0)
+        self.assertEqual(self.read(self.dst), self.data)
+
+    def test_restart(self):
+        failing = Transfer(
+            lambda: BrokenFiles(CHUNK * 3), LocalFiles, streams=1, chunk_size=CHUNK
+        )
+        with self.assertRaises(IOError):
+            failing.run(self.src, self.dst)
+
+        result = Transfer(LocalFiles, LocalFiles, chunk_size=CHUNK).run(
+            self.src, self.dst, restart=True
+        )
+
+        self.assertEqual(result.resumed, 0)
+        self.assertEqual(self.read(self.dst), self.data)
+
+
+class FormatTest(unittest.TestCase):
+    def test_format_transfer(self):
+        result = TransferResult("a", "b", 3000000, 1000000, 2.0, 1)
+
+        self.assertEqual(
+            format_transfer("downloaded", result),
+            "[ssh] downloaded a -> b: 2.0 MB in 2.00s (1.0 MB/s, 1 stream, "
+            "resumed after 1.0 MB)",
+        )
+
+    def test_format_bytes(self):
+        self.assertEqual(format_bytes(999), "999 B")
+        self.assertEqual(format_bytes(1500), "1.5 KB")
+        self.assertEqual(format_bytes(2.5e12), "2.5 TB")
+        self.assertEqual(format_bytes(2.5e15), "2500.0 TB")
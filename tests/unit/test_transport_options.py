@@ -0,0 +1,116 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from sshkernel.transport_options import apply_transport_options
+from sshkernel.transport_options import connect_options
+from sshkernel.transport_options import select_algorithms
+from sshkernel.transport_options import transport_options
+
+SUPPORTED = ("aes128-ctr", "aes256-ctr", "aes128-gcm@openssh.com", "3des-cbc")
+CURRENT = ("aes128-ctr", "aes256-ctr", "aes128-gcm@openssh.com")
+
+
+class TransportDouble:
+    def __init__(self):
+        self.security = SimpleNamespace(
+            ciphers=CURRENT, digests=("hmac-sha2-256",), kex=("curve25519-sha256",)
+        )
+        self._cipher_info = dict.fromkeys(SUPPORTED)
+        self._mac_info = dict.fromkeys(["hmac-sha2-256", "hmac-sha1"])
+        self._kex_info = dict.fromkeys(["curve25519-sha256"])
+        self.local_cipher = "aes128-ctr"
+        self.local_mac = "hmac-sha2-256"
+        self.local_compression = "none"
+        self.disabled_algorithms = dict()
+        self.use_compression = Mock()
+        self.renegotiate_keys = Mock()
+
+    def get_security_options(self):
+        return self.security
+
+
+class TransportOptionsTest(unittest.TestCase):
+    def test_transport_options(self):
+        lookup = dict(hostname="h", compression="yes", ciphers="aes128-ctr", macs="")
+
+        self.assertEqual(
+            transport_options(lookup), dict(compression="yes", ciphers="aes128-ctr")
+        )
+
+    def test_select_algorithms(self):
+        cases = [
+            ("aes256-ctr,chacha20-poly1305@openssh.com", ("aes256-ctr",)),
+            ("+3des-cbc,aes128-ctr", CURRENT + ("3des-cbc",)),
+            ("-aes128-ctr", ("aes256-ctr", "aes128-gcm@openssh.com")),
+            (
+                "^aes128-gcm@openssh.com",
+                ("aes128-gcm@openssh.com", "aes128-ctr", "aes256-ctr"),
+            ),
+        ]
+        for spec, expected in cases:
+            self.assertEqual(select_algorithms(spec, CURRENT, SUPPORTED), expected)
+
+        with self.assertRaises(ValueError):
+            select_algorithms("chacha20-poly1305@openssh.com", CURRENT, SUPPORTED)
+
+    def test_connect_options(self):
+        transport_class = SimpleNamespace(
+            _preferred_ciphers=CURRENT,
+            _preferred_macs=("hmac-sha2-256", "hmac-sha1"),
+            _preferred_kex=("curve25519-sha256",),
+            _cipher_info=dict.fromkeys(SUPPORTED),
+            _mac_info=dict.fromkeys(["hmac-sha2-256", "hmac-sha1"]),
+            _kex_info=dict.fromkeys(["curve25519-sha256"]),
+        )
+
+        kwargs = connect_options(
+            dict(compression="yes", ciphers="aes256-ctr", macs="^hmac-sha1"),
+            transport_class,
+        )
+
+        self.assertEqual(
+            kwargs,
+            dict(
+                disabled_algorithms=dict(
+                    ciphers=["aes128-ctr", "aes128-gcm@openssh.com"], macs=[]
+                ),
+                compress=True,
+            ),
+        )
+        self.assertEqual(connect_options(dict(macs="^hmac-sha1"), transport_class), {})
+
+    def test_apply_transport_options(self):
+        transport = TransportDouble()
+
+        negotiated = apply_transport_options(
+            transport, dict(compression="yes", ciphers="^aes256-ctr")
+        )
+
+        self.assertEqual(
+            transport.security.ciphers,
+            ("aes256-ctr", "aes128-ctr", "aes128-gcm@openssh.com"),
+        )
+        transport.use_compression.assert_called_once_with(True)
+        transport.renegotiate_keys.assert_called_once_with()
+        self.assertEqual(negotiated["cipher"], "aes128-ctr")
+
+    def test_apply_unchanged_options(self):
+        transport = TransportDouble()
+
+        negotiated = apply_transport_options(
+            transport, dict(compression="no", macs="hmac-sha2-256")
+        )
+
+        self.assertIsNone(negotiated)
+        transport.use_compression.assert_not_called()
+        transport.renegotiate_keys.assert_not_called()
+
+    def test_apply_disabled_options(self):
+        transport = TransportDouble()
+        transport.disabled_algorithms = dict(ciphers=["aes128-ctr"])
+
+        negotiated = apply_transport_options(transport, dict(ciphers="-aes128-ctr"))
+
+        self.assertIsNone(negotiated)
+        transport.renegotiate_keys.assert_not_called()